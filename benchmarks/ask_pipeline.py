@@ -0,0 +1,487 @@
+# Benchmarks and load tests for the /ask pipeline on synthetic knowledge bases
+##### benchmarks/ask_pipeline.py #####
+"""Measure the /ask pipeline on synthetic corpora.
+
+    python -m benchmarks.ask_pipeline run --sizes 1000 10000 100000 --concurrency 1 8 32
+    python -m benchmarks.ask_pipeline compare benchmarks/results/old.json benchmarks/results/new.json
+
+Each corpus size runs in a fresh process inside a temporary directory, with
+its own generated document store, config.yaml, embedding cache and index, so
+nothing in data/ or embeddings/ is touched. Per size it records:
+
+  build        time to load documents and build the index (cold, then again
+               from cached vectors), index and process memory
+  stages       latency percentiles of encode, index search, result lookup,
+               retrieval, filtering, formatting, the whole answer, and
+               WhatsApp/email sends to local fake Twilio/SMTP servers
+  concurrency  QPS and latency with N threads calling the answer path
+  delivery     messages/sec through the delivery queue to the fake servers
+
+Results are written as JSON (default benchmarks/results/ask-<time>.json).
+--backend hashing replaces the embedding model with a fast bag-of-words
+hash, to size the index and pipeline for corpora too large to encode with
+the real model on the benchmark machine.
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+TOPICS = [
+    "roth ira", "401k", "brokerage account", "wire transfer", "mutual fund", "savings account",
+    "credit card", "mortgage", "student loan", "tax return", "dividend", "index fund",
+    "financial advisor", "password reset", "mobile app", "account fees", "withdrawal",
+    "direct deposit", "beneficiary", "estate planning", "bond ladder", "margin account",
+]
+ACTIONS = [
+    "open", "close", "transfer", "withdraw from", "contribute to", "update", "link",
+    "cancel", "review", "rebalance", "report", "set up",
+]
+FILLER = (
+    "our clients can manage this online or with an advisor fees may apply depending on the "
+    "account type and balance processing usually takes one to three business days contact "
+    "support if you need help with documents limits or eligibility requirements"
+).split()
+
+
+# --- Synthetic data -------------------------------------------------------
+
+def synthetic_items(count, seed=0):
+    """Yield count FAQ and article items about a fixed set of financial topics"""
+    rng = random.Random(seed)
+    for doc_id in range(count):
+        topic = rng.choice(TOPICS)
+        action = rng.choice(ACTIONS)
+        body = " ".join(rng.choice(FILLER) for _ in range(rng.randint(20, 60)))
+        if doc_id % 2 == 0:
+            question = f"How do I {action} my {topic} ({doc_id})?"
+            text = f"Q: {question}\nA: To {action} your {topic}, {body}."
+            yield {"id": doc_id, "text": text, "source": "FAQ"}
+        else:
+            title = f"{topic.title()}: how to {action} it ({doc_id})"
+            yield {"id": doc_id, "text": f"{title}\n{body}.", "source": "Help Article"}
+
+
+def synthetic_queries(count, seed=1):
+    """Questions about the corpus topics, plus some unrelated ones that hit the fallback"""
+    rng = random.Random(seed)
+    queries = []
+    for number in range(count):
+        if number % 10 == 9:
+            queries.append(f"What is the weather like on day {number}?")
+        else:
+            queries.append(f"How can I {rng.choice(ACTIONS)} a {rng.choice(TOPICS)}? ({number})")
+    return queries
+
+
+class HashingBackend:
+    """Bag-of-words embedding from hashed words: no model, roughly lexical similarity"""
+
+    name = "hashing"
+    buckets = 4096
+
+    def __init__(self, model_name=None, models_dir=None, dimension=384):
+        self.model_name = model_name
+        self._dimension = dimension
+        rng = np.random.default_rng(0)
+        self.table = rng.standard_normal((self.buckets, dimension)).astype(np.float32)
+
+    @property
+    def dimension(self):
+        return self._dimension
+
+    def encode(self, texts, batch_size=32):
+        embeddings = np.zeros((len(texts), self._dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = text.lower().split()
+            if words:
+                rows = [zlib.crc32(word.encode()) % self.buckets for word in words]
+                embeddings[row] = self.table[rows].sum(axis=0)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.clip(norms, 1e-12, None)
+
+    def encode_one(self, text):
+        return self.encode([text])[0]
+
+
+# --- Measurement helpers --------------------------------------------------
+
+def summarize(samples):
+    """Latency percentiles in milliseconds for a list of durations in seconds"""
+    if not samples:
+        return None
+    ms = np.asarray(samples) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def timed(samples, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+def rss_mb():
+    """Current resident memory of this process in MB (peak where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- One corpus size, in its own process ----------------------------------
+
+def benchmark_config(options):
+    return {
+        "server": {"warm_up": "lazy"},
+        "logging": {"level": "WARNING" if options["quiet"] else "DEBUG"},
+        "batching": {"enabled": options["batching"]},
+        "retrieval": {"mode": options["mode"]},
+        # Every query goes through the whole pipeline, near-duplicates included
+        "response_cache": {"enabled": False, "semantic": {"enabled": False}},
+        "knowledge_base": {
+            "embedding_model": options["model"],
+            "embedding_backend": options["backend"],
+            "models_dir": os.path.join(REPO_ROOT, "models"),
+            "query_cache_size": 0,  # Measure encoding, not the query embedding cache
+            "index": {"type": options["index"]},
+        },
+        "integrations": {"whatsapp": {"enabled": False}, "email": {"enabled": False}},
+    }
+
+
+def run_size(size, options):
+    """Build a corpus of size items in a temporary directory and measure it; returns a result dict"""
+    with tempfile.TemporaryDirectory(prefix="fin-ai-bench-") as workdir:
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(1) as pool:
+            return pool.apply(_measure_size, (size, options, workdir))
+
+
+def _measure_size(size, options, workdir):
+    import yaml
+
+    os.chdir(workdir)
+    os.makedirs("data")
+    with open("config.yaml", "w") as f:
+        yaml.safe_dump(benchmark_config(options), f)
+    os.environ["FIN_AI_CONFIG"] = os.path.join(workdir, "config.yaml")
+    sys.path.insert(0, REPO_ROOT)
+
+    from src.document_store import DocumentStoreWriter
+    from src.embedding_backends import BACKENDS
+
+    BACKENDS.setdefault(HashingBackend.name, HashingBackend)
+    start = time.perf_counter()
+    with DocumentStoreWriter("data/knowledge_base.jsonl") as writer:
+        for item in synthetic_items(size, seed=options["seed"]):
+            writer.add(item)
+    generate_seconds = time.perf_counter() - start
+
+    # Keep anything the pipeline writes to stdout out of the benchmark's own output
+    log = io.StringIO() if options["quiet"] else sys.stdout
+    with contextlib.redirect_stdout(log):
+        return _measure_pipeline(size, options, generate_seconds)
+
+
+def _measure_pipeline(size, options, generate_seconds):
+    from src import knowledge_base as kb
+    from src.delivery import DeliveryQueue
+    from benchmarks.fake_servers import FakeSMTPServer, FakeTwilioServer
+    from src.fin_engine import fin_ai
+    from src.integrations import SMTPPool, TwilioWhatsAppSender
+    from src.main import answer_query
+    from src.retrieval import retrieve_relevant_data
+    from email.mime.text import MIMEText
+
+    rss_before = rss_mb()
+    build = {"generate_seconds": generate_seconds}
+    start = time.perf_counter()
+    kb.get_embedding_model()
+    build["model_load_seconds"] = time.perf_counter() - start
+    start = time.perf_counter()
+    kb.initialize()
+    build["load_and_index_seconds"] = time.perf_counter() - start
+    start = time.perf_counter()
+    index = kb.create_index(force=True)  # Vectors now come from the embedding cache
+    build["index_build_seconds"] = time.perf_counter() - start
+    build["indexed_vectors"] = int(index.ntotal)
+    build["index_file_mb"] = os.path.getsize(kb.index_path) / 2**20
+    memory = {"rss_mb_before_load": rss_before, "rss_mb_after_load": rss_mb()}
+
+    queries = synthetic_queries(options["queries"], seed=options["seed"] + 1)
+    k = 3
+    stages = {name: [] for name in (
+        "encode", "index_search", "result_lookup", "retrieve", "filter", "format", "answer",
+    )}
+    for query in queries[: options["warmup"]]:
+        answer_query(query)
+    for query in queries:
+        vector = timed(stages["encode"], kb.embed_queries, [query])
+        distances, indices = timed(stages["index_search"], index.search, vector, k)
+        timed(stages["result_lookup"], kb._results, distances[0], indices[0], k)
+        context = timed(stages["retrieve"], retrieve_relevant_data, query)
+        if options["mode"] == "hybrid":
+            relevant = timed(stages["filter"], fin_ai._filter_by_relevance, context)
+        else:
+            relevant = timed(stages["filter"], fin_ai._filter_by_vector_relevance, context)
+        if relevant:
+            timed(stages["format"], fin_ai._format_combined_response, query, relevant)
+        timed(stages["answer"], answer_query, query)
+
+    # Channel sends to local fake servers: connection reuse and protocol cost, not the network
+    with FakeTwilioServer() as twilio, FakeSMTPServer() as smtp:
+        sender = TwilioWhatsAppSender("ACbench", "token", "+15550000000", api_base_url=twilio.url)
+        pool = SMTPPool(smtp.host, smtp.port, sender="bench@example.com", use_tls=False)
+        stages["send_whatsapp"], stages["send_email"] = [], []
+        response = answer_query(queries[0])
+        for _ in range(options["sends"]):
+            timed(stages["send_whatsapp"], sender.send, "+15551234567", response)
+            message = MIMEText(response)
+            timed(stages["send_email"], pool.send, "user@example.com", message)
+
+        def send(channel, text, recipient):
+            if channel == "whatsapp":
+                return sender.send(recipient, text)
+            return pool.send(recipient, MIMEText(text))
+
+        queue = DeliveryQueue(send, workers=options["delivery_workers"])
+        start = time.perf_counter()
+        ids = [queue.submit("whatsapp" if i % 2 else "email", response, "+15551234567" if i % 2
+                            else "user@example.com") for i in range(options["sends"])]
+        while queue.pending_count:
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        delivered = sum(queue.status(delivery_id)["status"] == "delivered" for delivery_id in ids)
+        queue.stop()
+        sender.close()
+        pool.close()
+    delivery = {
+        "workers": options["delivery_workers"],
+        "messages": len(ids),
+        "delivered": delivered,
+        "messages_per_second": len(ids) / elapsed if elapsed > 0 else None,
+    }
+
+    concurrency = [_load_test(answer_query, queries, workers, options["duration"])
+                   for workers in options["concurrency"]]
+    memory["rss_mb_after_queries"] = rss_mb()
+    memory["peak_rss_mb"] = peak_rss_mb()
+
+    return {
+        "size": size,
+        "documents": len(kb.documents),
+        "build": build,
+        "memory": memory,
+        "stages": {name: summarize(samples) for name, samples in stages.items()},
+        "concurrency": concurrency,
+        "delivery": delivery,
+    }
+
+
+def _load_test(answer, queries, workers, duration):
+    """Call answer from `workers` threads for `duration` seconds; return QPS and latency"""
+    latencies = [[] for _ in range(workers)]
+    errors = [0] * workers
+    deadline = time.perf_counter() + duration
+    barrier = threading.Barrier(workers)
+
+    def worker(number):
+        barrier.wait()
+        position = number
+        while time.perf_counter() < deadline:
+            try:
+                timed(latencies[number], answer, queries[position % len(queries)])
+            except Exception:
+                errors[number] += 1
+            position += workers
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(worker, range(workers)))
+    elapsed = time.perf_counter() - start
+    samples = [latency for worker_latencies in latencies for latency in worker_latencies]
+    return dict(
+        {"workers": workers, "requests": len(samples), "errors": sum(errors),
+         "qps": len(samples) / elapsed if elapsed > 0 else None},
+        latency=summarize(samples),
+    )
+
+
+# --- Runs and comparisons ---------------------------------------------------
+
+def run(args):
+    options = {
+        "backend": args.backend,
+        "model": args.model,
+        "index": args.index,
+        "mode": args.mode,
+        "batching": args.batching,
+        "queries": args.queries,
+        "warmup": args.warmup,
+        "sends": args.sends,
+        "delivery_workers": args.delivery_workers,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "seed": args.seed,
+        "quiet": not args.verbose,
+    }
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "options": options,
+        },
+        "runs": [],
+    }
+    for size in args.sizes:
+        print(f"Benchmarking {size} items ...", file=sys.stderr)
+        result = run_size(size, options)
+        report["runs"].append(result)
+        print(_summary_line(result), file=sys.stderr)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"ask-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}", file=sys.stderr)
+    return report
+
+
+def _summary_line(result):
+    answer = result["stages"]["answer"]
+    best_qps = max((level["qps"] or 0 for level in result["concurrency"]), default=0)
+    return (f"  {result['size']} items: index {result['build']['load_and_index_seconds']:.1f}s, "
+            f"answer p50 {answer['p50_ms']:.2f}ms p95 {answer['p95_ms']:.2f}ms, "
+            f"best {best_qps:.0f} qps, rss {result['memory']['rss_mb_after_queries']:.0f}MB")
+
+
+def flatten(result, prefix=""):
+    """Flatten nested result dicts to {'stages.answer.p95_ms': value} for comparison"""
+    flat = {}
+    for key, value in result.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, list):
+            for entry in value:
+                if isinstance(entry, dict) and "workers" in entry:
+                    flat.update(flatten(entry, f"{name}.{entry['workers']}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+# Metrics where a larger value is better; for everything else smaller is better
+HIGHER_IS_BETTER = ("qps", "messages_per_second")
+COMPARED = ("_ms", "_seconds", "_mb", "qps", "messages_per_second")
+
+
+def compare(baseline, candidate, threshold=0.2):
+    """Return (rows, regressions) comparing two reports run for run by corpus size"""
+    rows, regressions = [], []
+    baseline_runs = {run["size"]: run for run in baseline["runs"]}
+    for run in candidate["runs"]:
+        if run["size"] not in baseline_runs:
+            continue
+        before, after = flatten(baseline_runs[run["size"]]), flatten(run)
+        for name in sorted(set(before) & set(after)):
+            if not name.endswith(COMPARED) or name.endswith("max_ms") or not before[name]:
+                continue
+            change = (after[name] - before[name]) / before[name]
+            worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+            row = (run["size"], name, before[name], after[name], change)
+            rows.append(row)
+            if worse > threshold:
+                regressions.append(row)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the /ask pipeline on synthetic corpora")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmark and write a JSON report")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    run_parser.add_argument("--backend", default="sentence-transformers",
+                            help="embedding backend, or 'hashing' for a model-free stand-in")
+    run_parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    run_parser.add_argument("--index", default="flat", help="flat, ivf_flat, ivf_pq or hnsw")
+    run_parser.add_argument("--mode", default="vector", choices=["vector", "hybrid"])
+    run_parser.add_argument("--batching", action="store_true", help="enable the query micro-batcher")
+    run_parser.add_argument("--queries", type=int, default=200, help="queries timed per stage")
+    run_parser.add_argument("--warmup", type=int, default=10)
+    run_parser.add_argument("--sends", type=int, default=100, help="messages per channel to the fake servers")
+    run_parser.add_argument("--delivery-workers", type=int, default=4)
+    run_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    run_parser.add_argument("--duration", type=float, default=5.0, help="seconds per concurrency level")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", help="report path (default benchmarks/results/ask-<time>.json)")
+    run_parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+
+    compare_parser = commands.add_parser("compare", help="compare two reports, exit 1 on regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=0.2,
+                                help="relative change counted as a regression (default 0.2 = 20%%)")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        run(args)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    rows, regressions = compare(baseline, candidate, args.threshold)
+    for size, name, before, after, change in rows:
+        marker = "  REGRESSION" if (size, name, before, after, change) in regressions else ""
+        print(f"{size:>9} {name:<45} {before:>12.3f} {after:>12.3f} {change:>+8.1%}{marker}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
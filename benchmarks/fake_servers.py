@@ -0,0 +1,147 @@
+# Local stand-ins for Twilio and an SMTP server, for tests and load runs
+##### benchmarks/fake_servers.py #####
+import json
+import socketserver
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class _BackgroundServer:
+    """Runs a socketserver in a daemon thread; use as a context manager"""
+
+    def _serve(self, server):
+        self._server = server
+        self.host, self.port = server.server_address[:2]
+        self._thread = threading.Thread(target=server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeTwilioServer(_BackgroundServer):
+    """Accepts Twilio Messages API calls and records them.
+
+    Point integrations.whatsapp.api_base_url at .url. fail_next() makes the
+    next requests fail, e.g. with 429 and a Retry-After header.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.messages = []
+        self.connections = 0
+        self._failures = []
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse can be observed
+            disable_nagle_algorithm = True  # headers and body are separate writes
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.connections += 1
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+                with fake._lock:
+                    failure = fake._failures.pop(0) if fake._failures else None
+                    if failure is None:
+                        message = dict(form, sid=f"SM{uuid.uuid4().hex}", path=self.path)
+                        fake.messages.append(message)
+                if failure is not None:
+                    status, retry_after = failure
+                    headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+                    self._reply(status, {"message": "fake failure"}, headers)
+                else:
+                    self._reply(201, {"sid": message["sid"], "status": "queued"})
+
+            def _reply(self, status, body, headers=None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._serve(ThreadingHTTPServer((host, port), Handler))
+        self.url = f"http://{self.host}:{self.port}"
+
+    def fail_next(self, count=1, status=500, retry_after=None):
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * count)
+
+
+class FakeSMTPServer(_BackgroundServer):
+    """A minimal SMTP server (no TLS or auth) that records the messages it receives"""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.messages = []  # (sender, recipients, data)
+        self.connections = 0
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            disable_nagle_algorithm = True
+
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                with fake._lock:
+                    fake.connections += 1
+                self.reply("220 fake-smtp ready")
+                sender, recipients = None, []
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode().strip()
+                    verb = command[:4].upper()
+                    if verb in ("EHLO", "HELO"):
+                        self.reply("250 fake-smtp")
+                    elif verb == "MAIL":
+                        sender, recipients = command.split(":", 1)[1].strip(), []
+                        self.reply("250 OK")
+                    elif verb == "RCPT":
+                        recipients.append(command.split(":", 1)[1].strip())
+                        self.reply("250 OK")
+                    elif verb == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        lines = []
+                        for data_line in iter(self.rfile.readline, b""):
+                            if data_line in (b".\r\n", b".\n"):
+                                break
+                            lines.append(data_line.decode())
+                        with fake._lock:
+                            fake.messages.append((sender, recipients, "".join(lines)))
+                        self.reply("250 OK queued")
+                    elif verb == "RSET":
+                        sender, recipients = None, []
+                        self.reply("250 OK")
+                    elif verb == "NOOP":
+                        self.reply("250 OK")
+                    elif verb == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("502 Command not implemented")
+
+        server = socketserver.ThreadingTCPServer((host, port), Handler)
+        server.daemon_threads = True
+        self._serve(server)
@@ -0,0 +1,81 @@
+# Micro-batching of concurrent vector searches
+##### src/batching.py #####
+import threading
+import time
+from concurrent.futures import Future
+
+
+class QueryBatcher:
+    """Coalesce concurrent search calls into one batched encode + FAISS search.
+
+    Callers block in search() while a background thread collects queries for
+    up to max_wait_ms after the first one arrives, or until max_batch_size
+    queries are waiting, then runs search_batch(queries, k) once and hands
+    each caller its own results. k is the largest k in the batch; callers
+    asking for fewer get their results trimmed.
+    """
+
+    def __init__(self, search_batch, max_batch_size=16, max_wait_ms=5.0):
+        self._search_batch = search_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max_wait_ms / 1000.0
+        self._waiting = []  # (query, k, future)
+        self._cond = threading.Condition()
+        self._thread = None
+        self.batches = 0
+        self.queries = 0
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, query, k=5):
+        """Queue a query and return a Future for its result list"""
+        future = Future()
+        with self._cond:
+            self._ensure_started()
+            self._waiting.append((query, k, future))
+            self._cond.notify()
+        return future
+
+    def search(self, query, k=5):
+        return self.submit(query, k).result()
+
+    def _collect(self):
+        """Wait for the first query, then for the batch to fill or the window to close"""
+        with self._cond:
+            while not self._waiting:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while len(self._waiting) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._waiting[:self.max_batch_size]
+            del self._waiting[:self.max_batch_size]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            queries = [query for query, _, _ in batch]
+            k = max(k for _, k, _ in batch)
+            try:
+                results = self._search_batch(queries, k)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.queries += len(batch)
+            for (_, query_k, future), result in zip(batch, results):
+                future.set_result(result[:query_k])
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "mean_batch_size": self.queries / self.batches if self.batches else 0.0,
+        }
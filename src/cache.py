@@ -0,0 +1,250 @@
+# In-process caches for the request path
+##### src/cache.py #####
+import threading
+import time
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+_MISSING = object()
+
+# Squared L2 between unit embeddings (2 - 2 * cosine): 0.15 is cosine >= 0.925
+DEFAULT_SEMANTIC_MAX_DISTANCE = 0.15
+
+
+def normalize_query(query: str, lowercase=True) -> str:
+    """Cache key for a user query: whitespace collapsed and, for models that ignore case, lowercased"""
+    if lowercase:
+        query = query.lower()
+    return " ".join(query.split())
+
+
+class LRUCache:
+    """Bounded, thread-safe LRU cache with an optional time-to-live per entry.
+
+    max_size <= 0 disables the cache (every get is a miss and nothing is stored).
+    """
+
+    def __init__(self, max_size=1024, ttl_seconds=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= self._clock():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        expires_at = self._clock() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, computing and storing it on a miss.
+
+        compute runs outside the lock, so two threads missing on the same key at
+        once may both compute it; the later result wins.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class ResponseCache:
+    """LRU cache of final answers keyed by (normalized query, engine fingerprint).
+
+    Every lookup passes the current knowledge base version; when it differs
+    from the version the entries were computed with, the cache is emptied.
+    A response computed against an older version is not stored.
+    """
+
+    def __init__(self, max_size=1024, ttl_seconds=None, clock=time.monotonic, normalize=normalize_query):
+        self._cache = LRUCache(max_size=max_size, ttl_seconds=ttl_seconds, clock=clock)
+        self._normalize = normalize
+        self._lock = threading.Lock()
+        self.version = None
+        self.invalidations = 0
+
+    def _key(self, query, fingerprint):
+        return (self._normalize(query), fingerprint)
+
+    def get(self, query, version, fingerprint=None, default=None):
+        if version != self.version:
+            with self._lock:
+                if version != self.version:
+                    if self.version is not None and len(self._cache):
+                        self.invalidations += 1
+                    self._cache.clear()
+                    self.version = version
+        return self._cache.get(self._key(query, fingerprint), default)
+
+    def put(self, query, version, response, fingerprint=None):
+        with self._lock:
+            if version != self.version:
+                return  # The knowledge base changed while the response was computed
+            self._cache.put(self._key(query, fingerprint), response)
+
+    def get_or_compute(self, query, version, compute, fingerprint=None):
+        response = self.get(query, version, fingerprint, _MISSING)
+        if response is _MISSING:
+            response = compute()
+            self.put(query, version, response, fingerprint)
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def stats(self):
+        return dict(self._cache.stats(), invalidations=self.invalidations, version=self.version)
+
+
+class SemanticResponseCache:
+    """Values for recent queries, found by embedding distance instead of exact text.
+
+    A small exact FAISS index holds the embeddings of the cached queries; a
+    lookup returns the value of the nearest one within max_distance (squared
+    L2 between unit-length embeddings, 2 - 2 * cosine similarity), so
+    rephrasings like "roth ira benefits" and "what's good about a Roth IRA?"
+    share one entry. Least recently used entries are evicted above max_size,
+    and like ResponseCache it is emptied when the knowledge base version changes.
+    max_size <= 0 disables the cache.
+    """
+
+    def __init__(self, max_size=1024, max_distance=DEFAULT_SEMANTIC_MAX_DISTANCE, candidates=4):
+        self.max_size = max_size
+        self.max_distance = max_distance
+        self.candidates = candidates  # Neighbours checked, in case the nearest has another fingerprint
+        self._index = None  # Created on the first put, when the dimension is known
+        self._entries = OrderedDict()  # id -> (fingerprint, value), least recently used first
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _clear(self):
+        if self._index is not None:
+            self._index.reset()
+        self._entries.clear()
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self.version is not None and self._entries:
+                self.invalidations += 1
+            self._clear()
+            self.version = version
+
+    @staticmethod
+    def _row(embedding):
+        return np.ascontiguousarray(embedding, dtype=np.float32).reshape(1, -1)
+
+    def get(self, embedding, version, fingerprint=None, default=None):
+        with self._lock:
+            self._check_version(version)
+            if self._entries:
+                distances, ids = self._index.search(self._row(embedding), min(self.candidates, len(self._entries)))
+                for distance, entry_id in zip(distances[0], ids[0]):
+                    if entry_id < 0 or distance > self.max_distance:
+                        break
+                    entry_fingerprint, value = self._entries[entry_id]
+                    if entry_fingerprint == fingerprint:
+                        self._entries.move_to_end(entry_id)
+                        self.hits += 1
+                        return value
+            self.misses += 1
+            return default
+
+    def put(self, embedding, version, value, fingerprint=None):
+        if self.max_size <= 0:
+            return
+        row = self._row(embedding)
+        with self._lock:
+            if version != self.version:
+                return  # The knowledge base changed while the value was computed
+            if self._index is None:
+                self._index = faiss.IndexIDMap(faiss.IndexFlatL2(row.shape[1]))
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(row, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = (fingerprint, value)
+            if len(self._entries) > self.max_size:
+                evicted = []
+                while len(self._entries) > self.max_size:
+                    evicted.append(self._entries.popitem(last=False)[0])
+                self._index.remove_ids(np.array(evicted, dtype=np.int64))
+                self.evictions += len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "max_distance": self.max_distance,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "version": self.version,
+            }
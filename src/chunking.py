@@ -0,0 +1,116 @@
+# Splitting long documents into chunks for embedding
+##### src/chunking.py #####
+import re
+
+try:
+    import fitz  # PyMuPDF, only needed for PDF ingestion
+except ImportError:
+    fitz = None
+
+# Blank lines or markdown-style headings start a new paragraph
+PARAGRAPH_BREAK_RE = re.compile(r'\n\s*\n|\n(?=#{1,6}\s)')
+
+DEFAULTS = {
+    "enabled": True,
+    "mode": "tokens",  # tokens: fixed-size windows, paragraph: pack whole paragraphs
+    # Whitespace tokens per chunk. all-MiniLM-L6-v2 reads at most 256 word pieces,
+    # which is roughly 190 words of ordinary English.
+    "max_tokens": 150,
+    "overlap": 30,  # tokens repeated between consecutive windows
+}
+
+# Chunks kept per item; the rest of an extremely long item is not embedded
+MAX_CHUNKS = 4096
+
+
+def chunk_settings(config=None):
+    settings = dict(DEFAULTS)
+    settings.update(config or {})
+    if settings["mode"] not in ("tokens", "paragraph"):
+        raise ValueError(f"Unknown chunking mode '{settings['mode']}', expected 'tokens' or 'paragraph'")
+    if not 0 <= settings["overlap"] < settings["max_tokens"]:
+        raise ValueError("chunking overlap must be smaller than max_tokens")
+    return settings
+
+
+def token_windows(tokens, max_tokens, overlap):
+    """Yield overlapping windows of at most max_tokens tokens"""
+    step = max_tokens - overlap
+    for start in range(0, max(len(tokens) - overlap, 1), step):
+        yield tokens[start:start + max_tokens]
+
+
+def chunk_text(text, config=None):
+    """Split text into chunks of at most max_tokens whitespace tokens.
+
+    Text that already fits is returned as a single chunk, unchanged.
+    """
+    settings = chunk_settings(config)
+    max_tokens, overlap = settings["max_tokens"], settings["overlap"]
+    tokens = text.split()
+    if not settings["enabled"] or len(tokens) <= max_tokens:
+        return [text]
+
+    if settings["mode"] == "tokens":
+        return [" ".join(window) for window in token_windows(tokens, max_tokens, overlap)]
+
+    # Paragraph mode: pack whole paragraphs, splitting only paragraphs that are too long
+    chunks = []
+    current = []
+    for paragraph in PARAGRAPH_BREAK_RE.split(text):
+        words = paragraph.split()
+        if not words:
+            continue
+        if len(words) > max_tokens:
+            if current:
+                chunks.append(" ".join(current))
+                current = []
+            chunks.extend(" ".join(window) for window in token_windows(words, max_tokens, overlap))
+        elif len(current) + len(words) > max_tokens:
+            chunks.append(" ".join(current))
+            current = list(words)
+        else:
+            current.extend(words)
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def index_text(item):
+    """Return the text that is embedded for a knowledge base item"""
+    text = item['text']
+    # For FAQ format, use both question and answer for better matching
+    if text.startswith("Q:") and "\nA:" in text:
+        parts = text.split("\nA:")
+        question = parts[0].replace("Q:", "").strip()
+        answer = parts[1].strip()
+        # Embed the combined text to capture both question and answer semantics
+        return f"{question} {answer}"
+    return text
+
+
+def chunk_item(item, config=None):
+    """Return [(text to embed, text to return)] for each chunk of a knowledge base item"""
+    text = item['text']
+    chunks = chunk_text(text, config)
+    if len(chunks) == 1:
+        return [(index_text(item), text)]
+    # Repeat the title (first line) in every chunk so each one keeps its context
+    title = text.split("\n", 1)[0].strip()
+    pieces = []
+    for chunk in chunks[:MAX_CHUNKS]:
+        if not chunk.startswith(title):
+            chunk = f"{title}\n{chunk}"
+        pieces.append((chunk, chunk))
+    return pieces
+
+
+def iter_pdf_pages(path):
+    """Yield (page_number, text) for each page of a PDF, one page in memory at a time"""
+    if fitz is None:
+        raise ImportError("PDF ingestion needs PyMuPDF: pip install PyMuPDF")
+    with fitz.open(path) as pdf:
+        for page_number, page in enumerate(pdf, start=1):
+            text = page.get_text().strip()
+            if text:
+                yield page_number, text
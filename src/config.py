@@ -0,0 +1,31 @@
+# Application configuration, read once per process
+##### src/config.py #####
+import hashlib
+import json
+import os
+
+import yaml
+
+# Set FIN_AI_CONFIG to use another file, e.g. in tests or containers
+config_path = os.environ.get("FIN_AI_CONFIG", "config.yaml")
+
+
+def load_config(path=None):
+    """Read a YAML config file; a missing file gives an empty config (all defaults)"""
+    path = path or config_path
+    if not os.path.exists(path):
+        print(f"No {path} found, using defaults")
+        return {}
+    with open(path, "r") as f:
+        return yaml.safe_load(f) or {}
+
+
+# Shared by every module; import this instead of reading config.yaml again
+config = load_config()
+
+
+def config_fingerprint(sections, source=None):
+    """Short hash of the given config sections, to key caches of results that depend on them"""
+    source = config if source is None else source
+    selected = {section: source.get(section) for section in sections}
+    return hashlib.sha256(json.dumps(selected, sort_keys=True, default=str).encode()).hexdigest()[:16]
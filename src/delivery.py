@@ -0,0 +1,415 @@
+# Background delivery of responses to channels
+##### src/delivery.py #####
+import heapq
+import itertools
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from src.metrics import registry
+from src.sqlite_util import ThreadLocalConnection, Transaction
+
+# Statuses of deliveries that still have to be sent
+PENDING_STATUSES = ("queued", "retrying")
+
+send_seconds = registry.histogram(
+    "fin_ai_delivery_send_seconds", "Time spent in one channel send attempt", ("channel",)
+)
+attempts_total = registry.counter(
+    "fin_ai_delivery_attempts_total", "Delivery attempts by channel and outcome", ("channel", "outcome")
+)
+
+
+class DeliveryError(Exception):
+    """Raised by a channel sender to control what happens to a failed delivery.
+
+    retryable=False fails the delivery at once (e.g. an invalid number);
+    retry_after delays the next attempt by at least that many seconds
+    (e.g. from a 429 Retry-After header).
+    """
+
+    def __init__(self, message, retryable=True, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Rate limit of rate events per second with bursts of up to burst events"""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take a token if one is available. Returns 0.0, or the seconds until one will be."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return 0.0
+            return (1.0 - self._tokens) / self.rate
+
+
+def _public_status(job):
+    return {key: job[key] for key in ("delivery_id", "channel", "recipient", "status", "attempts", "error")}
+
+
+class MemoryOutbox:
+    """Deliveries kept in process memory; pending ones are lost on restart"""
+
+    def __init__(self, max_statuses=10000):
+        self.max_statuses = max_statuses
+        self._due = []  # heap of (next_attempt_at, seq, delivery_id)
+        self._jobs = {}  # delivery_id -> job, while pending or sending
+        self._statuses = OrderedDict()  # delivery_id -> public status, most recent last
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _set_status(self, job):
+        delivery_id = job["delivery_id"]
+        self._statuses[delivery_id] = _public_status(job)
+        self._statuses.move_to_end(delivery_id)
+        while len(self._statuses) > self.max_statuses:
+            self._statuses.popitem(last=False)
+
+    def add(self, job):
+        self.save(job)
+
+    def save(self, job):
+        """Store a job after it was created or attempted"""
+        with self._lock:
+            self._set_status(job)
+            if job["status"] in PENDING_STATUSES:
+                self._jobs[job["delivery_id"]] = job
+                heapq.heappush(self._due, (job["next_attempt_at"], next(self._seq), job["delivery_id"]))
+            else:
+                self._jobs.pop(job["delivery_id"], None)
+
+    def claim(self, now):
+        """Return (a due job marked 'sending', None) or (None, when the next job is due)"""
+        with self._lock:
+            while self._due:
+                next_attempt_at, _, delivery_id = self._due[0]
+                if next_attempt_at > now:
+                    return None, next_attempt_at
+                heapq.heappop(self._due)
+                job = self._jobs.get(delivery_id)
+                if job is not None:
+                    job["status"] = "sending"
+                    self._set_status(job)
+                    return job, None
+            return None, None
+
+    def status(self, delivery_id):
+        with self._lock:
+            status = self._statuses.get(delivery_id)
+            return dict(status) if status else None
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._jobs)
+
+
+class SQLiteOutbox:
+    """Deliveries in a SQLite file, so pending ones survive restarts and are shared by workers.
+
+    A claimed job gets a lease: if the process sending it dies, the job is
+    picked up again once lease_seconds have passed (at-least-once delivery).
+    Finished deliveries are kept for retention_seconds for status lookups.
+    """
+
+    def __init__(self, path, lease_seconds=60.0, retention_seconds=86400.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self._connections = ThreadLocalConnection(path)
+        self._last_prune = 0.0
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS deliveries ("
+                " id TEXT PRIMARY KEY, job TEXT NOT NULL, status TEXT NOT NULL,"
+                " next_attempt_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS deliveries_due ON deliveries (status, next_attempt_at)")
+
+    def _connection(self):
+        return self._connections.get()
+
+    def _transaction(self):
+        return Transaction(self._connection())
+
+    def _write(self, conn, job, next_attempt_at, now):
+        conn.execute(
+            "INSERT INTO deliveries (id, job, status, next_attempt_at, updated_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT(id) DO UPDATE SET job = excluded.job, status = excluded.status,"
+            " next_attempt_at = excluded.next_attempt_at, updated_at = excluded.updated_at",
+            (job["delivery_id"], json.dumps(job), job["status"], next_attempt_at, now),
+        )
+
+    def add(self, job):
+        self.save(job)
+
+    def save(self, job):
+        now = time.time()
+        with self._transaction() as conn:
+            self._write(conn, job, job["next_attempt_at"], now)
+            if now - self._last_prune > 60:
+                self._last_prune = now
+                conn.execute(
+                    "DELETE FROM deliveries WHERE status IN ('delivered', 'failed') AND updated_at < ?",
+                    (now - self.retention_seconds,),
+                )
+
+    def claim(self, now):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT job FROM deliveries WHERE status IN ('queued', 'retrying', 'sending')"
+                " AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                (next_due,) = conn.execute(
+                    "SELECT MIN(next_attempt_at) FROM deliveries"
+                    " WHERE status IN ('queued', 'retrying', 'sending')"
+                ).fetchone()
+                return None, next_due
+            job = json.loads(row[0])
+            job["status"] = "sending"
+            self._write(conn, job, now + self.lease_seconds, now)
+            return job, None
+
+    def status(self, delivery_id):
+        row = self._connection().execute("SELECT job FROM deliveries WHERE id = ?", (delivery_id,)).fetchone()
+        return _public_status(json.loads(row[0])) if row else None
+
+    def pending_count(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM deliveries WHERE status IN ('queued', 'retrying', 'sending')"
+        ).fetchone()[0]
+
+
+class DeliveryMetrics:
+    """Per-channel delivery counters and timings"""
+
+    COUNTERS = ("submitted", "delivered", "failed", "retries", "throttled")
+
+    def __init__(self):
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def _channel(self, channel):
+        metrics = self._channels.get(channel)
+        if metrics is None:
+            metrics = dict.fromkeys(self.COUNTERS, 0)
+            metrics.update(send_seconds=0.0, sends=0, delivery_seconds=0.0)
+            self._channels[channel] = metrics
+        return metrics
+
+    def count(self, channel, counter):
+        with self._lock:
+            self._channel(channel)[counter] += 1
+
+    def record_send(self, channel, send_seconds):
+        with self._lock:
+            metrics = self._channel(channel)
+            metrics["sends"] += 1
+            metrics["send_seconds"] += send_seconds
+
+    def record_delivered(self, channel, delivery_seconds):
+        with self._lock:
+            metrics = self._channel(channel)
+            metrics["delivered"] += 1
+            metrics["delivery_seconds"] += delivery_seconds
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for channel, metrics in self._channels.items():
+                result[channel] = {counter: metrics[counter] for counter in self.COUNTERS}
+                sends, delivered = metrics["sends"], metrics["delivered"]
+                result[channel]["avg_send_ms"] = 1000 * metrics["send_seconds"] / sends if sends else None
+                # Time from submit() to successful send, including queueing, throttling and retries
+                result[channel]["avg_delivery_ms"] = (
+                    1000 * metrics["delivery_seconds"] / delivered if delivered else None
+                )
+            return result
+
+
+class DeliveryQueue:
+    """Send responses to channels from a pool of background workers, retrying failures.
+
+    send(channel, response, recipient) must return True on success; False or an
+    exception counts as a failed attempt (see DeliveryError for finer control).
+    Failed attempts are retried with exponential backoff up to max_attempts.
+    Channels in rate_limits (channel -> TokenBucket) are throttled: a job over
+    the limit waits in the outbox instead of blocking a worker. Deliveries are
+    kept in the outbox (MemoryOutbox by default, or SQLiteOutbox) and their
+    status can be looked up by delivery id.
+    """
+
+    def __init__(self, send, max_attempts=3, backoff_seconds=1.0, max_statuses=10000,
+                 workers=1, rate_limits=None, outbox=None, poll_seconds=1.0, clock=time.time):
+        self._send = send
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.workers = max(1, int(workers))
+        self.rate_limits = rate_limits or {}
+        self.outbox = outbox if outbox is not None else MemoryOutbox(max_statuses)
+        # Other processes can add to a shared outbox without waking us, so idle workers poll
+        self.poll_seconds = poll_seconds
+        self.metrics = DeliveryMetrics()
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._wakeups = 0  # bumped on every submit so a worker never sleeps through one
+        self._threads = []
+        self._stopping = False
+
+    def start(self):
+        with self._cond:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            if self._threads:
+                return
+            self._stopping = False
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"delivery-worker-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=5.0):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def submit(self, channel, response, recipient=None):
+        """Queue a delivery and return its id"""
+        self.start()
+        now = self._clock()
+        job = {
+            "delivery_id": str(uuid.uuid4()),
+            "channel": channel,
+            "recipient": recipient,
+            "response": response,
+            "status": "queued",
+            "attempts": 0,
+            "error": None,
+            "created_at": now,
+            "next_attempt_at": now,
+        }
+        self.outbox.add(job)
+        self.metrics.count(channel, "submitted")
+        with self._cond:
+            self._wakeups += 1
+            self._cond.notify()
+        return job["delivery_id"]
+
+    def status(self, delivery_id):
+        return self.outbox.status(delivery_id)
+
+    @property
+    def pending_count(self):
+        return self.outbox.pending_count()
+
+    def stats(self):
+        return {
+            "pending": self.pending_count,
+            "workers": self.workers,
+            "channels": self.metrics.snapshot(),
+        }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                seen = self._wakeups
+            job, next_due = self.outbox.claim(self._clock())
+            if job is not None:
+                self._attempt(job)
+                continue
+            timeout = self.poll_seconds
+            if next_due is not None:
+                timeout = min(timeout, max(0.0, next_due - self._clock()))
+            with self._cond:
+                if self._wakeups == seen and not self._stopping:
+                    self._cond.wait(timeout)
+
+    def _attempt(self, job):
+        channel = job["channel"]
+        bucket = self.rate_limits.get(channel)
+        wait = bucket.try_acquire() if bucket is not None else 0.0
+        if wait > 0:
+            # Over the channel's rate: put the job back until a token is available
+            job["status"] = "retrying" if job["attempts"] else "queued"
+            job["next_attempt_at"] = self._clock() + wait
+            self.outbox.save(job)
+            self.metrics.count(channel, "throttled")
+            attempts_total.labels(channel, "throttled").inc()
+            return
+
+        job["attempts"] += 1
+        error = None
+        retryable = True
+        retry_after = None
+        start = time.perf_counter()
+        try:
+            delivered = self._send(channel, job["response"], job["recipient"])
+            if not delivered:
+                error = "delivery failed"
+        except DeliveryError as e:
+            error, retryable, retry_after = str(e), e.retryable, e.retry_after
+        except Exception as e:
+            error = str(e)
+        elapsed = time.perf_counter() - start
+        self.metrics.record_send(channel, elapsed)
+        send_seconds.labels(channel).observe(elapsed)
+
+        now = self._clock()
+        job["error"] = error
+        if error is None:
+            job["status"] = "delivered"
+            self.metrics.record_delivered(channel, now - job["created_at"])
+        elif not retryable or job["attempts"] >= self.max_attempts:
+            job["status"] = "failed"
+            self.metrics.count(channel, "failed")
+        else:
+            job["status"] = "retrying"
+            delay = self.backoff_seconds * (2 ** (job["attempts"] - 1))
+            job["next_attempt_at"] = now + max(delay, retry_after or 0.0)
+            self.metrics.count(channel, "retries")
+        attempts_total.labels(channel, job["status"]).inc()
+        self.outbox.save(job)
+
+
+def create_delivery_queue(config, send):
+    """Build the delivery queue described by the 'delivery' config section"""
+    config = config or {}
+    backend = config.get("backend", "memory")
+    if backend == "memory":
+        outbox = MemoryOutbox()
+    elif backend == "sqlite":
+        outbox = SQLiteOutbox(config.get("path", "data/deliveries.db"))
+    else:
+        raise ValueError(f"Unknown delivery backend '{backend}', expected 'memory' or 'sqlite'")
+    rate_limits = {
+        channel: TokenBucket(limit["rate"], limit.get("burst"))
+        for channel, limit in (config.get("rate_limits") or {}).items()
+    }
+    return DeliveryQueue(
+        send,
+        max_attempts=config.get("max_attempts", 3),
+        backoff_seconds=config.get("backoff_seconds", 1.0),
+        workers=config.get("workers", 4),
+        rate_limits=rate_limits,
+        outbox=outbox,
+    )
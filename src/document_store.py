@@ -0,0 +1,236 @@
+# On-disk document store read one document at a time by id
+##### src/document_store.py #####
+import json
+import mmap
+import os
+import threading
+import time
+from array import array
+from collections.abc import MutableMapping
+
+import numpy as np
+
+
+class DocumentStore:
+    """Knowledge base items in a JSONL file with an offset index next to it.
+
+    <path>.idx holds int64 rows of (doc_id, byte offset, byte length) sorted by
+    id, after a header row of (count, data file size, 0). Opening a store
+    reads only the index, 24 bytes per document; get() is a binary search and
+    one read, so document text stays on disk until it is asked for.
+
+    With memory_map=True both files are mapped read-only instead of read, so
+    processes serving the same (immutable) store share one copy in the page
+    cache. A mapped store must not be replaced in place; see src/snapshots.py.
+    """
+
+    def __init__(self, path, open_timeout_seconds=5.0, memory_map=False):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self.memory_map = memory_map
+        deadline = time.monotonic() + open_timeout_seconds
+        while True:
+            self._file = open(path, "rb")
+            if memory_map:
+                entries = np.memmap(self.index_path, dtype=np.int64, mode="r").reshape(-1, 3)
+            else:
+                entries = np.fromfile(self.index_path, dtype=np.int64).reshape(-1, 3)
+            # A writer replaces the data file and then the index; wait for the pair to match
+            if len(entries) and entries[0, 1] == os.fstat(self._file.fileno()).st_size:
+                break
+            self._file.close()
+            if time.monotonic() > deadline:
+                raise ValueError(f"{self.index_path} does not match {path}")
+            time.sleep(0.05)
+        self._map = None
+        if memory_map:
+            # Views of the mapped index; nothing is copied into this process
+            self._ids, self._offsets, self._lengths = entries[1:, 0], entries[1:, 1], entries[1:, 2]
+            if entries[0, 1]:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._ids = entries[1:, 0].copy()
+            self._offsets = entries[1:, 1].copy()
+            self._lengths = entries[1:, 2].copy()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _position(self, doc_id):
+        position = int(np.searchsorted(self._ids, doc_id))
+        if position < len(self._ids) and self._ids[position] == doc_id:
+            return position
+        return None
+
+    def __contains__(self, doc_id):
+        return self._position(int(doc_id)) is not None
+
+    def ids(self):
+        """Sorted array of the document ids in the store"""
+        return self._ids
+
+    def get(self, doc_id):
+        """Return the item with the given id, or None"""
+        position = self._position(int(doc_id))
+        if position is None:
+            return None
+        if self._map is not None:
+            offset = int(self._offsets[position])
+            return json.loads(self._map[offset:offset + int(self._lengths[position])])
+        with self._lock:
+            self._file.seek(int(self._offsets[position]))
+            line = self._file.read(int(self._lengths[position]))
+        return json.loads(line)
+
+    def __iter__(self):
+        """Stream every item in file order with its own file handle"""
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                item = json.loads(line)
+                position = self._position(item["id"])
+                # Skip lines superseded by a later line with the same id
+                if position is not None and self._offsets[position] == offset:
+                    yield item
+                offset += len(line)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+class DocumentStoreWriter:
+    """Write items one at a time into a new DocumentStore.
+
+    Nothing is visible at path until close(), which replaces the data file
+    and its index. If an id is written more than once the last item wins.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._tmp_path = f"{path}.tmp.{os.getpid()}"
+        self._file = open(self._tmp_path, "wb")
+        self._entries = array("q")  # flat (doc_id, offset, length) triples
+        self._offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def __len__(self):
+        return len(self._entries) // 3
+
+    def add(self, item):
+        """Append an item, which must have an integer 'id'"""
+        line = (json.dumps(item, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        self._file.write(line)
+        self._entries.extend((int(item["id"]), self._offset, len(line)))
+        self._offset += len(line)
+
+    def close(self):
+        """Publish the store; returns the number of distinct documents"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+        entries = np.frombuffer(self._entries, dtype=np.int64).reshape(-1, 3)
+        entries = entries[np.argsort(entries[:, 0], kind="stable")]
+        if len(entries):
+            # Keep the last line written for each id
+            entries = entries[np.append(entries[1:, 0] != entries[:-1, 0], True)]
+        header = np.array([[len(entries), self._offset, 0]], dtype=np.int64)
+
+        index_tmp_path = f"{self._tmp_path}.idx"
+        with open(index_tmp_path, "wb") as f:
+            np.vstack([header, entries]).tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self._tmp_path, self.path)
+        os.replace(index_tmp_path, f"{self.path}.idx")
+        return len(entries)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class Documents(MutableMapping):
+    """Knowledge base items by id: a DocumentStore (if any) plus in-memory changes.
+
+    Items from the store are read from disk on every access, so only changed
+    items are held in memory. Mapping order is store order, then new items.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self._changed = {}  # doc_id -> item, added or replaced since the store was written
+        self._deleted = set()  # store ids removed since the store was written
+
+    def reset(self, store=None):
+        """Switch to another store (or none) and drop all in-memory changes"""
+        # The old store is not closed: searches in other threads may still be reading it
+        self.store = store
+        self._changed = {}
+        self._deleted = set()
+
+    def __getitem__(self, doc_id):
+        item = self._changed.get(doc_id)
+        if item is not None:
+            return item
+        if self.store is None or doc_id in self._deleted:
+            raise KeyError(doc_id)
+        item = self.store.get(doc_id)
+        if item is None:
+            raise KeyError(doc_id)
+        return item
+
+    def __setitem__(self, doc_id, item):
+        self._changed[doc_id] = item
+        self._deleted.discard(doc_id)
+
+    def __delitem__(self, doc_id):
+        if doc_id not in self:
+            raise KeyError(doc_id)
+        self._changed.pop(doc_id, None)
+        if self.store is not None and doc_id in self.store:
+            self._deleted.add(doc_id)
+
+    def __contains__(self, doc_id):
+        if doc_id in self._changed:
+            return True
+        return self.store is not None and doc_id not in self._deleted and doc_id in self.store
+
+    def __iter__(self):
+        # Snapshots, so a change applied by another thread cannot break the iteration
+        changed = list(self._changed)
+        skip = self._deleted | set(changed)
+        if self.store is not None:
+            for doc_id in self.store.ids().tolist():
+                if doc_id not in skip:
+                    yield doc_id
+        yield from changed
+
+    def __len__(self):
+        if self.store is None:
+            return len(self._changed)
+        new = sum(1 for doc_id in list(self._changed) if doc_id not in self.store)
+        return len(self.store) - len(self._deleted) + new
+
+    def max_id(self):
+        """Largest id in use or in the store, -1 when empty"""
+        ids = list(self._changed)
+        if self.store is not None and len(self.store):
+            ids.append(int(self.store.ids()[-1]))
+        return max(ids, default=-1)
@@ -0,0 +1,277 @@
+# Interchangeable implementations of text -> embedding vector
+##### src/embedding_backends.py #####
+"""Embedding backends.
+
+  sentence-transformers  PyTorch fp32, the reference implementation
+  torch-int8             the same model with Linear layers dynamically quantized to int8
+  onnx                   ONNX Runtime on models/<model>/model.onnx
+  onnx-int8              ONNX Runtime on models/<model>/model_int8.onnx
+
+Every backend returns float32 arrays of shape (n, dimension) for the same
+model, so they can be swapped in config. Vectors differ slightly between
+backends, so each backend other than the reference gets its own embedding
+cache (see cache_name). Create the ONNX files (needs pip install onnx onnxruntime) with:
+
+    python -m src.embedding_backends export all-MiniLM-L6-v2 --quantize
+"""
+import abc
+import argparse
+import inspect
+import json
+import os
+import warnings
+
+import numpy as np
+
+from src.logs import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_BACKEND = "sentence-transformers"
+DEFAULT_MODELS_DIR = "models"
+
+
+def model_source(model_name, models_dir=DEFAULT_MODELS_DIR):
+    """Use models/<model_name> when it exists, otherwise the name (downloaded by sentence-transformers)"""
+    local_path = os.path.join(models_dir, model_name)
+    return local_path if os.path.isdir(local_path) else model_name
+
+
+def cache_name(model_name, backend=DEFAULT_BACKEND):
+    """Name under which a backend's vectors are cached; the reference keeps the plain model name"""
+    return model_name if backend == DEFAULT_BACKEND else f"{model_name}@{backend}"
+
+
+class EmbeddingBackend(abc.ABC):
+    """Turns texts into embedding vectors. Subclasses implement encode() and dimension."""
+
+    name = None
+
+    def __init__(self, model_name, models_dir=DEFAULT_MODELS_DIR):
+        self.model_name = model_name
+        self.models_dir = models_dir
+
+    @property
+    @abc.abstractmethod
+    def dimension(self):
+        """Length of the vectors encode() returns"""
+
+    @abc.abstractmethod
+    def encode(self, texts, batch_size=32):
+        """Return a float32 array with one row per text"""
+
+    def encode_one(self, text):
+        return self.encode([text])[0]
+
+    @property
+    def lowercases(self):
+        """True when the tokenizer folds case, so texts differing only in case get the same vector"""
+        return False
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """PyTorch fp32 on CPU through sentence-transformers"""
+
+    name = "sentence-transformers"
+
+    def __init__(self, model_name, models_dir=DEFAULT_MODELS_DIR):
+        super().__init__(model_name, models_dir)
+        # Importing sentence_transformers pulls in torch, so it only happens when a model is built
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_source(model_name, models_dir), device="cpu")
+
+    @property
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    @property
+    def lowercases(self):
+        return bool(getattr(getattr(self.model, "tokenizer", None), "do_lower_case", False))
+
+    def encode(self, texts, batch_size=32):
+        return np.asarray(self.model.encode(
+            list(texts), batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False
+        ), dtype=np.float32)
+
+
+class QuantizedTorchBackend(SentenceTransformerBackend):
+    """The sentence-transformers model with its Linear layers quantized to int8 when loaded"""
+
+    name = "torch-int8"
+
+    def __init__(self, model_name, models_dir=DEFAULT_MODELS_DIR):
+        super().__init__(model_name, models_dir)
+        import torch
+        from torch.ao.quantization import quantize_dynamic
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # torch.ao deprecation notices on every load
+            self.model = quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxBackend(EmbeddingBackend):
+    """ONNX Runtime inference with the model's pooling and normalization done in numpy.
+
+    Needs models/<model_name>/ as written by export_onnx(): the exported
+    transformer (model.onnx or model_int8.onnx), its tokenizer, and the
+    sentence-transformers modules.json and pooling config.
+    """
+
+    name = "onnx"
+    onnx_file = "model.onnx"
+
+    def __init__(self, model_name, models_dir=DEFAULT_MODELS_DIR):
+        super().__init__(model_name, models_dir)
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.path = os.path.join(models_dir, model_name)
+        onnx_path = os.path.join(self.path, self.onnx_file)
+        if not os.path.exists(onnx_path):
+            raise FileNotFoundError(
+                f"{onnx_path} not found; run: python -m src.embedding_backends export {model_name}"
+                + (" --quantize" if self.name == "onnx-int8" else "")
+            )
+        self.tokenizer = AutoTokenizer.from_pretrained(self.path)
+        self.session = onnxruntime.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self.max_length, self.pooling, self.normalize = self._read_pipeline()
+        self._dimension = self.session.get_outputs()[0].shape[-1]
+
+    def _read_pipeline(self):
+        """Return (max sequence length, pooling mode, normalize) from the sentence-transformers config"""
+        max_length = 256
+        settings_path = os.path.join(self.path, "sentence_bert_config.json")
+        if os.path.exists(settings_path):
+            with open(settings_path) as f:
+                max_length = json.load(f).get("max_seq_length", max_length)
+
+        pooling, normalize = "mean", False
+        modules_path = os.path.join(self.path, "modules.json")
+        if os.path.exists(modules_path):
+            with open(modules_path) as f:
+                modules = json.load(f)
+            for module in modules:
+                if module["type"].endswith("Pooling"):
+                    with open(os.path.join(self.path, module["path"], "config.json")) as f:
+                        pooling_config = json.load(f)
+                    if pooling_config.get("pooling_mode_cls_token"):
+                        pooling = "cls"
+                elif module["type"].endswith("Normalize"):
+                    normalize = True
+        return max_length, pooling, normalize
+
+    @property
+    def dimension(self):
+        return self._dimension
+
+    @property
+    def lowercases(self):
+        return bool(getattr(self.tokenizer, "do_lower_case", False))
+
+    def _encode_batch(self, texts):
+        encoded = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+        )
+        inputs = {name: encoded[name].astype(np.int64) for name in self.input_names}
+        token_embeddings = self.session.run(None, inputs)[0]
+        if self.pooling == "cls":
+            pooled = token_embeddings[:, 0]
+        else:
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+    def encode(self, texts, batch_size=32):
+        texts = list(texts)
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        # Batch texts of similar length together to keep padding small
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        for begin in range(0, len(texts), batch_size):
+            positions = order[begin:begin + batch_size]
+            embeddings[positions] = self._encode_batch([texts[i] for i in positions])
+        return embeddings
+
+
+class QuantizedOnnxBackend(OnnxBackend):
+    name = "onnx-int8"
+    onnx_file = "model_int8.onnx"
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (SentenceTransformerBackend, QuantizedTorchBackend, OnnxBackend, QuantizedOnnxBackend)
+}
+
+
+def create_backend(name=DEFAULT_BACKEND, model_name='all-MiniLM-L6-v2', models_dir=DEFAULT_MODELS_DIR):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{name}', expected one of {', '.join(BACKENDS)}")
+    logger.info("Loading embedding model %s (%s)", model_name, name)
+    return BACKENDS[name](model_name, models_dir)
+
+
+def export_onnx(model_name, models_dir=DEFAULT_MODELS_DIR, quantize=False):
+    """Save model_name under models_dir with an ONNX export of its transformer (and an int8 copy)"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    output_dir = os.path.join(models_dir, model_name)
+    model = SentenceTransformer(model_source(model_name, models_dir), device="cpu")
+    model.save(output_dir)  # weights, tokenizer, pooling and normalize config
+
+    transformer = model[0].auto_model.eval()
+    dummy = model.tokenizer(["An example sentence to trace the model"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self, transformer):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *inputs):
+            return self.transformer(**dict(zip(input_names, inputs))).last_hidden_state
+
+    onnx_path = os.path.join(output_dir, OnnxBackend.onnx_file)
+    axes = {"batch": 0, "sequence": 1}
+    # Newer torch defaults to the dynamo exporter; keep the TorchScript one that
+    # dynamic_axes is written for. torch 2.2 (packages.txt) has no dynamo argument.
+    exporter = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    torch.onnx.export(
+        TokenEmbeddings(transformer),
+        tuple(dummy[name] for name in input_names),
+        onnx_path,
+        input_names=input_names,
+        output_names=["token_embeddings"],
+        dynamic_axes={name: {index: axis for axis, index in axes.items()}
+                      for name in input_names + ["token_embeddings"]},
+        opset_version=14,
+        **exporter,
+    )
+    print(f"Exported {onnx_path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = os.path.join(output_dir, QuantizedOnnxBackend.onnx_file)
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+        print(f"Quantized {int8_path}")
+    return output_dir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Embedding backend tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="export a model to ONNX under the models directory")
+    export.add_argument("model", nargs="?", default='all-MiniLM-L6-v2')
+    export.add_argument("--models-dir", default=DEFAULT_MODELS_DIR)
+    export.add_argument("--quantize", action="store_true", help="also write an int8 model (needs onnxruntime)")
+    args = parser.parse_args(argv)
+    export_onnx(args.model, args.models_dir, quantize=args.quantize)
+
+
+if __name__ == "__main__":
+    main()
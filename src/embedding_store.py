@@ -0,0 +1,200 @@
+# Persistent, content-addressed embedding cache
+##### src/embedding_store.py #####
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, single worker only
+    fcntl = None
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so formatting-only edits reuse the cached vector"""
+    return " ".join(text.split())
+
+
+class EmbeddingStore:
+    """On-disk cache of embedding vectors keyed by a hash of (model name, normalized text).
+
+    Each model gets its own directory holding:
+      vectors.f32     - append-only float32 rows, memory-mapped for reads
+      manifest.jsonl  - one {"key", "row"} line per stored vector
+      meta.json       - model name and vector dimension
+
+    Vector bytes are written before their manifest line, so a reader that
+    sees a key in the manifest can always read its row. Appends from several
+    worker processes are serialized with a lock file.
+    """
+
+    def __init__(self, directory, model_name, dimension=None):
+        self.model_name = model_name
+        safe_name = model_name.replace("/", "__")
+        self.directory = os.path.join(directory, safe_name)
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.manifest_path = os.path.join(self.directory, "manifest.jsonl")
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.lock_path = os.path.join(self.directory, ".lock")
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.dimension = dimension
+        self._rows = {}  # key -> row
+        self._manifest_offset = 0
+        self._vectors = None  # np.memmap over vectors.f32
+        self._thread_lock = threading.Lock()
+        self._load_meta()
+
+    def _load_meta(self):
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+            if self.dimension is not None and meta["dimension"] != self.dimension:
+                raise ValueError(
+                    f"Embedding store at {self.directory} has dimension {meta['dimension']}, "
+                    f"expected {self.dimension}"
+                )
+            self.dimension = meta["dimension"]
+
+    def _write_meta(self):
+        with open(self.meta_path, "w") as f:
+            json.dump({"model": self.model_name, "dimension": self.dimension}, f)
+
+    @contextmanager
+    def _locked(self, exclusive):
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def key(self, text: str) -> str:
+        payload = f"{self.model_name}\0{normalize_text(text)}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _refresh(self):
+        """Pick up manifest lines appended since the last refresh (possibly by other workers)"""
+        if self.dimension is None:
+            self._load_meta()
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path, "r") as f:
+            f.seek(self._manifest_offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # Partial line from an interrupted write
+                entry = json.loads(line)
+                self._rows[entry["key"]] = entry["row"]
+                self._manifest_offset += len(line.encode("utf-8"))
+
+    def _vector_rows(self):
+        if not os.path.exists(self.vectors_path) or not self.dimension:
+            return 0
+        return os.path.getsize(self.vectors_path) // (self.dimension * 4)
+
+    def _mapped_vectors(self, min_rows):
+        """Return a memmap covering at least min_rows rows, remapping if the file grew"""
+        if self._vectors is None or self._vectors.shape[0] < min_rows:
+            rows = self._vector_rows()
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                      shape=(rows, self.dimension))
+        return self._vectors
+
+    def lookup(self, texts):
+        """Return (vectors, missing) where missing lists positions with no cached vector.
+
+        Rows of vectors at missing positions are left as zeros.
+        """
+        keys = [self.key(text) for text in texts]
+        with self._locked(exclusive=False):
+            self._refresh()
+        missing = [i for i, key in enumerate(keys) if key not in self._rows]
+        if self.dimension is None:
+            return None, missing
+
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        found = [(i, self._rows[key]) for i, key in enumerate(keys) if key in self._rows]
+        if found:
+            positions, rows = zip(*found)
+            mapped = self._mapped_vectors(max(rows) + 1)
+            vectors[list(positions)] = mapped[list(rows)]
+        return vectors, missing
+
+    def add(self, texts, vectors):
+        """Append vectors for texts that are not already stored"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[0] != len(texts):
+            raise ValueError("Expected one vector per text")
+
+        with self._locked(exclusive=True):
+            self._refresh()
+            if self.dimension is None:
+                self.dimension = int(vectors.shape[1])
+                self._write_meta()
+            elif vectors.shape[1] != self.dimension:
+                raise ValueError(f"Expected vectors of dimension {self.dimension}")
+
+            new_entries = []
+            new_rows = []
+            seen = set()
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                if key in self._rows or key in seen:
+                    continue
+                seen.add(key)
+                new_entries.append(key)
+                new_rows.append(vector)
+            if not new_entries:
+                return 0
+
+            row_bytes = self.dimension * 4
+            with open(self.vectors_path, "ab") as f:
+                # Drop any partial row left behind by an interrupted write
+                size = f.tell()
+                if size % row_bytes:
+                    f.truncate(size - size % row_bytes)
+                    f.seek(0, os.SEEK_END)
+                first_row = f.tell() // row_bytes
+                f.write(np.asarray(new_rows, dtype=np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            with open(self.manifest_path, "a") as f:
+                for offset, key in enumerate(new_entries):
+                    f.write(json.dumps({"key": key, "row": first_row + offset}) + "\n")
+            self._refresh()
+        return len(new_entries)
+
+    def get_or_compute(self, texts, encode, chunk_size=None):
+        """Return a float32 array of vectors for texts, encoding only the uncached ones.
+
+        encode receives a list of texts and must return an array of shape (n, dimension).
+        When chunk_size is set, misses are encoded and stored chunk by chunk so an
+        interrupted run keeps the vectors it already computed.
+        """
+        vectors, missing = self.lookup(texts)
+        if not missing:
+            return vectors
+
+        step = chunk_size or len(missing)
+        for begin in range(0, len(missing), step):
+            positions = missing[begin:begin + step]
+            missing_texts = [texts[i] for i in positions]
+            computed = np.asarray(encode(missing_texts), dtype=np.float32)
+            self.add(missing_texts, computed)
+            if vectors is None:
+                vectors = np.zeros((len(texts), computed.shape[1]), dtype=np.float32)
+            vectors[positions] = computed
+        return vectors
@@ -1,6 +1,14 @@
 # Improved Fin AI Engine with fallback information
-import yaml
-import re
+import logging
+from src.config import config as app_config
+from src.relevance import relevance_matcher, parsed_documents, FINANCIAL_TERMS
+from src.history import HistoryCompactor
+from src.knowledge_base import embed_texts
+from src.topics import TOPICS_PATH, TopicCatalog
+from src.logs import get_logger
+from src.metrics import stage_timer, timed_stage
+
+logger = get_logger(__name__)
 
 def validate_response(response):
     # Simple validation function
@@ -9,80 +17,73 @@ def validate_response(response):
     return response
 
 class FinancialAI:
-    def __init__(self):
-        # Load config
-        with open("config.yaml", "r") as f:
-            self.config = yaml.safe_load(f)
-        
-        print("Using improved Financial Q&A engine with fallbacks...")
-        
-        # Initialize fallback information for common financial topics
-        self.fallback_info = {
-            'roth ira': """
-A Roth IRA is a retirement account with tax advantages:
-1. Contributions are made with after-tax dollars
-2. Qualified withdrawals in retirement are tax-free
-3. No required minimum distributions (RMDs) during your lifetime
-4. Flexibility to withdraw contributions (not earnings) without penalties
-5. Good for those who expect to be in a higher tax bracket in retirement
-
-Note: This is general information. Please consult with our financial advisors for personalized advice.
-""",
-            'ira': """
-Individual Retirement Accounts (IRAs) are tax-advantaged accounts designed to help you save for retirement:
-1. Traditional IRAs may offer tax-deductible contributions
-2. Roth IRAs offer tax-free withdrawals in retirement
-3. Contribution limits apply ($6,500 for 2023, $7,500 if over 50)
-4. Early withdrawal penalties may apply before age 59½
-5. Various investment options available within the account
-
-Note: This is general information. Please consult with our financial advisors for personalized advice.
-""",
-            '401k': """
-A 401(k) is an employer-sponsored retirement plan with these features:
-1. Tax-deferred contributions that reduce your taxable income
-2. Employer matching contributions may be available
-3. Higher contribution limits than IRAs
-4. Limited investment options selected by your employer
-5. Loans may be available from your account
-
-Note: This is general information. Please consult with our financial advisors for personalized advice.
-"""
-        }
+    def __init__(self, config=None):
+        self.config = app_config if config is None else config
+        
+        logger.info("Using improved Financial Q&A engine with fallbacks...")
+        
+        # Minimum fused relevance (0-1) for hybrid retrieval results
+        self.min_relevance = (self.config.get("retrieval") or {}).get("min_relevance", 0.3)
+        
+        # General answers for common financial topics (data/topics.json), found by
+        # keyword after a retrieval miss or routed by query embedding before retrieval
+        topics_config = self.config.get("topics") or {}
+        self.route_before_retrieval = topics_config.get("route_before_retrieval", True)
+        self.topic_catalog = TopicCatalog.load(
+            topics_config.get("path", TOPICS_PATH),
+            encode=embed_texts,
+            min_similarity=topics_config.get("min_similarity", 0.8),
+            min_margin=topics_config.get("min_margin", 0.05),
+        )
+        
+        # Recent topics are carried over between turns within a bounded budget
+        history_config = self.config.get("history") or {}
+        self.history_compactor = HistoryCompactor(
+            max_turns=history_config.get("max_turns", 3),
+            max_chars=history_config.get("max_chars", 300),
+            topic_terms=FINANCIAL_TERMS | {topic.name for topic in self.topic_catalog.topics},
+        )
 
     def generate_response(self, query: str, context, history: list = None) -> str:
         try:
-            # Prepend history to query if available
-            if history:
-                history_text = "\n".join([f"Previous Q: {h_query}\nPrevious A: {h_response}" for h_query, h_response in history])
-                query = f"{history_text}\n\nCurrent Q: {query}"
+            # Carry topics from recent turns over instead of the whole transcript.
+            # match_query is used for relevance checks, query is what we echo back.
+            match_query = self.compact_history(query, history).text
 
             # If we have context items
             if isinstance(context, list) and context:
+                # Hybrid retrieval results carry a fused 'relevance' (higher is better)
+                hybrid_search = any('relevance' in item for item in context)
                 # Check if the results come from vector search (will have 'score' field)
                 vector_search = any('score' in item for item in context)
                 
-                if vector_search:
+                if hybrid_search:
+                    relevant_items = self._filter_by_relevance(context)
+                    if relevant_items:
+                        answer = self._format_combined_response(query, relevant_items, match_query)
+                    else:
+                        answer = self._get_fallback_response(query, match_query)
+                elif vector_search:
                     # For vector search results, use semantic relevance
                     relevant_items = self._filter_by_vector_relevance(context)
                     if relevant_items:
-                        answer = self._format_combined_response(query, relevant_items)
+                        answer = self._format_combined_response(query, relevant_items, match_query)
                     else:
-                        answer = self._get_fallback_response(query)
+                        answer = self._get_fallback_response(query, match_query)
                 else:
                     # For keyword search results
                     if len(context) == 1:
                         # If only one item, use it directly
-                        answer = self._format_single_response(query, context[0])
+                        answer = self._format_single_response(query, context[0], match_query)
                     else:
                         # If multiple items, combine them
-                        answer = self._format_combined_response(query, context)
+                        answer = self._format_combined_response(query, context, match_query)
             else:
                 # No relevant information found, try fallback information
-                answer = self._get_fallback_response(query)
+                answer = self._get_fallback_response(query, match_query)
             
         except Exception as e:
-            print(f"Error: {str(e)}")
+            logger.exception("Error generating response")
             answer = f"Error generating response: {str(e)}"
         
         return validate_response(answer)
@@ -92,67 +93,76 @@ Note: This is general information. Please consult with our financial advisors fo
         # Only keep items with a score below a threshold (lower is better in L2 distance)
         # The threshold depends on the embedding model and may need tuning
         # For all-MiniLM-L6-v2 with L2 distance, a higher threshold is needed
-        relevant_items = [item for item in items if item.get('score', float('inf')) < 20.0]
+        with stage_timer("filter"):
+            relevant_items = [item for item in items if item.get('score', float('inf')) < 20.0]
+            
+            # Sort by score (lower is better)
+            relevant_items.sort(key=lambda x: x.get('score', float('inf')))
         
-        # Print debug info
-        print(f"Vector search found {len(items)} items, {len(relevant_items)} are below threshold")
-        for item in items:
-            if 'text' in item and 'score' in item:
-                preview = item['text'][:50].replace('\n', ' ')
-                print(f"Item score: {item['score']:.4f}, text: '{preview}...'")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Vector relevance filter", extra={"fields": {
+                "items": len(items), "below_threshold": len(relevant_items),
+                "scores": [round(item['score'], 4) for item in items if 'score' in item],
+            }})
+        
+        return relevant_items
+    
+    def _filter_by_relevance(self, items):
+        """Filter hybrid search results by their fused relevance"""
+        with stage_timer("filter"):
+            relevant_items = [item for item in items if item.get('relevance', 0.0) >= self.min_relevance]
+            
+            # Sort by relevance (higher is better)
+            relevant_items.sort(key=lambda x: x.get('relevance', 0.0), reverse=True)
         
-        # Sort by score (lower is better)
-        relevant_items.sort(key=lambda x: x.get('score', float('inf')))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Hybrid relevance filter", extra={"fields": {
+                "items": len(items), "above_min_relevance": len(relevant_items),
+            }})
         
         return relevant_items
     
-    def _format_single_response(self, query, item):
+    def compact_history(self, query, history=None):
+        """Return the query with topics from recent turns, see src/history.py"""
+        return self.history_compactor.compact(query, history)
+    
+    @timed_stage("format")
+    def _format_single_response(self, query, item, match_query=None):
         """Format a response from a single knowledge base item"""
-        text = item['text']
+        match_query = match_query or query
+        # Question/answer fields are parsed once when the knowledge base loads
+        document = parsed_documents.get(item)
         
         # If it's a FAQ (Q&A format)
-        if text.startswith("Q:"):
-            parts = text.split("\nA:")
-            if len(parts) > 1:
-                question = parts[0].replace("Q:", "").strip()
-                answer = parts[1].strip()
-                
-                # Check if this is actually relevant to the query
-                if self._is_relevant_to_query(query, question, answer):
-                    return f"{answer}\n\nThis information is from our FAQ on: {question}"
-                else:
-                    # If not relevant, try fallback
-                    return self._get_fallback_response(query)
+        if document.is_faq:
+            # Check if this is actually relevant to the query
+            if relevance_matcher.is_relevant(match_query, document):
+                return f"{document.answer}\n\nThis information is from our FAQ on: {document.question}"
+            else:
+                # If not relevant, try fallback
+                return self._get_fallback_response(query, match_query)
         
         # For other types of content, check relevance
-        if self._is_relevant_to_query(query, "", text):
-            return f"{text}\n\nSource: {item.get('source', 'Knowledge Base')}"
+        if relevance_matcher.is_relevant(match_query, document):
+            return f"{document.text}\n\nSource: {item.get('source', 'Knowledge Base')}"
         else:
-            return self._get_fallback_response(query)
+            return self._get_fallback_response(query, match_query)
     
-    def _format_combined_response(self, query, items):
+    @timed_stage("format")
+    def _format_combined_response(self, query, items, match_query=None):
         """Format a response from multiple knowledge base items"""
+        match_query = match_query or query
         response_parts = []
         sources = set()
         
         for item in items:
-            text = item['text']
             sources.add(item.get('source', 'Knowledge Base'))
+            document = parsed_documents.get(item)
             
-            # If it's a FAQ (Q&A format)
-            if text.startswith("Q:"):
-                parts = text.split("\nA:")
-                if len(parts) > 1:
-                    question = parts[0].replace("Q:", "").strip()
-                    answer = parts[1].strip()
-                    
-                    # For vector search results, we already filtered by relevance
-                    if 'score' in item or self._is_relevant_to_query(query, question, answer):
-                        response_parts.append(answer)
-            else:
-                # For vector search results, we already filtered by relevance
-                if 'score' in item or self._is_relevant_to_query(query, "", text):
-                    response_parts.append(text)
+            # For vector and hybrid search results, we already filtered by relevance
+            if 'score' in item or 'relevance' in item or relevance_matcher.is_relevant(match_query, document):
+                # For FAQs (Q&A format) only the answer is used
+                response_parts.append(document.answer)
         
         # If we have relevant parts, use them
         if response_parts:
@@ -161,40 +171,34 @@ Note: This is general information. Please consult with our financial advisors fo
             return f"Here's what I found about '{query}':\n\n{combined}\n\nSource: {source_text}"
         else:
             # If no relevant parts, use fallback
-            return self._get_fallback_response(query)
+            return self._get_fallback_response(query, match_query)
     
-    def _is_relevant_to_query(self, query, question, answer):
-        """Determine if a response is actually relevant to the query"""
-        query_lower = query.lower()
-        combined_text = (question + " " + answer).lower()
-        
-        # Extract key terms from query
-        query_terms = set(re.findall(r'\b\w+\b', query_lower))
-        
-        # Check for key financial terms in both query and response
-        financial_terms = ['ira', 'roth', '401k', 'retirement', 'investment', 'fund', 'stock', 'bond', 'fee', 'fees', 'commission', 'cost']
-        query_fin_terms = [term for term in financial_terms if term in query_lower]
-        
-        # If query has financial terms, make sure at least one is in the response
-        if query_fin_terms:
-            return any(term in combined_text for term in query_fin_terms)
-        
-        # Otherwise, check if at least half of query terms are in the response
-        matching_terms = sum(1 for term in query_terms if term in combined_text and len(term) > 3)
-        return matching_terms >= len(query_terms) / 3  # At least 1/3 of terms match
+    def _format_topic_response(self, topic):
+        return f"{topic.answer}\n\nNote: This is general information not specific to our services. For personalized advice, please contact our financial advisors."
     
-    def _get_fallback_response(self, query):
+    def route_topics(self, query_embeddings):
+        """Answers for queries that confidently match a catalog topic, None for the others.
+
+        Takes the (queries, dimension) query embeddings; one similarity product covers all topics.
+        """
+        if not self.route_before_retrieval:
+            return [None] * len(query_embeddings)
+        with stage_timer("route"):
+            topics = self.topic_catalog.route(query_embeddings)
+        return [self._format_topic_response(topic) if topic is not None else None for topic in topics]
+    
+    def _get_fallback_response(self, query, match_query=None):
         """Provide fallback information when knowledge base doesn't have relevant info"""
-        query_lower = query.lower()
-        
-        # Check for specific financial topics
-        for topic, info in self.fallback_info.items():
-            if topic in query_lower:
-                return f"{info}\n\nNote: This is general information not specific to our services. For personalized advice, please contact our financial advisors."
+        # Check for specific financial topics (the longest matching keyword wins)
+        topic = self.topic_catalog.find(match_query or query)
+        if topic is not None:
+            return self._format_topic_response(topic)
         
         # Generic fallback
         return f"I don't have specific information about '{query}' in my knowledge base. Please try asking about our investment services, fees, account setup, or contact information. For personalized financial advice, please contact our advisors."
 
 # Initialize the AI engine
 fin_ai = FinancialAI()
-generate_response = fin_ai.generate_response
\ No newline at end of file
+generate_response = fin_ai.generate_response
+compact_history = fin_ai.compact_history
+route_topics = fin_ai.route_topics
\ No newline at end of file
@@ -0,0 +1,60 @@
+# Conversation history compaction
+##### src/history.py #####
+import re
+
+from src.relevance import FINANCIAL_TERMS, TermMatcher
+
+# Upper-case acronyms such as IRA, HSA or ETF
+ACRONYM_RE = re.compile(r'\b[A-Z][A-Z0-9]{1,}\b')
+
+
+class CompactedQuery:
+    """A query plus the topics carried over from earlier turns"""
+
+    __slots__ = ("query", "topics", "text")
+
+    def __init__(self, query, topics, text):
+        self.query = query  # What the user asked this turn
+        self.topics = topics  # Topics added from earlier turns
+        self.text = text  # Query used for retrieval and relevance matching
+
+
+class HistoryCompactor:
+    """Turn a conversation history into a short, bounded retrieval query.
+
+    Only the queries of the last max_turns turns are looked at, and only the
+    topic entities in them (known financial terms and acronyms) are kept.
+    They are added to the current query when it does not name a topic of its
+    own, e.g. "What are its benefits?" after "What is a Roth IRA?" becomes
+    "What are its benefits? roth ira". The result never exceeds max_chars
+    unless the current query alone does.
+    """
+
+    def __init__(self, max_turns=3, max_chars=300, topic_terms=FINANCIAL_TERMS):
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.topic_matcher = TermMatcher(topic_terms)
+
+    def topics(self, text):
+        """Return topic entities in text, dropping ones contained in a longer topic"""
+        found = set(self.topic_matcher.find(text))
+        found.update(acronym.lower() for acronym in ACRONYM_RE.findall(text))
+        return [topic for topic in sorted(found, key=len, reverse=True)
+                if not any(topic != other and topic in other for other in found)]
+
+    def compact(self, query, history=None):
+        if not history or self.max_turns <= 0 or self.topics(query):
+            return CompactedQuery(query, [], query)
+
+        topics = []
+        budget = self.max_chars - len(query)
+        # Most recent turns first, so their topics win when the budget runs out
+        for previous_query, _ in reversed(list(history)[-self.max_turns:]):
+            for topic in self.topics(previous_query):
+                if any(topic in kept for kept in topics) or len(topic) + 1 > budget:
+                    continue
+                topics.append(topic)
+                budget -= len(topic) + 1
+
+        text = " ".join([query] + topics)
+        return CompactedQuery(query, topics, text)
@@ -0,0 +1,98 @@
+# FAISS index construction for the configured index type
+##### src/index_factory.py #####
+import faiss
+import numpy as np
+
+from src.logs import get_logger
+
+logger = get_logger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# faiss warns below this many training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+DEFAULTS = {
+    "type": "flat",
+    "nlist": 1024,        # IVF: number of inverted lists (clamped for small corpora)
+    "nprobe": 16,         # IVF: lists visited per query
+    "pq_m": 16,           # IVF-PQ: sub-quantizers, must divide the vector dimension
+    "pq_bits": 8,         # IVF-PQ: bits per sub-quantizer code
+    "hnsw_m": 32,         # HNSW: neighbors per node
+    "ef_construction": 200,
+    "ef_search": 64,      # HNSW: candidate list size at query time
+    "rerank": None,       # Rescore with exact vectors; defaults to on for ivf_pq
+    "rerank_factor": 4,   # Candidates fetched per requested result when reranking
+}
+
+
+def index_settings(config=None):
+    """Merge an index config section with the defaults and validate it"""
+    settings = dict(DEFAULTS)
+    settings.update(config or {})
+    if settings["type"] not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{settings['type']}', expected one of {INDEX_TYPES}")
+    if settings["rerank"] is None:
+        settings["rerank"] = settings["type"] == "ivf_pq"
+    return settings
+
+
+def _ivf_nlist(settings, n):
+    # Keep enough training points per list; tiny corpora end up with a single list
+    return max(1, min(settings["nlist"], n // MIN_POINTS_PER_CENTROID))
+
+
+def build_index(vectors, ids, config=None):
+    """Build, train and fill an ID-mapped FAISS index of the configured type.
+
+    Every type uses the L2 metric, so scores stay squared L2 distances and the
+    relevance threshold in FinancialAI applies to all of them.
+    """
+    settings = index_settings(config)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dimension = vectors.shape
+    index_type = settings["type"]
+
+    if index_type == "ivf_pq" and n < 2 ** settings["pq_bits"]:
+        logger.warning("Only %d vectors, too few to train PQ codebooks; using ivf_flat instead", n)
+        index_type = "ivf_flat"
+
+    if index_type == "flat":
+        base = faiss.IndexFlatL2(dimension)
+    elif index_type == "hnsw":
+        base = faiss.IndexHNSWFlat(dimension, settings["hnsw_m"])
+        base.hnsw.efConstruction = settings["ef_construction"]
+    else:
+        nlist = _ivf_nlist(settings, n)
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == "ivf_flat":
+            base = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_L2)
+        else:
+            if dimension % settings["pq_m"]:
+                raise ValueError(f"pq_m={settings['pq_m']} does not divide dimension {dimension}")
+            base = faiss.IndexIVFPQ(quantizer, dimension, nlist, settings["pq_m"], settings["pq_bits"])
+        # Train on the corpus vectors themselves
+        base.train(vectors)
+
+    index = faiss.IndexIDMap(base)
+    index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+    configure_search(index, settings)
+    return index
+
+
+def configure_search(index, config=None):
+    """Apply query-time parameters (nprobe / efSearch) that match the index type"""
+    settings = index_settings(config)
+    params = faiss.ParameterSpace()
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(base, faiss.IndexIVF):
+        params.set_index_parameter(index, "nprobe", settings["nprobe"])
+    elif isinstance(base, faiss.IndexHNSW):
+        params.set_index_parameter(index, "efSearch", settings["ef_search"])
+    return index
+
+
+def is_approximate(index):
+    """True if the index stores compressed vectors, so its distances are estimates"""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    return isinstance(base, faiss.IndexIVFPQ)
@@ -0,0 +1,91 @@
+# Process-wide holder for the loaded FAISS index
+##### src/index_manager.py #####
+import hashlib
+import os
+import threading
+
+import faiss
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Return the sha256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class IndexManager:
+    """Keep a single FAISS index in memory and reload it only when the file on disk changes.
+
+    Readers call get() without taking a lock. A reload builds the new index
+    completely before publishing it with one reference assignment, so a
+    concurrent reader sees either the old index or the new one, never a
+    partially loaded one.
+    """
+
+    def __init__(self, path, loader=None):
+        self.path = path
+        self._loader = loader or faiss.read_index
+        self._lock = threading.Lock()  # Serializes reloads and publishes
+        self._index = None
+        self._stat = None  # (mtime_ns, size) of the file the index came from
+        self._digest = None
+
+    @property
+    def digest(self):
+        """sha256 of the index file the in-memory index came from (None before one is loaded)"""
+        return self._digest
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def get(self):
+        """Return the current index, reloading it first if the file has changed"""
+        stat = self._file_stat()
+        if stat is not None and stat != self._stat:
+            self._reload(stat)
+        return self._index
+
+    def _reload(self, stat):
+        with self._lock:
+            # Another thread may have reloaded while we waited for the lock
+            if stat == self._stat:
+                return
+            digest = file_digest(self.path)
+            if digest == self._digest:
+                # The file was touched or rewritten with identical content
+                self._stat = stat
+                return
+            index = self._loader(self.path)
+            self._index = index
+            self._digest = digest
+            self._stat = stat
+
+    def publish(self, index):
+        """Write an index to disk atomically and make it the in-memory index"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            tmp_path = f"{self.path}.tmp.{os.getpid()}.{threading.get_ident()}"
+            faiss.write_index(index, tmp_path)
+            digest = file_digest(tmp_path)
+            # os.replace is atomic, so other processes never read a partial file
+            os.replace(tmp_path, self.path)
+            self._index = index
+            self._digest = digest
+            self._stat = self._file_stat()
+        return index
+
+    def clear(self):
+        """Drop the in-memory index so the next get() reads it from disk again"""
+        with self._lock:
+            self._index = None
+            self._stat = None
+            self._digest = None
@@ -0,0 +1,226 @@
+# Streaming ingestion of FAQ, article and PDF exports into the document store
+##### src/ingest.py #####
+"""Build data/knowledge_base.jsonl from large exports without loading them into memory.
+
+Usage:
+    python -m src.ingest data/faq.json data/help_articles.json export.jsonl articles.csv
+
+Sources are read one record at a time: JSONL, CSV (with a header row), a
+JSON array, or a PDF (one item per page). Records need either question and
+answer, title and content, or text fields; an optional id column keeps ids
+stable across re-ingestion. Embeddings for every chunk are computed in
+batches during the same pass and stored in the embedding cache, so the
+server only has to build the FAISS index when it starts.
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+
+from src.chunking import chunk_item, chunk_settings, iter_pdf_pages
+from src.document_store import DocumentStoreWriter
+from src.config import config_path, load_config
+from src.embedding_backends import DEFAULT_BACKEND, DEFAULT_MODELS_DIR, cache_name, create_backend
+from src.embedding_store import EmbeddingStore
+
+# Same defaults as src/knowledge_base.py
+DEFAULT_OUTPUT = "data/knowledge_base.jsonl"
+DEFAULT_EMBEDDINGS_DIR = "embeddings"
+DEFAULT_MODEL = 'all-MiniLM-L6-v2'
+
+# Whitespace and commas between elements of a JSON array
+JSON_SEPARATOR_RE = re.compile(r'[\s,]*')
+# Individual skipped records are reported up to this many times
+MAX_REPORTED_ERRORS = 20
+
+
+def iter_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_csv(path):
+    csv.field_size_limit(2 ** 31 - 1)  # Article bodies can be far above the 128 KB default
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def iter_json_array(path, read_size=1 << 20):
+    """Yield the elements of a top-level JSON array, reading read_size characters at a time"""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(read_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{path}: expected a JSON array")
+        position = 1
+        while True:
+            position = JSON_SEPARATOR_RE.match(buffer, position).end()
+            if buffer.startswith("]", position):
+                return
+            try:
+                if position == len(buffer):
+                    raise json.JSONDecodeError("Need more data", buffer, position)
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                more = f.read(read_size)
+                if not more:
+                    raise
+                buffer = buffer[position:] + more
+                position = 0
+                continue
+            yield record
+            if position > read_size:
+                buffer = buffer[position:]
+                position = 0
+
+
+def iter_pdf(path):
+    """One knowledge base item per page of a PDF, titled after the file name"""
+    title = os.path.splitext(os.path.basename(path))[0].replace("_", " ")
+    for page_number, text in iter_pdf_pages(path):
+        yield {"text": f"{title} (page {page_number})\n{text}", "source": "PDF"}
+
+
+def iter_source(path):
+    """Pick a reader from the file extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".ndjson"):
+        return iter_jsonl(path)
+    if extension == ".csv":
+        return iter_csv(path)
+    if extension == ".json":
+        return iter_json_array(path)
+    if extension == ".pdf":
+        return iter_pdf(path)
+    raise ValueError(f"Unsupported source '{path}', expected .jsonl, .ndjson, .csv, .json or .pdf")
+
+
+def _field(record, name):
+    value = record.get(name)
+    if value is None:
+        return ""
+    # Unify line endings from CSV/Windows exports, trim surrounding whitespace
+    return str(value).replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+def normalize_record(record):
+    """Turn a source record into a knowledge base item, or raise ValueError"""
+    if not isinstance(record, dict):
+        raise ValueError("record is not an object")
+    question, answer = _field(record, "question"), _field(record, "answer")
+    title, content = _field(record, "title"), _field(record, "content")
+    if question and answer:
+        text, source = f"Q: {question}\nA: {answer}", "FAQ"
+    elif title and content:
+        text, source = f"{title}\n{content}", "Help Article"
+    elif _field(record, "text"):
+        text, source = _field(record, "text"), "Document"
+    else:
+        raise ValueError("needs question and answer, title and content, or text")
+
+    item = {"text": text, "source": _field(record, "source") or source}
+    doc_id = _field(record, "id")
+    if doc_id:
+        try:
+            item["id"] = int(doc_id)
+        except ValueError:
+            raise ValueError(f"id '{doc_id}' is not an integer") from None
+        if item["id"] < 0:
+            raise ValueError(f"id {item['id']} is negative")
+    return item
+
+
+class _Embedder:
+    """Fill the embedding cache for items, a few batches at a time"""
+
+    def __init__(self, model_name, backend, models_dir, embeddings_dir, batch_size, chunking):
+        self.model = create_backend(backend, model_name, models_dir)
+        self.store = EmbeddingStore(embeddings_dir, cache_name(model_name, backend))
+        self.batch_size = batch_size
+        self.chunking = chunking
+        self.pending = []
+        self.encoded = 0
+
+    def _encode(self, texts):
+        self.encoded += len(texts)
+        return self.model.encode(texts, batch_size=self.batch_size)
+
+    def add(self, item):
+        self.pending.extend(embedded for embedded, _ in chunk_item(item, self.chunking))
+        if len(self.pending) >= self.batch_size * 16:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.store.get_or_compute(self.pending, self._encode, chunk_size=self.batch_size * 16)
+            self.pending = []
+
+
+def ingest(sources, output=DEFAULT_OUTPUT, embed=True, config=None):
+    """Stream sources into a new document store at output. Returns counts."""
+    kb_config = (config or {}).get("knowledge_base") or {}
+    embedder = None
+    if embed:
+        embedder = _Embedder(
+            kb_config.get("embedding_model", DEFAULT_MODEL),
+            kb_config.get("embedding_backend", DEFAULT_BACKEND),
+            kb_config.get("models_dir", DEFAULT_MODELS_DIR),
+            DEFAULT_EMBEDDINGS_DIR,
+            kb_config.get("embedding_batch_size", 64),
+            chunk_settings(kb_config.get("chunking")),
+        )
+
+    counts = {"items": 0, "skipped": 0, "duplicates": 0, "encoded": 0}
+    seen_ids = set()  # The store keeps the last item per id, so a repeated id would drop one silently
+    start = time.perf_counter()
+    with DocumentStoreWriter(output) as writer:
+        for path in sources:
+            for number, record in enumerate(iter_source(path), start=1):
+                try:
+                    item = normalize_record(record)
+                    # Items without an id get their position, like knowledge_base.json
+                    item = {"id": item.pop("id", counts["items"]), **item}
+                    if item["id"] in seen_ids:
+                        counts["duplicates"] += 1
+                        raise ValueError(f"id {item['id']} is already used by an earlier record")
+                except ValueError as e:
+                    counts["skipped"] += 1
+                    if counts["skipped"] <= MAX_REPORTED_ERRORS:
+                        print(f"Skipping {path} record {number}: {e}")
+                    continue
+                seen_ids.add(item["id"])
+                writer.add(item)
+                counts["items"] += 1
+                if embedder is not None:
+                    embedder.add(item)
+                if counts["items"] % 10000 == 0:
+                    print(f"Ingested {counts['items']} items ({time.perf_counter() - start:.0f}s)")
+            print(f"Read {path}")
+        if embedder is not None:
+            embedder.flush()
+            counts["encoded"] = embedder.encoded
+    print(f"Wrote {counts['items']} items to {output} in {time.perf_counter() - start:.1f}s "
+          f"({counts['skipped']} skipped, {counts['duplicates']} of them duplicate ids, "
+          f"{counts['encoded']} texts encoded)")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream FAQ/article exports into the knowledge base document store")
+    parser.add_argument("sources", nargs="+", help=".jsonl, .ndjson, .csv, .json (array) or .pdf files")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help=f"document store to write (default {DEFAULT_OUTPUT})")
+    parser.add_argument("--no-embed", action="store_true", help="skip computing embeddings; the server computes them at startup")
+    parser.add_argument("--config", default=config_path)
+    args = parser.parse_args(argv)
+
+    counts = ingest(args.sources, args.output, embed=not args.no_embed, config=load_config(args.config))
+    return 0 if counts["items"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,7 @@
+import glob
 import json
-import os
+
+from src.ingest import iter_pdf
 
 # Load FAQ data
 with open("data/faq.json", "r") as f:
@@ -26,6 +28,11 @@ for item in help_data:
         "source": "Help Article"
     })
 
+# Add PDFs, one item per page so a large PDF never has to be held in memory at once.
+# Long pages are split further into chunks when the index is built.
+for path in sorted(glob.glob("data/*.pdf")):
+    knowledge_base.extend(iter_pdf(path))
+
 # Save combined knowledge base
 with open("data/knowledge_base.json", "w") as f:
     json.dump(knowledge_base, f, indent=2)
@@ -1,78 +1,235 @@
-# Email, WhatsApp, SMS, Live Chat integration 
+# Email, WhatsApp, SMS, Live Chat integration
 ##### src/integrations.py #####
 
 # Integration handlers for different channels
-import yaml
-from twilio.rest import Client
+import logging
+import queue
 import smtplib
+import threading
 from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 
-class IntegrationManager:
-    def __init__(self):
-        # Load config
-        with open("config.yaml", "r") as f:
-            self.config = yaml.safe_load(f)
-        
-        print("Using Twilio WhatsApp integration...")
-        
-        # Initialize Twilio client
-        if self.config["integrations"]["whatsapp"]["enabled"]:
-            try:
-                self.twilio_client = Client(
-                    self.config["integrations"]["whatsapp"]["twilio_account_sid"],
-                    self.config["integrations"]["whatsapp"]["twilio_auth_token"]
-                )
-                print("Twilio client initialized successfully")
-            except Exception as e:
-                print(f"Error initializing Twilio client: {str(e)}")
-    
-    def send_email(self, to_email: str, response: str):
-        """Send response via email (simplified)"""
-        print(f"[EMAIL] To: {to_email}")
-        print(f"[EMAIL] Message: {response}")
-        return True
-    
-    def send_whatsapp(self, to_number: str, response: str):
-        """Send response via WhatsApp"""
-        if not self.config["integrations"]["whatsapp"]["enabled"]:
-            print("WhatsApp integration is disabled")
-            return
-        
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.config import config as app_config
+from src.delivery import DeliveryError
+from src.logs import get_logger
+
+logger = get_logger(__name__)
+
+TWILIO_API_BASE_URL = "https://api.twilio.com"
+
+
+class TwilioWhatsAppSender:
+    """Sends WhatsApp messages through the Twilio REST API over pooled keep-alive connections"""
+
+    def __init__(self, account_sid, auth_token, from_number, api_base_url=TWILIO_API_BASE_URL,
+                 pool_size=10, timeout=10.0):
+        self.from_number = from_number
+        self.timeout = timeout
+        self.messages_url = f"{api_base_url.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        # One session for all workers: TLS connections are reused instead of set up per message
+        self.session = requests.Session()
+        self.session.auth = (account_sid, auth_token)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def send(self, to_number, body):
         try:
-            # Format the phone number correctly
-            if not to_number.startswith("+"):
-                to_number = "+" + to_number
-            
-            # Remove any spaces or dashes
-            to_number = to_number.replace(" ", "").replace("-", "")
-            
-            print(f"Sending WhatsApp message to {to_number}")
-            
-            message = self.twilio_client.messages.create(
-                body=response,
-                from_=f"whatsapp:{self.config['integrations']['whatsapp']['from_number']}",
-                to=f"whatsapp:{to_number}"
+            reply = self.session.post(
+                self.messages_url,
+                data={"From": f"whatsapp:{self.from_number}", "To": f"whatsapp:{to_number}", "Body": body},
+                timeout=self.timeout,
             )
-            print(f"WhatsApp message sent successfully: {message.sid}")
+        except requests.RequestException as e:
+            raise DeliveryError(f"Twilio request failed: {e}")
+
+        if reply.status_code < 300:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("WhatsApp message sent", extra={"fields": {"sid": reply.json().get('sid')}})
             return True
-            
-        except Exception as e:
-            print(f"Error sending WhatsApp message: {str(e)}")
-            return False
+        error = f"Twilio returned {reply.status_code}: {reply.text[:200]}"
+        if reply.status_code == 429:
+            retry_after = reply.headers.get("Retry-After")
+            raise DeliveryError(error, retry_after=float(retry_after) if retry_after else None)
+        # 5xx is worth retrying; other 4xx (bad number, bad credentials) will not get better
+        raise DeliveryError(error, retryable=reply.status_code >= 500)
+
+    def close(self):
+        self.session.close()
+
+
+class SMTPPool:
+    """A small pool of logged-in SMTP connections shared by the delivery workers"""
+
+    def __init__(self, host, port=587, sender=None, password=None, username=None, use_tls=True,
+                 size=2, timeout=10.0):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username or sender
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            connection.starttls()
+        if self.password:
+            connection.login(self.username, self.password)
+        return connection
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _checkin(self, connection):
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            self._quit(connection)
+
+    @staticmethod
+    def _quit(connection):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    def send(self, to_email, message):
+        # An idle connection may have been closed by the server; reconnect once before giving up
+        for attempt in range(2):
+            try:
+                connection = self._checkout() if attempt == 0 else self._connect()
+            except (smtplib.SMTPException, OSError) as e:
+                raise DeliveryError(f"SMTP connection failed: {e}")
+            try:
+                connection.sendmail(self.sender, [to_email], message.as_string())
+            except smtplib.SMTPRecipientsRefused as e:
+                self._checkin(connection)
+                raise DeliveryError(f"Recipient refused: {e.recipients}", retryable=False)
+            except smtplib.SMTPException as e:
+                if not isinstance(e, smtplib.SMTPServerDisconnected):
+                    self._quit(connection)
+                    raise DeliveryError(f"SMTP error: {e}")
+                error = e
+            except OSError as e:  # Socket timeouts and resets; SMTPException is an OSError too, so it goes first
+                error = e
+            else:
+                self._checkin(connection)
+                return True
+            connection.close()
+            if attempt == 1:
+                raise DeliveryError(f"SMTP connection lost: {error}")
+
+    def close(self):
+        while True:
+            try:
+                self._quit(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+class IntegrationManager:
+    def __init__(self, config=None):
+        self.config = app_config if config is None else config
+        integrations = self.config.get("integrations") or {}
+        self.whatsapp_config = integrations.get("whatsapp") or {}
+        self.email_config = integrations.get("email") or {}
+        self._whatsapp_sender = None  # Built on the first message of each channel
+        self._smtp_pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def whatsapp_sender(self):
+        if self._whatsapp_sender is None:
+            with self._lock:
+                if self._whatsapp_sender is None:
+                    self._whatsapp_sender = TwilioWhatsAppSender(
+                        self.whatsapp_config["twilio_account_sid"],
+                        self.whatsapp_config["twilio_auth_token"],
+                        self.whatsapp_config["from_number"],
+                        api_base_url=self.whatsapp_config.get("api_base_url", TWILIO_API_BASE_URL),
+                        pool_size=self.whatsapp_config.get("pool_size", 10),
+                    )
+        return self._whatsapp_sender
+
+    @property
+    def smtp_pool(self):
+        if self._smtp_pool is None:
+            with self._lock:
+                if self._smtp_pool is None:
+                    self._smtp_pool = SMTPPool(
+                        self.email_config["smtp_server"],
+                        self.email_config.get("smtp_port", 587),
+                        sender=self.email_config.get("sender_email"),
+                        password=self.email_config.get("smtp_password"),
+                        username=self.email_config.get("smtp_username"),
+                        use_tls=self.email_config.get("use_tls", True),
+                        size=self.email_config.get("pool_size", 2),
+                    )
+        return self._smtp_pool
+
+    def send_email(self, to_email: str, response: str):
+        """Send response via email, or only log it when no SMTP server is configured"""
+        if not self.email_config.get("enabled") or not self.email_config.get("smtp_server"):
+            logger.info("[EMAIL] No SMTP server configured, not sending", extra={"fields": {"to": to_email}})
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[EMAIL] Message", extra={"fields": {"to": to_email, "response": response}})
+            return True
+
+        message = MIMEText(response)
+        message["Subject"] = self.email_config.get("subject", "Your question")
+        message["From"] = self.email_config.get("sender_email", "")
+        message["To"] = to_email
+        return self.smtp_pool.send(to_email, message)
+
+    def send_whatsapp(self, to_number: str, response: str):
+        """Send response via WhatsApp. Raises DeliveryError if it could not be sent."""
+        if not self.whatsapp_config.get("enabled"):
+            raise DeliveryError("WhatsApp integration is disabled", retryable=False)
+
+        # Format the phone number correctly
+        if not to_number.startswith("+"):
+            to_number = "+" + to_number
+
+        # Remove any spaces or dashes
+        to_number = to_number.replace(" ", "").replace("-", "")
+
+        return self.whatsapp_sender.send(to_number, response)
+
+    def close(self):
+        """Close pooled connections"""
+        if self._whatsapp_sender is not None:
+            self._whatsapp_sender.close()
+        if self._smtp_pool is not None:
+            self._smtp_pool.close()
 
 # Initialize integration manager
 integration_manager = IntegrationManager()
 
 def send_response_to_channel(channel: str, response: str, recipient: str = None):
-    """Route response to appropriate channel"""
-    print(f"Sending response via {channel} to {recipient}")
-    
-    if channel == "email" and recipient:
-        integration_manager.send_email(recipient, response)
-    elif channel == "whatsapp" and recipient:
-        integration_manager.send_whatsapp(recipient, response)
+    """Route response to appropriate channel. Returns True once it was delivered.
+
+    Raises DeliveryError (not retryable) for an unknown channel or a missing recipient.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Sending response", extra={"fields": {"channel": channel, "recipient": recipient}})
+
+    if channel in ("email", "whatsapp") and not recipient:
+        raise DeliveryError(f"No recipient given for {channel}", retryable=False)
+    if channel == "email":
+        return integration_manager.send_email(recipient, response)
+    elif channel == "whatsapp":
+        return integration_manager.send_whatsapp(recipient, response)
     elif channel == "chat":
-        print(f"[CHAT] Response: {response}")
-    else:
-        print(f"[UNKNOWN] Channel: {channel}, Response: {response}")
\ No newline at end of file
+        # The response already went back to the chat client in the API reply
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[CHAT] Response", extra={"fields": {"response": response}})
+        return True
+    raise DeliveryError(f"Unknown channel '{channel}'", retryable=False)
@@ -1,138 +1,715 @@
 # Simplified knowledge base implementation
+import collections
+import contextlib
 import os
 import json
+import hashlib
+import logging
+import time
+import threading
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import faiss
+from src.config import config
+from src.index_manager import IndexManager
+from src.embedding_store import EmbeddingStore
+from src.cache import LRUCache, normalize_query
+from src.index_factory import build_index, configure_search, index_settings, is_approximate
+from src.lexical_index import LexicalIndex
+from src.relevance import parsed_documents
+from src.chunking import MAX_CHUNKS, chunk_item, chunk_settings, index_text
+from src.document_store import Documents, DocumentStore, DocumentStoreWriter
+from src.embedding_backends import DEFAULT_BACKEND, DEFAULT_MODELS_DIR, cache_name, create_backend
+from src.snapshots import SNAPSHOT_DIR, SnapshotStore
+from src.logs import get_logger
+from src.metrics import stage_timer
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, single worker only
+    fcntl = None
+
+logger = get_logger(__name__)
+
+# Indexing options (all optional)
+kb_config = config.get("knowledge_base") or {}
+embedding_batch_size = kb_config.get("embedding_batch_size", 64)
+# Index type (flat, ivf_flat, ivf_pq, hnsw) and its tuning, see src/index_factory.py
+index_config = index_settings(kb_config.get("index"))
+# How long items are split before embedding, see src/chunking.py
+chunking_config = chunk_settings(kb_config.get("chunking"))
+# Chunks fetched per requested result when documents have several chunks
+chunk_overfetch = kb_config.get("chunk_overfetch", 3)
+
+# FAISS ids are doc_id * CHUNK_ID_STRIDE + chunk number, so the document of a
+# chunk is a division away and all chunks of a document form one id range
+CHUNK_ID_STRIDE = MAX_CHUNKS
+
+# Query embeddings are cached because traffic is dominated by repeated questions
+query_embedding_cache = LRUCache(
+    max_size=kb_config.get("query_cache_size", 1024),
+    ttl_seconds=kb_config.get("query_cache_ttl_seconds", 3600),
+)
 
 knowledge_base_path = "data/knowledge_base.json"
+# Written by `python -m src.ingest`; used instead of knowledge_base.json when present
+document_store_path = "data/knowledge_base.jsonl"
+# Append-only log of upserts and deletes applied on top of the base documents
+changes_path = "data/knowledge_base.changes.jsonl"
 index_path = "data/faiss_index"
-knowledge_data = []
-# Initialize the embedding model
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+embeddings_dir = "embeddings"
+# read-write: every worker loads data/ and builds or updates the index itself.
+# snapshot: workers serve the published snapshot memory-mapped and read-only,
+# sharing its pages; `python -m src.snapshots publish` builds new ones.
+serving_mode = kb_config.get("serving", "read-write")
+if serving_mode not in ("read-write", "snapshot"):
+    raise ValueError(f"Unknown knowledge_base.serving '{serving_mode}', expected 'read-write' or 'snapshot'")
+snapshot_store = SnapshotStore(kb_config.get("snapshot_dir", SNAPSHOT_DIR))
+_snapshot_version = None
+_snapshot_stat = None  # CURRENT file state when the snapshot was last checked
+_snapshot = None  # The _Corpus of the snapshot being served
+# What a search reads: the index, the documents and chunk counts its ids refer to,
+# and the vectors for exact reranking (None: the local embedding cache)
+_Corpus = collections.namedtuple("_Corpus", "index documents chunks vectors")
+# Stable document id -> item. With a document store only changed items are in memory.
+documents = Documents()
+# doc_id -> number of chunks, for items split into several chunks
+document_chunks = {}
+# Keyword index over documents, kept in sync by _apply_change
+lexical_index = LexicalIndex(text_loader=lambda doc_id: documents.get(doc_id, {}).get('text', ''))
+_changes_offset = 0  # Bytes of the change log already applied
+_generation = 0  # Bumped whenever the documents in this process change, see knowledge_base_version()
+_write_lock = threading.Lock()  # Serializes updates within this process
+# Guards the change log offset and the documents it updates. Replays run from
+# searches (after another worker published an index) and from writers.
+_replay_lock = threading.RLock()
+embedding_model_name = kb_config.get("embedding_model", 'all-MiniLM-L6-v2')
+# sentence-transformers (fp32 reference), torch-int8, onnx or onnx-int8, see src/embedding_backends.py
+embedding_backend = kb_config.get("embedding_backend", DEFAULT_BACKEND)
+models_dir = kb_config.get("models_dir", DEFAULT_MODELS_DIR)
+embedding_model = None  # Loaded on first use, see get_embedding_model()
+_model_lock = threading.Lock()
+# Set once documents are loaded and the index is built, see initialize()
+_ready = threading.Event()
+_init_lock = threading.Lock()
 
-if os.path.exists(knowledge_base_path):
-    with open(knowledge_base_path, "r") as f:
-        knowledge_data = json.load(f)
+# Vectors for knowledge base items, reused across restarts and workers
+embedding_store = EmbeddingStore(embeddings_dir, cache_name(embedding_model_name, embedding_backend))
+
+def _read_index(path):
+    logger.info("Loading index from %s", path)
+    index = configure_search(faiss.read_index(path), index_config)
+    # Another worker changed the knowledge base; pick up its documents too.
+    # The change log is always written before the index is published.
+    _replay_changes()
+    return index
+
+# Holds the loaded index for the whole process, see src/index_manager.py
+index_manager = IndexManager(index_path, loader=_read_index)
+
+def get_embedding_model():
+    """Return the embedding backend, loading the model on first use"""
+    global embedding_model
+    if embedding_model is None:
+        with _model_lock:
+            if embedding_model is None:
+                embedding_model = create_backend(embedding_backend, embedding_model_name, models_dir)
+    return embedding_model
 
 def embed_text(text: str):
     # Use the all-MiniLM-L6-v2 model to create embeddings
-    return embedding_model.encode(text).tolist()
+    return get_embedding_model().encode_one(text).tolist()
 
-def load_knowledge_base():
-    return knowledge_data
+def _freeze(embedding):
+    embedding = np.asarray(embedding, dtype=np.float32)
+    embedding.setflags(write=False)  # Shared between requests through the cache
+    return embedding
 
-def create_index(force=False):
-    """Create a FAISS index from the knowledge base data"""
-    if not knowledge_data:
-        print("No knowledge data available to index")
-        return None
+def query_key(query: str):
+    """Cache key for a query; case is folded only when the embedding model ignores it anyway"""
+    return normalize_query(query, lowercase=get_embedding_model().lowercases)
+
+def embed_query(query: str):
+    """Return the float32 embedding of a query, served from the LRU cache when possible"""
+    return query_embedding_cache.get_or_compute(
+        query_key(query), lambda: _freeze(get_embedding_model().encode_one(query))
+    )
+
+def embed_queries(queries):
+    """Return a (len(queries), dimension) float32 array, encoding all cache misses in one batch"""
+    keys = [query_key(query) for query in queries]
+    cached = [query_embedding_cache.get(key) for key in keys]
+    missing = [i for i, embedding in enumerate(cached) if embedding is None]
+    if missing:
+        encoded = get_embedding_model().encode([queries[i] for i in missing], batch_size=len(missing))
+        for i, embedding in zip(missing, encoded):
+            cached[i] = _freeze(embedding)
+            query_embedding_cache.put(keys[i], cached[i])
+    return np.vstack(cached)
+
+def embed_texts(texts, batch_size=None):
+    """Encode a list of texts in batches into a preallocated float32 array"""
+    batch_size = batch_size or embedding_batch_size
+    embedding_model = get_embedding_model()
+    dimension = embedding_model.dimension
+    embeddings = np.empty((len(texts), dimension), dtype=np.float32)
     
-    # Delete existing index if force is True
-    if force and os.path.exists(index_path):
-        os.remove(index_path)
-        print("Removed existing index to create a new one")
+    start = time.perf_counter()
+    for begin in range(0, len(texts), batch_size):
+        batch = texts[begin:begin + batch_size]
+        embeddings[begin:begin + len(batch)] = embedding_model.encode(batch, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
     
-    # Get embedding dimension from the model
-    dimension = len(embed_text("sample text"))
+    if texts:
+        rate = len(texts) / elapsed if elapsed > 0 else float('inf')
+        logger.info("Encoded %d items in %.2fs (%.1f items/sec, batch size %d)",
+                    len(texts), elapsed, rate, batch_size)
+    return embeddings
+
+def _index_document(doc_id, item, parse=True):
+    """Update the per-document structures that are precomputed at load time"""
+    text = item.get('text', '')
+    lexical_index.add(doc_id, text)
+    if parse:
+        parsed_documents.put(doc_id, text)
+    else:
+        parsed_documents.remove(doc_id)  # Parsed on first use instead
+    chunk_count = _chunk_count(item)
+    if chunk_count > 1:
+        document_chunks[doc_id] = chunk_count
+    else:
+        document_chunks.pop(doc_id, None)
+
+def _chunk_count(item):
+    return len(chunk_item(item, chunking_config)) if 'text' in item else 0
+
+def _apply_change(change):
+    global _generation
+    _generation += 1
+    doc_id = int(change["id"])
+    if change["op"] == "upsert":
+        documents[doc_id] = dict(change["item"], id=doc_id)
+        _index_document(doc_id, documents[doc_id])
+    elif change["op"] == "delete":
+        documents.pop(doc_id, None)
+        document_chunks.pop(doc_id, None)
+        lexical_index.remove(doc_id)
+        parsed_documents.remove(doc_id)
+
+def _replay_changes():
+    """Apply change log entries written since the last replay (possibly by other workers)"""
+    global _changes_offset
+    with _replay_lock:
+        if not os.path.exists(changes_path):
+            if _changes_offset:
+                _load_documents()  # The log was compacted into the base documents
+            return
+        if os.path.getsize(changes_path) < _changes_offset:
+            _load_documents()
+            return
+        with open(changes_path, "r") as f:
+            f.seek(_changes_offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # Partial line from a write in progress
+                _apply_change(json.loads(line))
+                _changes_offset += len(line.encode("utf-8"))
+
+def _reset_documents(store=None):
+    """Switch to a document store (or an empty overlay) and rebuild the per-document structures"""
+    global _generation
+    _generation += 1
+    document_chunks.clear()
+    lexical_index.clear()
+    parsed_documents.clear()
+    documents.reset(store)
+    if store is not None:
+        logger.info("Loading %d documents from %s", len(store), store.path)
+        # Stream the store once to build the in-memory indexes; text stays on disk
+        for item in store:
+            _index_document(item['id'], item, parse=False)
+
+def _load_documents():
+    """Load the document store (or knowledge_base.json) and replay the change log on top of it"""
+    global _changes_offset
+    with _replay_lock:
+        _changes_offset = 0
+        if os.path.exists(document_store_path):
+            _reset_documents(DocumentStore(document_store_path))
+        else:
+            _reset_documents()
+            if os.path.exists(knowledge_base_path):
+                with open(knowledge_base_path, "r") as f:
+                    items = json.load(f)
+                # Items without an id get their position, which is stable for the original file
+                for position, item in enumerate(items):
+                    doc_id = int(item.get('id', position))
+                    documents[doc_id] = dict(item, id=doc_id)
+                    _index_document(doc_id, documents[doc_id])
+        if os.path.exists(changes_path):
+            _replay_changes()
+
+@contextlib.contextmanager
+def _exclusive_update():
+    """Hold the write lock of this process and a lock file shared by all workers.
+
+    Taken for a whole update (replaying the log, appending to it, then cloning,
+    changing and publishing the index) so a worker never publishes an index
+    that lacks another worker's change. The lock is a file of its own because
+    compaction removes the change log.
+    """
+    with _write_lock:
+        os.makedirs(os.path.dirname(changes_path), exist_ok=True)
+        with open(f"{changes_path}.lock", "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+def _append_changes(changes):
+    """Durably append changes to the log, then apply them in memory (under _exclusive_update)"""
+    # Apply anything other workers appended first, so our offset stays correct
+    _replay_changes()
+    with open(changes_path, "a") as f:
+        for change in changes:
+            f.write(json.dumps(change) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    _replay_changes()
+
+def load_knowledge_base():
+    initialize()
+    return list(documents.values())
+
+def get_document(doc_id):
+    """Return the knowledge base item with the given id, or None"""
+    initialize()
+    return documents.get(int(doc_id))
+
+def lexical_search(query, top_k=3):
+    """Keyword (BM25) search; returns up to top_k (score, doc_id) pairs"""
+    initialize()
+    return lexical_index.search(query, top_k=top_k)
+
+def _chunk_texts(items):
+    """Return (chunk ids, texts to embed) for every chunk of items that have text"""
+    ids = []
+    texts = []
+    for item in items:
+        if 'text' not in item:
+            continue
+        for chunk_number, (embedded, _) in enumerate(chunk_item(item, chunking_config)):
+            ids.append(item['id'] * CHUNK_ID_STRIDE + chunk_number)
+            texts.append(embedded)
+    return np.array(ids, dtype=np.int64), texts
+
+def _embed_documents(items):
+    """Return (chunk ids, vectors) for every chunk of items that have text, using the embedding cache"""
+    ids, texts = _chunk_texts(items)
+    if not texts:
+        return ids, None
+    # Reuse cached vectors and only encode new or changed items, in batches.
+    # Misses are stored every few batches so an interrupted re-index keeps its progress.
+    vectors = embedding_store.get_or_compute(
+        texts, embed_texts, chunk_size=embedding_batch_size * 16
+    )
+    return ids, vectors
+
+def create_index(force=False, publish=True):
+    """Create a FAISS index from the knowledge base data (and serve it, unless publish is False)"""
+    if not len(documents):
+        logger.warning("No knowledge data available to index")
+        return None
     
-    # Create a FAISS index
-    index = faiss.IndexFlatL2(dimension)
+    # The existing index file is replaced atomically when the new one is
+    # published, so there is no need to delete it first even when force is True
     
-    # Create embeddings for all items in the knowledge base
-    embeddings = []
-    for i, item in enumerate(knowledge_data):
-        # Process the text based on its format
-        if 'text' in item:
-            text = item['text']
-            # For FAQ format, use both question and answer for better matching
-            if text.startswith("Q:") and "\nA:" in text:
-                parts = text.split("\nA:")
-                question = parts[0].replace("Q:", "").strip()
-                answer = parts[1].strip()
-                # Create embedding for the combined text to capture both question and answer semantics
-                embedding = embed_text(f"{question} {answer}")
-                print(f"Indexed FAQ item {i}: {question[:30]}...")
-            else:
-                embedding = embed_text(text)
-                print(f"Indexed text item {i}: {text[:30]}...")
-            embeddings.append(embedding)
+    # Embed in slices so only one slice of document text is in memory at a time
+    id_parts, vector_parts = [], []
+    batch = []
+    for item in documents.values():
+        batch.append(item)
+        if len(batch) == embedding_batch_size * 16:
+            ids, vectors = _embed_documents(batch)
+            if vectors is not None:
+                id_parts.append(ids)
+                vector_parts.append(vectors)
+            batch = []
+    ids, vectors = _embed_documents(batch)
+    if vectors is not None:
+        id_parts.append(ids)
+        vector_parts.append(vectors)
     
-    if not embeddings:
-        print("No content to index")
+    if not vector_parts:
+        logger.warning("No content to index")
         return None
     
-    # Convert to numpy array and add to index
-    embeddings_np = np.array(embeddings).astype('float32')
-    index.add(embeddings_np)
+    # Create (and train, for IVF types) a FAISS index keyed by chunk id
+    index = build_index(np.vstack(vector_parts), np.concatenate(id_parts), index_config)
     
-    # Save the index
-    os.makedirs(os.path.dirname(index_path), exist_ok=True)
-    faiss.write_index(index, index_path)
+    if publish:
+        # Save the index and make it the one served by search()
+        index_manager.publish(index)
     
-    print(f"Created index with {len(embeddings)} items")
+    logger.info("Created %s index with %d items", index_config['type'], index.ntotal)
     return index
 
 def load_index():
-    """Load the FAISS index if it exists, otherwise create it"""
-    if os.path.exists(index_path):
-        print("Loading existing index")
-        try:
-            return faiss.read_index(index_path)
-        except Exception as e:
-            print(f"Error loading index: {e}")
-            print("Creating new index instead")
-            return create_index(force=True)
-    else:
-        print("Creating new index")
+    """Return the in-memory FAISS index, reading it from disk only when the file changed"""
+    if serving_mode == "snapshot":
+        return _check_snapshot().index
+    try:
+        index = index_manager.get()
+    except Exception as e:
+        logger.error("Error loading index: %s; creating a new index instead", e)
+        return create_index(force=True)
+    if index is None:
+        logger.info("Creating new index")
         return create_index()
+    return index
 
-def search(query, k=5):
-    """Search the knowledge base for items similar to the query"""
-    # Load or create the index
-    index = load_index()
+def _require_writable():
+    if serving_mode == "snapshot":
+        raise RuntimeError(
+            "The knowledge base is read-only in snapshot serving mode; change it in a "
+            "read-write process and publish a new snapshot with `python -m src.snapshots publish`"
+        )
+
+def _check_snapshot():
+    """Return the _Corpus of the current snapshot, switching to a newly published one first"""
+    global _snapshot_version, _snapshot_stat
+    stat = snapshot_store.current_stat()
+    if stat is not None and stat == _snapshot_stat:
+        return _snapshot
+    # While one thread switches, the others keep serving the previous snapshot
+    if not _write_lock.acquire(blocking=_snapshot is None):
+        return _snapshot
+    try:
+        if stat is None:
+            raise RuntimeError(f"No snapshot published in {snapshot_store.root}; run `python -m src.snapshots publish`")
+        if stat != _snapshot_stat:
+            version = snapshot_store.current()
+            if version != _snapshot_version:
+                _switch_snapshot(version)
+            _snapshot_stat = stat
+    finally:
+        _write_lock.release()
+    return _snapshot
+
+def _switch_snapshot(version):
+    """Load a snapshot next to the one being served, then serve it with one swap"""
+    global _snapshot, _snapshot_version, documents, document_chunks, lexical_index, _generation
+    index, store, manifest = snapshot_store.open(version)
+    if (manifest.get("embedding_model"), manifest.get("embedding_backend")) != (
+            embedding_model_name, embedding_backend):
+        logger.warning("Snapshot %s was embedded with %s (%s), queries use %s (%s)", version,
+                       manifest.get("embedding_model"), manifest.get("embedding_backend"),
+                       embedding_model_name, embedding_backend)
+    new_documents = Documents(store)
+    new_chunks = {}
+    new_lexical = LexicalIndex(text_loader=lambda doc_id: new_documents.get(doc_id, {}).get('text', ''))
+    logger.info("Loading %d documents from %s", len(store), store.path)
+    for item in store:
+        new_lexical.add(item['id'], item.get('text', ''))
+        chunk_count = _chunk_count(item)
+        if chunk_count > 1:
+            new_chunks[item['id']] = chunk_count
+    corpus = _Corpus(configure_search(index, index_config), new_documents, new_chunks,
+                     snapshot_store.embedding_store(version))
+    # Searches read _snapshot once, so each sees the old snapshot or the new one, never a mix
+    _snapshot = corpus
+    documents, document_chunks, lexical_index = new_documents, new_chunks, new_lexical
+    _snapshot_version = version
+    _generation += 1
+    parsed_documents.clear()  # Parsed texts of the previous snapshot; they are parsed again on use
+    logger.info("Serving snapshot %s (%d vectors, memory-mapped)", version, index.ntotal)
+
+def publish_snapshot(keep=3):
+    """Build the index from the documents in data/ and publish both as a new snapshot.
+
+    This is the build step for snapshot serving; run it in its own process
+    (`python -m src.snapshots publish`), not in a serving worker.
+    """
+    with _init_lock, _write_lock:
+        _load_documents()
+        index = create_index(force=True, publish=False)
+        if index is None:
+            raise RuntimeError("Nothing to index, no snapshot published")
+        metadata = {
+            "embedding_model": embedding_model_name,
+            "embedding_backend": embedding_backend,
+            "index": index_config,
+            "chunking": chunking_config,
+        }
+        embeddings = None
+        if index_config['rerank'] and is_approximate(index):
+            # Serving nodes may have no embedding cache; exact reranking reads these instead
+            embeddings = (embedding_store.model_name, _embedding_batches())
+        return snapshot_store.publish(index, documents.values(), metadata, keep=keep, embeddings=embeddings)
+
+def _embedding_batches():
+    """(texts, vectors) for all chunks of the documents, a slice at a time, from the embedding cache"""
+    items = list(documents.values())
+    step = embedding_batch_size * 16
+    for begin in range(0, len(items), step):
+        _, texts = _chunk_texts(items[begin:begin + step])
+        if texts:
+            yield texts, embedding_store.get_or_compute(texts, embed_texts)
+
+def _live_corpus(index=None):
+    return _Corpus(index, documents, document_chunks, None)
+
+def _chunk_lookup(chunk_id, corpus=None):
+    """Return (item, chunk number, (text embedded, text returned)) or None if it is gone"""
+    corpus = corpus or _live_corpus()
+    doc_id, chunk_number = divmod(int(chunk_id), CHUNK_ID_STRIDE)
+    item = corpus.documents.get(doc_id)
+    if item is None or 'text' not in item:
+        return None
+    if doc_id in corpus.chunks:
+        pieces = chunk_item(item, chunking_config)
+    else:
+        pieces = [(index_text(item), item['text'])]
+    if chunk_number >= len(pieces):
+        return None
+    return item, chunk_number, pieces[chunk_number]
+
+def _rerank_exact(query_embedding, distances, indices, corpus=None):
+    """Replace approximate (PQ) distances with exact L2 distances from cached vectors.
+
+    Candidates whose vector is not in the cache keep their approximate distance.
+    """
+    candidates, texts, approximate = [], [], []
+    for distance, idx in zip(distances, indices):
+        found = _chunk_lookup(idx, corpus) if idx >= 0 else None
+        if found is not None:
+            candidates.append(int(idx))
+            texts.append(found[2][0])
+            approximate.append(distance)
+    if not candidates:
+        return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+    # A snapshot carries its own vectors; otherwise they come from the local cache
+    store = corpus.vectors if corpus is not None and corpus.vectors is not None else embedding_store
+    vectors, missing = store.lookup(texts)
+    rescored = np.array(approximate, dtype=np.float32)
+    cached = np.ones(len(texts), dtype=bool)
+    cached[missing] = False
+    if vectors is not None and cached.any():
+        rescored[cached] = ((vectors[cached] - query_embedding) ** 2).sum(axis=1)
+    if missing and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Rerank without cached vectors", extra={"fields": {"missing": len(missing)}})
+    order = np.argsort(rescored, kind="stable")
+    return rescored[order], np.array(candidates, dtype=np.int64)[order]
+
+def _results(distances, indices, k, corpus=None):
+    """Turn one row of FAISS output into up to k knowledge base items with a 'score'.
+
+    Chunks are de-duplicated to their document, keeping the best chunk, whose
+    text replaces the document text for documents split into several chunks.
+    """
+    corpus = corpus or _live_corpus()
+    results = []
+    seen = set()
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for i, idx in enumerate(indices):
+        if idx < 0 or int(idx) // CHUNK_ID_STRIDE in seen:
+            continue
+        found = _chunk_lookup(idx, corpus)
+        if found is None:
+            continue
+        item, chunk_number, (_, chunk) = found
+        seen.add(item['id'])
+        result = item.copy()
+        if item['id'] in corpus.chunks:
+            result['text'] = chunk
+            result['chunk'] = chunk_number
+        result['score'] = float(distances[i])
+        if debug:
+            logger.debug("Search result", extra={"fields": {
+                "rank": i, "id": item['id'], "score": round(result['score'], 4),
+                "text": result['text'][:50].replace('\n', ' '),
+            }})
+        results.append(result)
+        if len(results) == k:
+            break
+    return results
+
+def knowledge_base_version():
+    """A short hash that changes whenever the documents or the served index change.
+
+    Covers upserts, deletes and reloads in this process and indexes published
+    by other workers, so it can key caches of anything derived from the corpus.
+    """
+    initialize()
+    load_index()  # Picks up an index another worker has published since
+    state = f"{_generation}:{index_manager.digest}"
+    return hashlib.sha256(state.encode()).hexdigest()[:16]
+
+def search_batch(queries, k=5):
+    """Search for several queries at once: one batched encode and one multi-query FAISS search.
+
+    Returns one result list per query, in order.
+    """
+    initialize()
+    # Get the cached index (loaded from disk at most once per change), read
+    # together with the documents its ids refer to
+    if serving_mode == "snapshot":
+        corpus = _check_snapshot()
+    else:
+        corpus = _live_corpus(load_index())
+    index = corpus.index
     if index is None:
-        print("No index available, falling back to keyword search")
+        logger.warning("No index available, falling back to keyword search")
+        return [[] for _ in queries]
+    if not queries:
         return []
     
-    # Embed the query
-    query_embedding = np.array([embed_text(query)]).astype('float32')
+    # Embed the queries (cached for repeated questions)
+    with stage_timer("encode"):
+        query_embeddings = embed_queries(queries)
     
     # Search the index
-    distances, indices = index.search(query_embedding, k)
+    rerank = index_config['rerank'] and is_approximate(index)
+    fetch_k = k * index_config['rerank_factor'] if rerank else k
+    if corpus.chunks:
+        # Several chunks of one document may come back; fetch extra to fill k documents
+        fetch_k *= chunk_overfetch
+    with stage_timer("index_search"):
+        distances, indices = index.search(query_embeddings, fetch_k)
     
-    # Print debug info
-    print(f"Query: '{query}'")
-    print(f"Search results: {len(indices[0])} items")
-    
-    # Return the results
-    results = []
-    for i, idx in enumerate(indices[0]):
-        if idx < len(knowledge_data) and idx >= 0:
-            result = knowledge_data[idx].copy()
-            result['score'] = float(distances[0][i])
-            # Print debug info for each result
-            if 'text' in result:
-                text_preview = result['text'][:50].replace('\n', ' ')
-                print(f"Result {i}: score={result['score']:.4f}, text='{text_preview}...'")
-            results.append(result)
+    batch_results = []
+    with stage_timer("result_lookup"):
+        for row, query in enumerate(queries):
+            row_distances, row_indices = distances[row], indices[row]
+            if rerank:
+                row_distances, row_indices = _rerank_exact(query_embeddings[row], row_distances, row_indices, corpus)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Vector search", extra={"fields": {"query": query, "candidates": len(row_indices)}})
+            batch_results.append(_results(row_distances, row_indices, k, corpus))
+    return batch_results
+
+def search(query, k=5):
+    """Search the knowledge base for items similar to the query"""
+    return search_batch([query], k)[0]
+
+def _update_index(remove_ids, ids, vectors):
+    """Remove all chunks of the given documents, insert the given chunk vectors and publish"""
+    current = load_index()
+    if current is None:
+        return create_index()
     
-    return results
+    # Mutate a copy so concurrent searches keep using the current index
+    updated = faiss.clone_index(current)
+    if len(remove_ids):
+        try:
+            for doc_id in remove_ids:
+                start = int(doc_id) * CHUNK_ID_STRIDE
+                updated.remove_ids(faiss.IDSelectorRange(start, start + CHUNK_ID_STRIDE))
+        except RuntimeError:
+            # HNSW cannot remove vectors; rebuild from the embedding cache instead
+            return create_index()
+    configure_search(updated, index_config)
+    if vectors is not None:
+        updated.add_with_ids(vectors, ids)
+    return index_manager.publish(updated)
+
+def upsert_documents(items):
+    """Add or replace items by id. Items without an 'id' get a new one. Returns the ids."""
+    _require_writable()
+    initialize()
+    with _exclusive_update():
+        _replay_changes()
+        next_id = documents.max_id() + 1
+        changes = []
+        for item in items:
+            item = dict(item)
+            if item.get('id') is None:
+                item['id'] = next_id
+                next_id += 1
+            item['id'] = int(item['id'])
+            changes.append({"op": "upsert", "id": item['id'], "item": item})
+        
+        # Encode before touching the log so a failing model leaves nothing half-applied
+        ids, vectors = _embed_documents([change["item"] for change in changes])
+        _append_changes(changes)
+        doc_ids = [change["id"] for change in changes]
+        _update_index(doc_ids, ids, vectors)
+        return doc_ids
+
+def upsert_document(item):
+    """Add or replace a single item by id and return its id"""
+    return upsert_documents([item])[0]
+
+def delete_documents(doc_ids):
+    """Delete items by id. Returns the ids that existed."""
+    _require_writable()
+    initialize()
+    with _exclusive_update():
+        _replay_changes()
+        existing = [int(doc_id) for doc_id in doc_ids if int(doc_id) in documents]
+        if not existing:
+            return []
+        _append_changes([{"op": "delete", "id": doc_id} for doc_id in existing])
+        _update_index(existing, np.array([], dtype=np.int64), None)
+        return existing
+
+def delete_document(doc_id):
+    """Delete a single item by id. Returns True if it existed."""
+    return bool(delete_documents([doc_id]))
+
+def compact_knowledge_base():
+    """Fold the change log into the document store (or knowledge_base.json) and remove the log.
+
+    Other workers notice the log shrinking and reload the base documents.
+    """
+    global _changes_offset
+    _require_writable()
+    initialize()
+    with _exclusive_update():
+        _replay_changes()
+        if documents.store is not None:
+            with DocumentStoreWriter(document_store_path) as writer:
+                for item in documents.values():
+                    writer.add(item)
+            # Same content, so only the overlay of changed items has to go
+            documents.reset(DocumentStore(document_store_path))
+        else:
+            tmp_path = f"{knowledge_base_path}.tmp.{os.getpid()}"
+            with open(tmp_path, "w") as f:
+                json.dump(list(documents.values()), f, indent=2)
+            os.replace(tmp_path, knowledge_base_path)
+        if os.path.exists(changes_path):
+            os.remove(changes_path)
+        _changes_offset = 0
 
 def add_to_knowledge_base(item):
     """Add a new item to the knowledge base and update the index"""
-    knowledge_data.append(item)
-    
-    # Save the updated knowledge base
-    os.makedirs(os.path.dirname(knowledge_base_path), exist_ok=True)
-    with open(knowledge_base_path, "w") as f:
-        json.dump(knowledge_data, f, indent=2)
-    
-    # Update the index
-    create_index(force=True)
-    
-    return len(knowledge_data) - 1  # Return the index of the added item
+    # Only the new item is embedded and inserted; knowledge_base.json is not rewritten
+    return upsert_document(item)  # Return the id of the added item
+
+def initialize():
+    """Load documents and build the index on first use; later calls return at once"""
+    if _ready.is_set():
+        return
+    with _init_lock:
+        if _ready.is_set():
+            return
+        if serving_mode == "snapshot":
+            _check_snapshot()
+        else:
+            _load_documents()
+            # Vectors come from the embedding cache, so only items that are new
+            # or changed get encoded (and only then is the model loaded)
+            logger.info("Initializing knowledge base index...")
+            create_index(force=True)
+        _ready.set()
+
+def warm_up():
+    """Load everything the first request would otherwise wait for"""
+    initialize()
+    get_embedding_model().encode(["warm up"])
 
-# Initialize the index when the module is loaded - force recreation
-print("Initializing knowledge base index...")
-index = create_index(force=True)
\ No newline at end of file
+def is_ready():
+    return _ready.is_set() and embedding_model is not None
@@ -0,0 +1,141 @@
+# Inverted index for keyword search over the knowledge base
+##### src/lexical_index.py #####
+import math
+import re
+import sys
+import threading
+from collections import Counter
+
+from src.relevance import FINANCIAL_TERMS  # Query terms that get extra weight when they match
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Boosts on top of the BM25 score, same weights as the original keyword scan
+PHRASE_BOOST = 10
+KEYWORD_BOOST = 1
+FINANCIAL_TERM_BOOST = 2
+QUESTION_BOOST = 3
+
+
+def tokenize(text: str):
+    return TOKEN_RE.findall(text.lower())
+
+
+def faq_question(text: str) -> str:
+    """Return the question of a 'Q: ...\\nA: ...' item, or '' for other items"""
+    if "Q:" not in text:
+        return ""
+    return text.split("Q:", 1)[1].split("A:", 1)[0]
+
+
+class LexicalIndex:
+    """BM25 inverted index, built once and updated per document.
+
+    Scores are BM25 plus the boosts of the original keyword fallback: an exact
+    phrase match, each matching keyword, financial terms and keywords that
+    appear in an FAQ question. Only keywords longer than two characters count.
+
+    Texts are kept for the phrase check unless text_loader(doc_id) is given to
+    read them back from wherever the documents live.
+    """
+
+    def __init__(self, k1=1.5, b=0.75, text_loader=None):
+        self.k1 = k1
+        self.b = b
+        self.text_loader = text_loader
+        self._postings = {}  # term -> {doc_id: term frequency}
+        self._doc_len = {}  # doc_id -> number of tokens
+        self._doc_terms = {}  # doc_id -> distinct terms, to find its postings on removal
+        self._question_terms = {}  # doc_id -> terms in the FAQ question
+        self._texts = {}  # doc_id -> original text, only without a text_loader
+        self._total_len = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def add(self, doc_id, text):
+        """Index a document, replacing any previous version with the same id"""
+        tokens = tokenize(text)
+        with self._lock:
+            self._remove(doc_id)
+            counts = Counter(sys.intern(token) for token in tokens)  # one string per term across documents
+            for term, tf in counts.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+            self._doc_len[doc_id] = len(tokens)
+            self._doc_terms[doc_id] = tuple(counts)
+            self._total_len += len(tokens)
+            self._question_terms[doc_id] = frozenset(tokenize(faq_question(text)))
+            if self.text_loader is None:
+                self._texts[doc_id] = text
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        if doc_id not in self._doc_len:
+            return
+        for term in self._doc_terms.pop(doc_id):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_len -= self._doc_len.pop(doc_id)
+        del self._question_terms[doc_id]
+        self._texts.pop(doc_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._doc_len.clear()
+            self._doc_terms.clear()
+            self._question_terms.clear()
+            self._texts.clear()
+            self._total_len = 0
+
+    def _text(self, doc_id):
+        if self.text_loader is None:
+            return self._texts[doc_id]
+        return self.text_loader(doc_id)
+
+    def search(self, query: str, top_k=3):
+        """Return up to top_k (score, doc_id) pairs, best first"""
+        keywords = {term for term in tokenize(query) if len(term) > 2}
+        if not keywords:
+            return []
+        query_lower = query.lower()
+
+        with self._lock:
+            n_docs = len(self._doc_len)
+            if not n_docs:
+                return []
+            avg_len = self._total_len / n_docs
+            scores = {}
+            matched = {}
+            for term in keywords:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                boost = KEYWORD_BOOST + (FINANCIAL_TERM_BOOST if term in FINANCIAL_TERMS else 0)
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avg_len)
+                    score = idf * tf * (self.k1 + 1) / (tf + norm) + boost
+                    if term in self._question_terms[doc_id]:
+                        score += QUESTION_BOOST
+                    scores[doc_id] = scores.get(doc_id, 0.0) + score
+                    matched[doc_id] = matched.get(doc_id, 0) + 1
+
+            # A phrase match needs every keyword, and can only lift a document into
+            # the top_k if its score plus the boost reaches the current top_k cut-off
+            ranked = sorted(scores.values(), reverse=True)
+            cutoff = ranked[top_k - 1] if 0 < top_k <= len(ranked) else float("-inf")
+            for doc_id, count in matched.items():
+                if (count == len(keywords) and scores[doc_id] + PHRASE_BOOST >= cutoff
+                        and query_lower in self._text(doc_id).lower()):
+                    scores[doc_id] += PHRASE_BOOST
+
+        ranked = sorted(scores.items(), key=lambda pair: pair[1], reverse=True)[:top_k]
+        return [(score, doc_id) for doc_id, score in ranked]
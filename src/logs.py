@@ -0,0 +1,58 @@
+# Level-gated, structured logging for the application modules
+##### src/logs.py #####
+import json
+import logging
+import sys
+import time
+
+from src.config import config
+
+LOGGER_NAME = "src"  # Parent of every module logger (logging.getLogger(__name__))
+
+
+class StructuredFormatter(logging.Formatter):
+    """One line per record with its fields, as key=value text or as JSON.
+
+    Fields are passed as logger.info("message", extra={"fields": {...}}).
+    """
+
+    def __init__(self, json_lines=False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record):
+        fields = getattr(record, "fields", None) or {}
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+        if self.json_lines:
+            entry = {"time": timestamp, "level": record.levelname, "logger": record.name,
+                     "message": record.getMessage()}
+            entry.update(fields)
+            if record.exc_info:
+                entry["exception"] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+        line = f"{timestamp} {record.levelname} {record.name}: {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{key}={value!r}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def configure_logging(settings=None):
+    """Set the level and format of application logs from the 'logging' config section"""
+    settings = settings or {}
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(str(settings.get("level", "INFO")).upper())
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(StructuredFormatter(json_lines=settings.get("format", "text") == "json"))
+    logger.handlers = [handler]
+    logger.propagate = False
+    return logger
+
+
+def get_logger(name):
+    """Logger for a module. Guard expensive messages with logger.isEnabledFor(logging.DEBUG)."""
+    return logging.getLogger(name)
+
+
+configure_logging(config.get("logging"))
@@ -1,18 +1,68 @@
 # API server (FastAPI) 
 ##### src/main.py #####
 import os
-import yaml
+import time
+import json
 import uuid  # Import uuid
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import Union
+from concurrent.futures import ThreadPoolExecutor
 os.environ["TOKENIZERS_PARALLELISM"] = "false"  # Prevent tokenizers warning
 
-from fastapi import FastAPI, HTTPException
+import numpy as np
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware  # Import CORS middleware
-from pydantic import BaseModel
-from src.retrieval import retrieve_relevant_data
-from src.fin_engine import generate_response
-from src.integrations import send_response_to_channel
+from pydantic import BaseModel, ValidationError
+from src.config import config, config_fingerprint
+from src.cache import DEFAULT_SEMANTIC_MAX_DISTANCE, ResponseCache, SemanticResponseCache
+from src.retrieval import retrieve_relevant_data, retrieve_relevant_data_batch, query_batcher
+from src.knowledge_base import (
+    knowledge_base_version, embed_query, embed_queries, query_embedding_cache, query_key, warm_up, is_ready,
+)
+from src.fin_engine import generate_response, compact_history, fin_ai, route_topics
+from src.integrations import send_response_to_channel, integration_manager
+from src.delivery import create_delivery_queue
+from src.sessions import create_session_store
+from src.logs import get_logger
+from src.metrics import registry, stage_timer
+
+logger = get_logger(__name__)
+
+# Importing this module is cheap: the embedding model, documents and index are
+# loaded by warm_up() or by the first request that needs them.
+#   background - serve at once and warm up in a thread; /readyz reports when done
+#   startup    - warm up before the server accepts requests
+#   lazy       - no warm-up, the first request pays for it
+warm_up_mode = (config.get("server") or {}).get("warm_up", "background")
+warm_up_error = None
 
-app = FastAPI()
+def _warm_up():
+    global warm_up_error
+    try:
+        warm_up()
+        if fin_ai.route_before_retrieval and len(fin_ai.topic_catalog):
+            fin_ai.topic_catalog.centroids()  # Embed the topic examples once, before the first question
+        logger.info("Warm-up complete")
+    except Exception as e:
+        warm_up_error = str(e)
+        logger.error("Warm-up failed: %s", warm_up_error)
+
+@asynccontextmanager
+async def lifespan(app):
+    delivery_queue.start()
+    if warm_up_mode == "startup":
+        await asyncio.get_running_loop().run_in_executor(retrieval_executor, _warm_up)
+    elif warm_up_mode == "background":
+        threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+    yield
+    delivery_queue.stop()
+    integration_manager.close()
+    retrieval_executor.shutdown(wait=False)
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware to allow browser requests
 app.add_middleware(
@@ -23,11 +73,162 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-# Load config for default values
-with open("config.yaml", "r") as f:
-    config = yaml.safe_load(f)
+# Conversation histories, bounded and optionally shared between workers (see src/sessions.py)
+conversation_histories = create_session_store(config.get("sessions"))
+
+# Encoding, FAISS search and formatting are CPU-bound and run in this bounded
+# pool so the event loop stays free to accept requests
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=config.get("server", {}).get("retrieval_workers", 16),
+    thread_name_prefix="retrieval",
+)
+
+# Channel delivery (e.g. the Twilio call for WhatsApp) happens in a pool of
+# background workers, rate limited per channel (see src/delivery.py)
+delivery_queue = create_delivery_queue(config.get("delivery"), send_response_to_channel)
+
+# Without history an answer depends only on the query, the knowledge base version
+# and these settings, so answers to repeated questions are served from memory
+response_cache_config = config.get("response_cache") or {}
+response_cache = ResponseCache(
+    max_size=response_cache_config.get("max_size", 1024) if response_cache_config.get("enabled", True) else 0,
+    ttl_seconds=response_cache_config.get("ttl_seconds"),
+    normalize=query_key,  # Questions differing only in case share an answer when the model ignores case
+)
+engine_fingerprint = "{}-{}".format(
+    config_fingerprint(("retrieval", "knowledge_base", "history", "topics")), fin_ai.topic_catalog.digest
+)
+
+# Rephrasings of a cached question ("roth ira benefits", "what's good about a Roth IRA?")
+# are matched by query embedding and reuse its retrieval results, skipping the
+# knowledge base search; the answer is still formatted for the new wording
+semantic_cache_config = response_cache_config.get("semantic") or {}
+semantic_cache = SemanticResponseCache(
+    # Turning off response_cache turns this off too
+    max_size=semantic_cache_config.get("max_size", 1024)
+    if response_cache_config.get("enabled", True) and semantic_cache_config.get("enabled", True) else 0,
+    max_distance=semantic_cache_config.get("max_distance", DEFAULT_SEMANTIC_MAX_DISTANCE),
+)
+
+def _context(retrieval_query, embedding=None):
+    """(topic answer, None) for a query routed to a catalog topic, else (None, retrieval results)"""
+    # A confident match to a catalog topic is answered without retrieval; the
+    # query embedding is cached, so retrieval does not encode it again
+    if embedding is None:
+        embedding = embed_query(retrieval_query)
+    topic_response = route_topics(embedding[None])[0]
+    if topic_response is not None:
+        return topic_response, None
+    with stage_timer("retrieve"):
+        return None, retrieve_relevant_data(retrieval_query)
+
+def _respond(query, context, history=None):
+    topic_response, relevant_data = context
+    if topic_response is not None:
+        return topic_response
+    with stage_timer("generate"):
+        return generate_response(query, relevant_data, history)
+
+def _semantic_get(query, embedding, version):
+    """The answer to query from the context cached for a near-duplicate question, or None"""
+    context = semantic_cache.get(embedding, version, engine_fingerprint)
+    return None if context is None else _respond(query, context)
+
+def _answer_uncached(query, version):
+    """Answer from the semantic cache, or retrieve the context and store it there"""
+    if semantic_cache.max_size <= 0:
+        return _respond(query, _context(query))
+    embedding = embed_query(query)
+    response = _semantic_get(query, embedding, version)
+    if response is None:
+        context = _context(query, embedding)
+        semantic_cache.put(embedding, version, context, engine_fingerprint)
+        response = _respond(query, context)
+    return response
+
+def answer_query(query, history=None):
+    """Retrieve context for a query and generate the response (cached for queries without history)"""
+    with stage_timer("answer"):
+        if history:
+            # Use topics from recent turns for follow-up questions like "What are its benefits?"
+            return _respond(query, _context(compact_history(query, history).text), history)
+        version = knowledge_base_version()
+        return response_cache.get_or_compute(query, version, lambda: _answer_uncached(query, version), engine_fingerprint)
+
+def answer_queries(queries):
+    """Answer many queries without history, in order.
+
+    Cached answers (including those to near-duplicate questions) are reused and
+    questions matching a catalog topic are routed to its answer; the remaining
+    distinct queries are retrieved together (one batched encode and one
+    multi-query FAISS search).
+    """
+    version = knowledge_base_version()
+    responses = [response_cache.get(query, version, engine_fingerprint) for query in queries]
+    # Distinct queries by cache key, so a question repeated in the batch is answered once
+    missing = {}
+    for position, (query, response) in enumerate(zip(queries, responses)):
+        if response is None:
+            missing.setdefault(query_key(query), []).append(position)
+    if not missing:
+        return responses
+    
+    pending = [(queries[positions[0]], positions) for positions in missing.values()]
+    # One batched encode; the embeddings are cached for the search below
+    embeddings = embed_queries([query for query, _ in pending])
+    unanswered = []
+    for (query, positions), embedding in zip(pending, embeddings):
+        response = _semantic_get(query, embedding, version) if semantic_cache.max_size > 0 else None
+        if response is None:
+            unanswered.append((query, positions, embedding))
+            continue
+        response_cache.put(query, version, response, engine_fingerprint)
+        for position in positions:
+            responses[position] = response
+    if not unanswered:
+        return responses
+    
+    # Confident matches to a catalog topic are answered without retrieval
+    topic_responses = route_topics(np.vstack([embedding for _, _, embedding in unanswered]))
+    retrieve = [query for (query, _, _), response in zip(unanswered, topic_responses) if response is None]
+    with stage_timer("retrieve"):
+        relevant_batch = iter(retrieve_relevant_data_batch(retrieve) if retrieve else [])
+    for (query, positions, embedding), topic_response in zip(unanswered, topic_responses):
+        context = (topic_response, None if topic_response is not None else next(relevant_batch))
+        response = _respond(query, context)
+        response_cache.put(query, version, response, engine_fingerprint)
+        if semantic_cache.max_size > 0:
+            semantic_cache.put(embedding, version, context, engine_fingerprint)
+        for position in positions:
+            responses[position] = response
+    return responses
+
+# Request latency per route; the route template keeps ids out of the labels
+http_request_seconds = registry.histogram(
+    "fin_ai_http_request_seconds", "HTTP request latency by route and status code", ("method", "route", "status")
+)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    http_request_seconds.labels(
+        request.method, route.path if route is not None else "unmatched", str(response.status_code)
+    ).observe(time.perf_counter() - start)
+    return response
 
-conversation_histories = {}  # Global dictionary to store conversation histories
+def _recipient(channel, recipient):
+    """The recipient, or the default from config if the channel requires one and none was given"""
+    if not recipient and channel == "whatsapp":
+        return ((config.get("integrations") or {}).get("whatsapp") or {}).get("recipient_number")
+    return recipient
+
+def _submit_delivery(channel, response, recipient):
+    """Queue the response for its channel and return the delivery id (None for chat, which is not queued)"""
+    if channel == "chat":
+        return None  # The response is in the API reply; there is nothing to deliver
+    return delivery_queue.submit(channel, response, _recipient(channel, recipient))
 
 class QueryRequest(BaseModel):
     query: str
@@ -36,7 +237,7 @@ class QueryRequest(BaseModel):
     session_id: str = None  # Optional session ID
 
 @app.post("/ask")
-def ask(query_request: QueryRequest):
+async def ask(query_request: QueryRequest):
     session_id = query_request.session_id
     if not session_id:
         session_id = str(uuid.uuid4())  # Generate new session_id if not provided
@@ -44,27 +245,152 @@ def ask(query_request: QueryRequest):
 
     history = conversation_histories.get(session_id, [])
 
-    # Get relevant data from knowledge base
-    relevant_data = retrieve_relevant_data(query_request.query)
-    
-    # Generate response using history
-    response = generate_response(query_request.query, relevant_data, history)
+    # Retrieval and response generation are CPU-bound, so they run off the event loop
+    response = await asyncio.get_running_loop().run_in_executor(
+        retrieval_executor, answer_query, query_request.query, history
+    )
     
     # Update history
-    history.append((query_request.query, response))
-    conversation_histories[session_id] = history
-    
-    # Handle recipient
-    recipient = query_request.recipient
+    conversation_histories.append_turn(session_id, query_request.query, response)
     
-    # If no recipient provided but channel requires one, use default from config
-    if not recipient and query_request.channel == "whatsapp":
-        recipient = config["integrations"]["whatsapp"].get("recipient_number")
-        
-    # Send response to appropriate channel
-    send_response_to_channel(query_request.channel, response, recipient)
+    # Queue the response for the channel; the caller does not wait for delivery
+    delivery_id = _submit_delivery(query_request.channel, response, query_request.recipient)
     
-    return {"response": response, "session_id": session_id}
+    return {"response": response, "session_id": session_id, "delivery_id": delivery_id}
+
+class BatchItem(BaseModel):
+    query: str
+    id: Union[str, int] = None  # Echoed back with the result so the caller can match it up
+    channel: str = None  # Defaults to the channel query parameter; no delivery when neither is set
+    recipient: str = None
+
+batch_config = config.get("batch_ask") or {}
+batch_max_items = batch_config.get("max_items", 10000)
+batch_chunk_size = max(1, batch_config.get("chunk_size", 64))
+
+async def _batch_lines(request):
+    """The non-empty lines of an NDJSON body, split as the body arrives"""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+def _parse_batch_item(value):
+    """A BatchItem from a JSON string or object, or an error message"""
+    try:
+        if isinstance(value, bytes):
+            value = json.loads(value)
+        if isinstance(value, str):
+            value = {"query": value}
+        return BatchItem(**value) if isinstance(value, dict) else "expected a query string or object"
+    except (ValueError, ValidationError) as e:
+        return f"invalid item: {e}"
+
+@app.post("/ask/batch")
+async def ask_batch(request: Request, channel: str = None, recipient: str = None):
+    """Answer many questions in one call, e.g. for nightly digests or ticket triage.
+
+    The body is a JSON array of queries (strings or BatchItem objects), or NDJSON
+    (Content-Type: application/x-ndjson) with one per line. Questions are answered
+    without history and no sessions are created. Results are streamed back as
+    NDJSON, one line per item in input order, chunk by chunk as they are answered.
+    """
+    if "ndjson" in request.headers.get("content-type", ""):
+        values = []
+        async for line in _batch_lines(request):
+            values.append(line)
+            if len(values) > batch_max_items:
+                break
+    else:
+        try:
+            values = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        if not isinstance(values, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    if len(values) > batch_max_items:
+        raise HTTPException(status_code=413, detail=f"At most {batch_max_items} items per batch")
+    items = [_parse_batch_item(value) for value in values]
+
+    async def results():
+        loop = asyncio.get_running_loop()
+        for start in range(0, len(items), batch_chunk_size):
+            chunk = [(position, item) for position, item in enumerate(items[start:start + batch_chunk_size], start)
+                     if isinstance(item, BatchItem)]
+            # One chunk at a time, so a large batch does not starve /ask of retrieval threads
+            responses = await loop.run_in_executor(
+                retrieval_executor, answer_queries, [item.query for _, item in chunk]
+            ) if chunk else []
+            answered = {position: response for (position, _), response in zip(chunk, responses)}
+            for position in range(start, min(start + batch_chunk_size, len(items))):
+                item = items[position]
+                if not isinstance(item, BatchItem):
+                    yield json.dumps({"index": position, "error": item}) + "\n"
+                    continue
+                result = {"index": position, "id": item.id, "response": answered[position]}
+                item_channel = item.channel or channel
+                if item_channel:
+                    result["delivery_id"] = _submit_delivery(item_channel, answered[position],
+                                                             item.recipient or recipient)
+                yield json.dumps(result) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@app.get("/deliveries/{delivery_id}")
+def delivery_status(delivery_id: str):
+    status = delivery_queue.status(delivery_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown delivery id")
+    return status
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz(response: Response):
+    """Readiness: the model, documents and index are loaded (always true in lazy mode)"""
+    if is_ready() or warm_up_mode == "lazy":
+        return {"status": "ready"}
+    response.status_code = 503
+    if warm_up_error:
+        return {"status": "failed", "error": warm_up_error}
+    return {"status": "starting"}
+
+@app.get("/stats")
+def stats():
+    return {
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "query_batcher": query_batcher.stats() if query_batcher else None,
+        "sessions": conversation_histories.stats(),
+        "deliveries": delivery_queue.stats(),
+    }
+
+def _cache_stats():
+    caches = {"response": response_cache, "semantic": semantic_cache, "query_embedding": query_embedding_cache}
+    return {name: cache.stats() for name, cache in caches.items()}
+
+registry.gauge("fin_ai_ready", "1 once the model, documents and index are loaded", lambda: int(is_ready()))
+registry.gauge("fin_ai_cache_entries", "Entries in each cache",
+               lambda: {(name,): stats["size"] for name, stats in _cache_stats().items()}, ("cache",))
+registry.gauge("fin_ai_cache_lookups_total", "Cache lookups by result",
+               lambda: {(name, result): stats[key] for name, stats in _cache_stats().items()
+                        for result, key in (("hit", "hits"), ("miss", "misses"))},
+               ("cache", "result"), kind="counter")
+registry.gauge("fin_ai_deliveries_pending", "Deliveries waiting to be sent", lambda: delivery_queue.pending_count)
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics: stage and request latency histograms, delivery counters, caches"""
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/")
 def root():
@@ -0,0 +1,231 @@
+# Counters, histograms and stage timers, exported in Prometheus text format
+##### src/metrics.py #####
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from 100µs (cached answers) to 10s (cold model loads)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """The series for one combination of label values, created on first use"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterValue:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. requests served"""
+
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[position] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def render(self, name, labelnames, values):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(list(self.buckets) + [float("inf")], counts):
+            cumulative += bucket_count
+            labels = _format_labels(labelnames, values, [("le", _format_value(bound))])
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, values)
+        lines.append(f"{name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{name}_count{labels} {count}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (usually seconds) in fixed buckets"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class Gauge(_Metric):
+    """A value read when metrics are collected, from a function returning {label values: value}.
+
+    kind="counter" exports totals kept elsewhere (e.g. cache hits) as a counter.
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name, help_text, collect, labelnames=(), kind="gauge"):
+        super().__init__(name, help_text, labelnames)
+        self._collect = collect
+        self.type_name = kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        try:
+            values = self._collect()
+        except Exception:
+            return []  # A source that is not available yet is left out
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            if value is not None:
+                lines.append(f"{self.name}{_format_labels(self.labelnames, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """All metrics of the process, rendered together for /metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing  # Modules may be reloaded; keep one series per name
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, collect, labelnames=(), kind="gauge"):
+        with self._lock:
+            # Replaced rather than kept, so the latest source of a value wins
+            self._metrics[name] = Gauge(name, help_text, collect, labelnames, kind)
+            return self._metrics[name]
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry served by /metrics
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    "fin_ai_stage_seconds", "Time spent in each stage of answering a query", ("stage",)
+)
+
+
+def stage_timer(stage):
+    """Context manager that records the time spent in a pipeline stage"""
+    return stage_seconds.labels(stage).time()
+
+
+def timed_stage(stage):
+    """Decorator that records every call of a function as time spent in a pipeline stage"""
+    histogram = stage_seconds.labels(stage)
+
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorate
@@ -0,0 +1,149 @@
+# Precompiled matching used to decide whether an answer is relevant to a query
+##### src/relevance.py #####
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+WORD_RE = re.compile(r'\b\w+\b')
+
+# Terms that must appear in an answer when they appear in the query
+FINANCIAL_TERMS = frozenset(['ira', 'roth', '401k', 'retirement', 'investment', 'fund', 'stock', 'bond', 'fee', 'fees', 'commission', 'cost'])
+
+
+class TermMatcher:
+    """Find which of a fixed set of terms occur in a text, as substrings, in one regex pass.
+
+    The terms are compiled into a single lookahead alternation, longest first,
+    so every position reports the longest term starting there. Shorter terms
+    contained in a match (e.g. 'fee' in 'fees') are added from a precomputed
+    table, which gives the same result as testing each term with 'in'.
+    """
+
+    def __init__(self, terms):
+        self.terms = frozenset(term.lower() for term in terms if term)
+        ordered = sorted(self.terms, key=len, reverse=True)
+        self._pattern = re.compile("(?=(" + "|".join(map(re.escape, ordered)) + "))") if ordered else None
+        self._contained = {
+            term: frozenset(other for other in self.terms if other in term) for term in self.terms
+        }
+
+    def find(self, text: str) -> frozenset:
+        """Return the terms that occur in text (case-insensitive)"""
+        if self._pattern is None:
+            return frozenset()
+        found = set()
+        for match in self._pattern.finditer(text.lower()):
+            found |= self._contained[match.group(1)]
+        return frozenset(found)
+
+
+class ParsedDocument:
+    """Question/answer fields and match data for one knowledge base text, computed once"""
+
+    __slots__ = ("text", "is_faq", "question", "answer", "combined", "financial_terms")
+
+    def __init__(self, text, matcher):
+        self.text = text
+        self.is_faq = False
+        self.question = ""
+        self.answer = text
+        # Same parsing as the original formatter: 'Q: ...\nA: ...'
+        if text.startswith("Q:"):
+            parts = text.split("\nA:")
+            if len(parts) > 1:
+                self.is_faq = True
+                self.question = parts[0].replace("Q:", "").strip()
+                self.answer = parts[1].strip()
+        self.combined = (self.question + " " + self.answer).lower()
+        self.financial_terms = matcher.find(self.combined)
+
+
+class QueryProfile:
+    """Terms extracted from a query once, reused for every candidate answer"""
+
+    __slots__ = ("terms", "long_terms", "financial_terms")
+
+    def __init__(self, query, matcher):
+        query_lower = query.lower()
+        self.terms = frozenset(WORD_RE.findall(query_lower))
+        # Matched as substrings of the answer, like the original check ("account" in "accounts")
+        self.long_terms = TermMatcher(term for term in self.terms if len(term) > 3)
+        self.financial_terms = matcher.find(query_lower)
+
+
+class RelevanceMatcher:
+    """Decide whether a parsed document answers a query.
+
+    If the query mentions financial terms, at least one must occur in the
+    document. Otherwise at least a third of the query's words must appear
+    in it, as substrings (only words longer than three characters can match).
+    """
+
+    def __init__(self, financial_terms=FINANCIAL_TERMS, profile_cache_size=1024):
+        self.term_matcher = TermMatcher(financial_terms)
+        self.profile = lru_cache(maxsize=profile_cache_size)(self._profile)
+
+    def _profile(self, query):
+        return QueryProfile(query, self.term_matcher)
+
+    def parse(self, text):
+        return ParsedDocument(text, self.term_matcher)
+
+    def is_relevant(self, query, document):
+        profile = self.profile(query)
+        if profile.financial_terms:
+            return bool(profile.financial_terms & document.financial_terms)
+        matching_terms = len(profile.long_terms.find(document.combined))
+        return matching_terms >= len(profile.terms) / 3  # At least 1/3 of terms match
+
+
+class ParsedDocumentCache:
+    """Parsed documents keyed by document id, filled when the knowledge base loads.
+
+    get() checks that the cached entry was parsed from the same text, so items
+    whose text differs from the stored document (or that have no id) are
+    parsed on the spot instead. Documents that were not parsed at load time
+    are cached on first use. Above max_size the least recently used go.
+    """
+
+    def __init__(self, matcher, max_size=None):
+        self.matcher = matcher
+        self.max_size = max_size
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _store(self, doc_id, parsed):
+        with self._lock:
+            self._documents[doc_id] = parsed
+            self._documents.move_to_end(doc_id)
+            if self.max_size is not None and len(self._documents) > self.max_size:
+                self._documents.popitem(last=False)
+
+    def put(self, doc_id, text):
+        parsed = self.matcher.parse(text)
+        self._store(doc_id, parsed)
+        return parsed
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._documents.pop(doc_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+
+    def get(self, item):
+        text = item.get('text', '')
+        doc_id = item.get('id')
+        parsed = self._documents.get(doc_id)
+        if parsed is not None and parsed.text == text:
+            return parsed
+        if parsed is None and doc_id is not None and 'chunk' not in item:
+            return self.put(doc_id, text)
+        return self.matcher.parse(text)  # Not the stored document text
+
+
+# Shared by the knowledge base (which fills the cache) and FinancialAI (which reads it)
+relevance_matcher = RelevanceMatcher()
+parsed_documents = ParsedDocumentCache(relevance_matcher, max_size=100000)
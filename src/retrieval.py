@@ -1,58 +1,122 @@
 # Improved semantic search with better relevance scoring
 ##### src/retrieval.py #####
-from src.knowledge_base import load_knowledge_base, embed_text, search
+from src.config import config
+from src.knowledge_base import get_document, lexical_search, search, search_batch
+from src.batching import QueryBatcher
+
+# Concurrent requests are coalesced into one batched encode + FAISS search
+batching_config = config.get("batching") or {}
+query_batcher = None
+if batching_config.get("enabled"):
+    query_batcher = QueryBatcher(
+        search_batch,
+        max_batch_size=batching_config.get("max_batch_size", 16),
+        max_wait_ms=batching_config.get("max_wait_ms", 5),
+    )
+
+# Retrieval mode: "vector" (FAISS, keyword search only when it returns nothing)
+# or "hybrid" (FAISS and keyword search fused into one relevance score)
+retrieval_config = config.get("retrieval") or {}
+retrieval_mode = retrieval_config.get("mode", "vector")
+fusion_method = retrieval_config.get("fusion", "weighted")  # weighted or rrf
+vector_weight = retrieval_config.get("vector_weight", 0.7)
+rrf_k = retrieval_config.get("rrf_k", 60)
+# BM25 score at which the lexical similarity reaches 0.5
+lexical_midpoint = retrieval_config.get("lexical_midpoint", 10.0)
+hybrid_candidates = retrieval_config.get("candidates", 10)
+
+def vector_similarity(distance):
+    """Map a squared L2 distance between unit-length embeddings to cosine similarity in [0, 1]"""
+    return min(1.0, max(0.0, 1.0 - distance / 2.0))
+
+def lexical_similarity(score):
+    """Squash an unbounded BM25 score into [0, 1)"""
+    return score / (score + lexical_midpoint) if score > 0 else 0.0
+
+def fuse_results(vector_results, lexical_scored, top_k=3, method=None):
+    """Merge vector results and (score, doc_id) lexical results into one ranked list.
+
+    Each returned item carries a 'relevance' in [0, 1], higher is better.
+    Vector items also keep their raw L2 'score'.
+    """
+    method = method or fusion_method
+    items = {}
+    vector_sim = {}
+    for rank, item in enumerate(vector_results):
+        items[item['id']] = item
+        vector_sim[item['id']] = (rank, vector_similarity(item['score']))
+    lexical_sim = {}
+    for rank, (score, doc_id) in enumerate(lexical_scored):
+        if doc_id not in items:
+            document = get_document(doc_id)
+            if document is None:
+                continue
+            items[doc_id] = document.copy()
+        lexical_sim[doc_id] = (rank, lexical_similarity(score))
+    
+    fused = []
+    for doc_id, item in items.items():
+        if method == "rrf":
+            # Reciprocal rank fusion, scaled so rank 1 in both lists is 1.0
+            relevance = sum(1.0 / (rrf_k + ranked[doc_id][0] + 1)
+                            for ranked in (vector_sim, lexical_sim) if doc_id in ranked)
+            relevance /= 2.0 / (rrf_k + 1)
+        else:
+            relevance = (vector_weight * vector_sim.get(doc_id, (None, 0.0))[1]
+                         + (1 - vector_weight) * lexical_sim.get(doc_id, (None, 0.0))[1])
+        item['relevance'] = relevance
+        fused.append(item)
+    
+    fused.sort(key=lambda item: item['relevance'], reverse=True)
+    return fused[:top_k]
+
+def hybrid_search(query: str, top_k=3):
+    """Run FAISS and keyword search together and fuse them into one ranking"""
+    candidates = max(top_k, hybrid_candidates)
+    vector_results = vector_search(query, k=candidates)
+    lexical_scored = lexical_search(query, top_k=candidates)
+    return fuse_results(vector_results, lexical_scored, top_k=top_k)
+
+def vector_search(query: str, k=3):
+    """Vector search through the micro-batcher when it is enabled"""
+    if query_batcher is not None:
+        return query_batcher.search(query, k)
+    return search(query, k=k)
 
 def retrieve_relevant_data(query: str, top_k=3):
+    if retrieval_mode == "hybrid":
+        return hybrid_search(query, top_k=top_k)
+    
     # First try vector-based search using FAISS
-    vector_results = search(query, k=top_k)
+    vector_results = vector_search(query, k=top_k)
     
     # If we got results from vector search, return them
     if vector_results:
         return vector_results
     
-    # Fallback to keyword-based search if vector search returns no results
-    knowledge_data = load_knowledge_base()
-    
-    # Split query into keywords for better matching
-    query_keywords = set(query.lower().split())
-    
-    # Extract main topic from query (e.g., "Roth IRA" from "What are the benefits of a Roth IRA?")
-    query_lower = query.lower()
-    
-    # Score each item in the knowledge base
-    scored_items = []
-    for item in knowledge_data:
-        text = item['text'].lower()
-        
-        # Calculate a relevance score based on keyword matches
-        score = 0
-        
-        # Check for exact phrase matches first (highest priority)
-        if query_lower in text:
-            score += 10
-        
-        # Check for individual keyword matches
-        for keyword in query_keywords:
-            if keyword in text and len(keyword) > 2:  # Only consider keywords with length > 2
-                score += 1
-                
-                # Give extra weight to important financial terms
-                if keyword in ['ira', 'roth', '401k', 'retirement', 'investment', 'fund', 'stock', 'bond', 'fee', 'fees', 'commission', 'cost']:
-                    score += 2
-                    
-                # Give extra weight to titles/questions
-                if "Q:" in item['text'] and keyword in item['text'].split("Q:")[1].split("A:")[0].lower():
-                    score += 3
-        
-        # Only include items with a minimum relevance
-        if score > 0:
-            scored_items.append((score, item))
-    
-    # Sort by score (highest first) and take top_k
-    scored_items.sort(reverse=True, key=lambda x: x[0])
+    return keyword_fallback(query, top_k=top_k)
+
+def keyword_fallback(query: str, top_k=3):
+    """Keyword-based search using the precomputed inverted index
+    (BM25 plus boosts for phrase, financial term and FAQ question matches)"""
+    scored_items = lexical_search(query, top_k=top_k)
     
     # Return only the items, not the scores
-    results = [item for score, item in scored_items[:top_k]]
+    results = [get_document(doc_id) for score, doc_id in scored_items]
+    results = [item for item in results if item is not None]
     
     # If no results found, return an empty list
     return results if results else []
+
+def retrieve_relevant_data_batch(queries, top_k=3):
+    """retrieve_relevant_data for many queries at once: one batched encode and one
+    multi-query FAISS search for all of them. Returns one result list per query."""
+    if retrieval_mode == "hybrid":
+        candidates = max(top_k, hybrid_candidates)
+        vector_batch = search_batch(queries, k=candidates)
+        return [fuse_results(vector_results, lexical_search(query, top_k=candidates), top_k=top_k)
+                for query, vector_results in zip(queries, vector_batch)]
+    
+    vector_batch = search_batch(queries, k=top_k)
+    return [vector_results or keyword_fallback(query, top_k=top_k)
+            for query, vector_results in zip(queries, vector_batch)]
@@ -0,0 +1,330 @@
+# Conversation history storage
+##### src/sessions.py #####
+import abc
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+
+from src.sqlite_util import ThreadLocalConnection, Transaction
+
+# Responses at least this long are stored zlib-compressed
+COMPRESS_MIN_BYTES = 256
+# Rough per-turn bookkeeping cost counted against the memory budget
+TURN_OVERHEAD_BYTES = 64
+
+
+def _pack(text: str) -> bytes:
+    """Encode text for storage, compressing long text. The first byte tags the format."""
+    data = text.encode("utf-8")
+    if len(data) >= COMPRESS_MIN_BYTES:
+        return b"z" + zlib.compress(data)
+    return b"t" + data
+
+
+def _unpack(data) -> str:
+    data = bytes(data)
+    if data[:1] == b"z":
+        return zlib.decompress(data[1:]).decode("utf-8")
+    return data[1:].decode("utf-8")
+
+
+class SessionStore(MutableMapping):
+    """Conversation histories keyed by session id.
+
+    Behaves like a dict of session id -> list of (query, response) turns, so
+    existing code can keep using it that way. Use append_turn() to add turns;
+    it applies the store's caps and eviction.
+    """
+
+    @abc.abstractmethod
+    def append_turn(self, session_id, query, response):
+        """Add a turn to a session, creating it if needed"""
+
+    def get(self, session_id, default=None):
+        try:
+            return self[session_id]
+        except KeyError:
+            return default
+
+    def stats(self):
+        return {"sessions": len(self)}
+
+
+class _Session:
+    __slots__ = ("turns", "size", "last_access")
+
+    def __init__(self, max_turns, now):
+        self.turns = deque(maxlen=max_turns or None)  # (query bytes, packed response)
+        self.size = 0
+        self.last_access = now
+
+
+class InMemorySessionStore(SessionStore):
+    """Per-process session store with turn caps, idle expiry and a global memory budget.
+
+    Turns are kept as UTF-8 bytes with long responses zlib-compressed. When
+    the total size goes over max_bytes, least recently used sessions are evicted.
+    """
+
+    def __init__(self, max_turns=20, idle_ttl_seconds=3600, max_bytes=64 * 1024 * 1024,
+                 clock=time.monotonic):
+        self.max_turns = max_turns
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._sessions = OrderedDict()  # least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @staticmethod
+    def _turn_size(turn):
+        return len(turn[0]) + len(turn[1]) + TURN_OVERHEAD_BYTES
+
+    def _expire_idle(self, now):
+        if not self.idle_ttl_seconds:
+            return
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_access < self.idle_ttl_seconds:
+                break
+            self._drop(session_id)
+
+    def _drop(self, session_id):
+        session = self._sessions.pop(session_id)
+        self._size -= session.size
+        self.evictions += 1
+
+    def _enforce_budget(self, keep):
+        while self.max_bytes and self._size > self.max_bytes and len(self._sessions) > 1:
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                break
+            self._drop(oldest)
+
+    def _touch(self, session_id, now):
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        session.last_access = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _set_turns(self, session_id, turns, now):
+        if session_id in self._sessions:
+            self._size -= self._sessions.pop(session_id).size
+        session = _Session(self.max_turns, now)
+        for query, response in turns:
+            session.turns.append((query.encode("utf-8"), _pack(response)))
+        session.size = sum(self._turn_size(turn) for turn in session.turns)
+        self._sessions[session_id] = session
+        self._size += session.size
+
+    def append_turn(self, session_id, query, response):
+        with self._lock:
+            now = self._clock()
+            self._expire_idle(now)
+            session = self._touch(session_id, now)
+            if session is None:
+                session = _Session(self.max_turns, now)
+                self._sessions[session_id] = session
+            if len(session.turns) == session.turns.maxlen:
+                dropped = session.turns[0]
+                session.size -= self._turn_size(dropped)
+                self._size -= self._turn_size(dropped)
+            turn = (query.encode("utf-8"), _pack(response))
+            session.turns.append(turn)
+            session.size += self._turn_size(turn)
+            self._size += self._turn_size(turn)
+            self._enforce_budget(keep=session_id)
+
+    def __getitem__(self, session_id):
+        with self._lock:
+            now = self._clock()
+            self._expire_idle(now)
+            session = self._touch(session_id, now)
+            if session is None:
+                raise KeyError(session_id)
+            return [(query.decode("utf-8"), _unpack(response)) for query, response in session.turns]
+
+    def __setitem__(self, session_id, turns):
+        with self._lock:
+            now = self._clock()
+            self._expire_idle(now)
+            self._set_turns(session_id, turns, now)
+            self._enforce_budget(keep=session_id)
+
+    def __delitem__(self, session_id):
+        with self._lock:
+            if session_id not in self._sessions:
+                raise KeyError(session_id)
+            self._size -= self._sessions.pop(session_id).size
+
+    def __contains__(self, session_id):
+        with self._lock:
+            self._expire_idle(self._clock())
+            return session_id in self._sessions
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._sessions))
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._size = 0
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "sessions": len(self._sessions),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+
+class SQLiteSessionStore(SessionStore):
+    """Session store in a SQLite file that several uvicorn workers can share.
+
+    Uses WAL mode so readers do not block the writer. Turn caps and idle
+    expiry are enforced on write; there is no memory budget since nothing
+    is held in process memory.
+    """
+
+    def __init__(self, path, max_turns=20, idle_ttl_seconds=3600, clock=time.time):
+        self.path = path
+        self.max_turns = max_turns
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._clock = clock
+        self._connections = ThreadLocalConnection(path)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, last_access REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                " session_id TEXT NOT NULL, seq INTEGER NOT NULL,"
+                " query TEXT NOT NULL, response BLOB NOT NULL,"
+                " PRIMARY KEY (session_id, seq))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+
+    def _connect(self):
+        return Transaction(self._connections.get())
+
+    def _expire_idle(self, conn, now):
+        if not self.idle_ttl_seconds:
+            return
+        cutoff = now - self.idle_ttl_seconds
+        conn.execute(
+            "DELETE FROM turns WHERE session_id IN (SELECT id FROM sessions WHERE last_access < ?)",
+            (cutoff,),
+        )
+        conn.execute("DELETE FROM sessions WHERE last_access < ?", (cutoff,))
+
+    def append_turn(self, session_id, query, response):
+        now = self._clock()
+        with self._connect() as conn:
+            self._expire_idle(conn, now)
+            conn.execute(
+                "INSERT INTO sessions (id, last_access) VALUES (?, ?)"
+                " ON CONFLICT(id) DO UPDATE SET last_access = excluded.last_access",
+                (session_id, now),
+            )
+            (last_seq,) = conn.execute(
+                "SELECT COALESCE(MAX(seq), -1) FROM turns WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            conn.execute(
+                "INSERT INTO turns (session_id, seq, query, response) VALUES (?, ?, ?, ?)",
+                (session_id, last_seq + 1, query, _pack(response)),
+            )
+            if self.max_turns:
+                conn.execute(
+                    "DELETE FROM turns WHERE session_id = ? AND seq <= ?",
+                    (session_id, last_seq + 1 - self.max_turns),
+                )
+
+    def __getitem__(self, session_id):
+        now = self._clock()
+        with self._connect() as conn:
+            row = conn.execute("SELECT last_access FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None or (self.idle_ttl_seconds and now - row[0] >= self.idle_ttl_seconds):
+                raise KeyError(session_id)
+            conn.execute("UPDATE sessions SET last_access = ? WHERE id = ?", (now, session_id))
+            rows = conn.execute(
+                "SELECT query, response FROM turns WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+        return [(query, _unpack(response)) for query, response in rows]
+
+    def __setitem__(self, session_id, turns):
+        turns = list(turns)[-self.max_turns:] if self.max_turns else list(turns)
+        now = self._clock()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            conn.execute(
+                "INSERT INTO sessions (id, last_access) VALUES (?, ?)"
+                " ON CONFLICT(id) DO UPDATE SET last_access = excluded.last_access",
+                (session_id, now),
+            )
+            conn.executemany(
+                "INSERT INTO turns (session_id, seq, query, response) VALUES (?, ?, ?, ?)",
+                [(session_id, seq, query, _pack(response)) for seq, (query, response) in enumerate(turns)],
+            )
+
+    def __delitem__(self, session_id):
+        with self._connect() as conn:
+            deleted = conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount
+            conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+        if not deleted:
+            raise KeyError(session_id)
+
+    def __contains__(self, session_id):
+        try:
+            self[session_id]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id FROM sessions").fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM turns")
+            conn.execute("DELETE FROM sessions")
+
+    def stats(self):
+        return {"backend": "sqlite", "sessions": len(self), "path": self.path}
+
+
+def create_session_store(config=None):
+    """Build the session store described by the 'sessions' config section"""
+    config = config or {}
+    backend = config.get("backend", "memory")
+    max_turns = config.get("max_turns", 20)
+    idle_ttl_seconds = config.get("idle_ttl_seconds", 3600)
+    if backend == "memory":
+        return InMemorySessionStore(
+            max_turns=max_turns,
+            idle_ttl_seconds=idle_ttl_seconds,
+            max_bytes=config.get("max_memory_mb", 64) * 1024 * 1024,
+        )
+    if backend == "sqlite":
+        return SQLiteSessionStore(
+            config.get("path", "data/sessions.db"),
+            max_turns=max_turns,
+            idle_ttl_seconds=idle_ttl_seconds,
+        )
+    raise ValueError(f"Unknown session backend '{backend}', expected 'memory' or 'sqlite'")
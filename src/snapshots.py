@@ -0,0 +1,176 @@
+# Versioned, read-only knowledge base snapshots shared by all server workers
+##### src/snapshots.py #####
+"""Knowledge base snapshots for the read-only serving mode.
+
+A snapshot is a directory data/snapshots/<version>/ holding a FAISS index,
+the documents as an offset-indexed document store and a manifest. It is
+never modified after it is published: workers map its files read-only, so
+every worker on a node shares one copy in the page cache. data/snapshots/CURRENT
+names the snapshot to serve and is switched with an atomic rename, after the
+snapshot directory is complete. Workers notice the switch on their next search.
+
+Build and publish a snapshot (a separate step, e.g. after ingest) with:
+
+    python -m src.snapshots publish
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+import uuid
+
+import faiss
+
+from src.document_store import DocumentStore, DocumentStoreWriter
+from src.embedding_store import EmbeddingStore
+
+SNAPSHOT_DIR = "data/snapshots"
+INDEX_FILE = "faiss_index"
+DOCUMENTS_FILE = "knowledge_base.jsonl"
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+EMBEDDINGS_DIR = "embeddings"
+
+# Flat and HNSW codes and IVF inverted lists are read straight from the mapped file
+# (IO_FLAG_MMAP_IFC); older FAISS versions can only map IVF lists
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def _fsync_write(path, data):
+    with open(path, "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class SnapshotStore:
+    """Publishes snapshots under root and tells readers which one is current"""
+
+    def __init__(self, root=SNAPSHOT_DIR):
+        self.root = root
+        self.current_path = os.path.join(root, CURRENT_FILE)
+
+    def path(self, version, name=""):
+        return os.path.join(self.root, version, name)
+
+    def current_stat(self):
+        """(mtime_ns, inode) of CURRENT, a cheap check for a newly published snapshot"""
+        try:
+            st = os.stat(self.current_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_ino)
+
+    def current(self):
+        """Version of the snapshot being served, or None if none was published"""
+        try:
+            with open(self.current_path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def versions(self):
+        """Published snapshot versions, oldest first"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if not name.startswith(".") and os.path.isfile(self.path(name, MANIFEST_FILE))
+        )
+
+    def manifest(self, version):
+        with open(self.path(version, MANIFEST_FILE)) as f:
+            return json.load(f)
+
+    def publish(self, index, items, metadata=None, keep=3, embeddings=None):
+        """Write a new snapshot from a FAISS index and an iterable of items, then make it current.
+
+        embeddings, if given, is (model name, iterable of (texts, vectors)): the
+        float vectors of an approximate index, kept for exact reranking.
+        """
+        # Sorts by publish time, to the microsecond, so the newest snapshots are kept by prune
+        now = time.time()
+        version = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(now))}{int(now % 1 * 1e6):06d}-{uuid.uuid4().hex[:8]}"
+        tmp_dir = os.path.join(self.root, f".tmp-{version}")
+        os.makedirs(tmp_dir)
+        try:
+            with DocumentStoreWriter(os.path.join(tmp_dir, DOCUMENTS_FILE)) as writer:
+                for item in items:
+                    writer.add(item)
+            count = len(writer)
+            if embeddings is not None:
+                model_name, batches = embeddings
+                store = EmbeddingStore(os.path.join(tmp_dir, EMBEDDINGS_DIR), model_name)
+                for texts, vectors in batches:
+                    store.add(texts, vectors)
+                metadata = dict(metadata or {}, embeddings=model_name)
+            index_path = os.path.join(tmp_dir, INDEX_FILE)
+            faiss.write_index(index, index_path)
+            with open(index_path, "rb") as f:
+                os.fsync(f.fileno())
+            manifest = dict(metadata or {}, version=version, created_at=time.time(),
+                            documents=count, vectors=int(index.ntotal))
+            _fsync_write(os.path.join(tmp_dir, MANIFEST_FILE), json.dumps(manifest, indent=2))
+            # The directory appears complete under its final name, then CURRENT switches to it
+            os.rename(tmp_dir, self.path(version))
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        tmp_current = f"{self.current_path}.tmp.{os.getpid()}"
+        _fsync_write(tmp_current, version + "\n")
+        os.replace(tmp_current, self.current_path)
+        self.prune(keep)
+        return version
+
+    def prune(self, keep=3):
+        """Delete all but the newest keep snapshots (never the current one).
+
+        Workers still serving a deleted snapshot keep their mappings until
+        they switch; the files are only freed once the last one is unmapped.
+        """
+        current = self.current()
+        versions = self.versions()
+        for version in versions[:max(0, len(versions) - keep)]:
+            if version != current:
+                shutil.rmtree(self.path(version), ignore_errors=True)
+
+    def embedding_store(self, version):
+        """The vectors published with a snapshot, or None if it has none"""
+        model_name = self.manifest(version).get("embeddings")
+        if model_name is None:
+            return None
+        return EmbeddingStore(self.path(version, EMBEDDINGS_DIR), model_name)
+
+    def open(self, version):
+        """Return (index, document store, manifest) of a snapshot, memory-mapped read-only"""
+        index = faiss.read_index(self.path(version, INDEX_FILE), MMAP_FLAGS)
+        store = DocumentStore(self.path(version, DOCUMENTS_FILE), memory_map=True)
+        return index, store, self.manifest(version)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Knowledge base snapshots for read-only serving")
+    commands = parser.add_subparsers(dest="command", required=True)
+    publish = commands.add_parser("publish", help="build the index from data/ and publish it as a snapshot")
+    publish.add_argument("--keep", type=int, default=3, help="snapshots to keep (default 3)")
+    commands.add_parser("list", help="list published snapshots")
+    args = parser.parse_args(argv)
+
+    # Imported here: loading the knowledge base module reads config and sets up the model
+    from src import knowledge_base
+
+    if args.command == "publish":
+        version = knowledge_base.publish_snapshot(keep=args.keep)
+        print(f"Published snapshot {version}")
+        return
+    store = knowledge_base.snapshot_store
+    current = store.current()
+    for version in store.versions():
+        manifest = store.manifest(version)
+        marker = "*" if version == current else " "
+        print(f"{marker} {version}  {manifest['documents']} documents, {manifest['vectors']} vectors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# SQLite helpers shared by the session store and the delivery outbox
+##### src/sqlite_util.py #####
+import sqlite3
+import threading
+
+
+class ThreadLocalConnection:
+    """One SQLite connection per thread, in WAL mode so readers do not block the writer"""
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get(self):
+        # One connection per thread; sqlite3 connections are not thread-safe
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+
+class Transaction:
+    """Run the statements of a with-block in one immediate SQLite transaction"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
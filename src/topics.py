@@ -0,0 +1,110 @@
+# Catalog of general answers for common financial topics, routed by query embedding
+##### src/topics.py #####
+"""Topic catalog used by FinancialAI for general answers.
+
+Topics are data (data/topics.json), not code: each has a name, keywords,
+example questions and an answer. The example questions are embedded once
+and averaged into one unit-length centroid per topic, so routing a batch of
+queries is a single matrix product against all topics however many there
+are. Keyword matching, longest keyword first, is kept for the fallback
+after a retrieval miss and for topics the embeddings do not separate.
+"""
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from src.relevance import TermMatcher
+
+TOPICS_PATH = "data/topics.json"
+
+
+class Topic:
+    __slots__ = ("name", "answer", "keywords", "examples")
+
+    def __init__(self, name, answer, keywords=(), examples=()):
+        self.name = name
+        self.answer = answer
+        self.keywords = [keyword.lower() for keyword in keywords]
+        # Without examples the name and keywords stand in for the questions
+        self.examples = list(examples) or list(dict.fromkeys([name] + self.keywords))
+
+    def __repr__(self):
+        return f"Topic({self.name!r})"
+
+
+class TopicCatalog:
+    """Topics with keyword lookup and embedding routing.
+
+    encode(texts) returns unit-length float32 embeddings, as used for the
+    index; it is called once, on the first route(), to build the centroids.
+    A query is routed to a topic when its cosine similarity to the topic's
+    centroid is at least min_similarity and beats the runner-up by min_margin.
+    """
+
+    def __init__(self, topics, encode=None, min_similarity=0.8, min_margin=0.05):
+        self.topics = list(topics)
+        self.encode = encode
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self._keyword_topics = {}
+        for topic in self.topics:
+            for keyword in topic.keywords:
+                self._keyword_topics.setdefault(keyword, topic)
+        self._matcher = TermMatcher(self._keyword_topics)
+        self._centroids = None
+        self._lock = threading.Lock()
+        state = [(topic.name, topic.answer, topic.keywords, topic.examples) for topic in self.topics]
+        self.digest = hashlib.sha256(json.dumps(state).encode()).hexdigest()[:16]
+
+    @classmethod
+    def load(cls, path=TOPICS_PATH, **kwargs):
+        """Read a catalog file ({"topics": [...]}); a missing file gives an empty catalog"""
+        if not os.path.exists(path):
+            return cls([], **kwargs)
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls([Topic(**topic) for topic in data.get("topics", [])], **kwargs)
+
+    def __len__(self):
+        return len(self.topics)
+
+    def find(self, text):
+        """The topic of the longest keyword occurring in text, or None"""
+        found = self._matcher.find(text)
+        if not found:
+            return None
+        return self._keyword_topics[max(found, key=len)]
+
+    def centroids(self):
+        """(topics, dimension) unit-length centroids of the example embeddings, built on first use"""
+        if self._centroids is None:
+            with self._lock:
+                if self._centroids is None:
+                    examples = [example for topic in self.topics for example in topic.examples]
+                    embeddings = np.asarray(self.encode(examples), dtype=np.float32)
+                    owners = np.repeat(np.arange(len(self.topics)), [len(topic.examples) for topic in self.topics])
+                    centroids = np.zeros((len(self.topics), embeddings.shape[1]), dtype=np.float32)
+                    np.add.at(centroids, owners, embeddings)
+                    centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+                    self._centroids = centroids
+        return self._centroids
+
+    def route(self, embeddings):
+        """The confidently matching topic for each row of embeddings, or None"""
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if not self.topics or self.encode is None:
+            return [None] * len(embeddings)
+        similarities = embeddings @ self.centroids().T
+        best = similarities.argmax(axis=1)
+        rows = np.arange(len(embeddings))
+        best_similarity = similarities[rows, best]
+        if len(self.topics) > 1:
+            similarities[rows, best] = -np.inf
+            runner_up = similarities.max(axis=1)
+        else:
+            runner_up = np.full(len(embeddings), -np.inf, dtype=np.float32)
+        confident = (best_similarity >= self.min_similarity) & (best_similarity - runner_up >= self.min_margin)
+        return [self.topics[topic] if ok else None for topic, ok in zip(best, confident)]
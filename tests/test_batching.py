@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+from src.batching import QueryBatcher
+
+
+class Recorder:
+    """search_batch that returns k numbered results per query and records each call"""
+
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    def __call__(self, queries, k):
+        self.calls.append((list(queries), k))
+        if self.error is not None:
+            raise self.error
+        return [[f"{query}-{rank}" for rank in range(k)] for query in queries]
+
+
+def test_full_batches_are_searched_without_waiting_for_the_window():
+    search_batch = Recorder()
+    batcher = QueryBatcher(search_batch, max_batch_size=3, max_wait_ms=60000)
+    start = time.monotonic()
+    futures = [batcher.submit(query, k) for query, k in (("a", 1), ("b", 3), ("c", 2))]
+    # Each caller gets its own results, trimmed to its own k
+    assert [future.result(timeout=5) for future in futures] == [["a-0"], ["b-0", "b-1", "b-2"], ["c-0", "c-1"]]
+    assert time.monotonic() - start < 5
+    assert search_batch.calls == [(["a", "b", "c"], 3)]
+    assert batcher.stats() == {"batches": 1, "queries": 3, "mean_batch_size": 3.0}
+
+
+def test_partial_batches_are_searched_when_the_window_closes():
+    search_batch = Recorder()
+    batcher = QueryBatcher(search_batch, max_batch_size=16, max_wait_ms=50)
+    start = time.monotonic()
+    assert batcher.search("a", k=2) == ["a-0", "a-1"]
+    assert time.monotonic() - start >= 0.05
+
+    results = {}
+    threads = [threading.Thread(target=lambda q=query: results.update({q: batcher.search(q, k=1)}))
+               for query in ("x", "y", "z")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert results == {"x": ["x-0"], "y": ["y-0"], "z": ["z-0"]}
+    assert sum(len(queries) for queries, _ in search_batch.calls) == 4
+
+
+def test_errors_reach_every_caller_in_the_batch_and_the_batcher_keeps_running():
+    search_batch = Recorder(error=RuntimeError("index not ready"))
+    batcher = QueryBatcher(search_batch, max_batch_size=2, max_wait_ms=60000)
+    futures = [batcher.submit("a"), batcher.submit("b")]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="index not ready"):
+            future.result(timeout=5)
+    assert batcher.stats()["batches"] == 0
+
+    search_batch.error = None
+    futures = [batcher.submit("c", k=1), batcher.submit("d", k=1)]
+    assert [future.result(timeout=5) for future in futures] == [["c-0"], ["d-0"]]
@@ -0,0 +1,18 @@
+from benchmarks.ask_pipeline import compare, synthetic_items
+
+
+def test_synthetic_corpus_is_deterministic():
+    first = list(synthetic_items(20, seed=3))
+    assert first == list(synthetic_items(20, seed=3))
+    assert [item["id"] for item in first] == list(range(20))
+    assert {item["source"] for item in first} == {"FAQ", "Help Article"}
+
+
+def test_compare_flags_regressions_in_both_directions():
+    def report(p95_ms, qps):
+        return {"runs": [{"size": 1000, "stages": {"answer": {"p95_ms": p95_ms}},
+                          "concurrency": [{"workers": 4, "qps": qps}]}]}
+
+    rows, regressions = compare(report(10.0, 100.0), report(11.0, 50.0), threshold=0.2)
+    assert {name for _, name, *_ in rows} == {"stages.answer.p95_ms", "concurrency.4.qps"}
+    assert [name for _, name, *_ in regressions] == ["concurrency.4.qps"]
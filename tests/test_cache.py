@@ -0,0 +1,141 @@
+import threading
+
+import numpy as np
+
+from src.cache import LRUCache, ResponseCache, SemanticResponseCache, normalize_query
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_normalize_query():
+    assert normalize_query("  What is a  Roth IRA?\n") == "what is a roth ira?"
+    # For models that read case, only whitespace is normalized
+    assert normalize_query("  What is a  Roth IRA?\n", lowercase=False) == "What is a Roth IRA?"
+    cache = ResponseCache(normalize=lambda query: normalize_query(query, lowercase=False))
+    assert cache.get_or_compute("Roth IRA", "v1", lambda: "cased answer") == "cased answer"
+    assert cache.get(" Roth  IRA", "v1") == "cased answer" and cache.get("roth ira", "v1") is None
+
+
+def test_lru_eviction_and_counters():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now least recently used
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    stats = cache.stats()
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+    assert stats["evictions"] == 1
+    assert stats["size"] == 2
+    assert stats["hit_rate"] == 0.75
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = LRUCache(max_size=10, ttl_seconds=5, clock=clock)
+    cache.put("q", "vector")
+    clock.now = 4.9
+    assert cache.get("q") == "vector"
+    clock.now = 5.0
+    assert cache.get("q") is None
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_get_or_compute_only_computes_on_miss():
+    cache = LRUCache(max_size=10)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return "value"
+
+    assert cache.get_or_compute("k", compute) == "value"
+    assert cache.get_or_compute("k", compute) == "value"
+    assert len(calls) == 1
+
+
+def test_zero_size_disables_cache():
+    cache = LRUCache(max_size=0)
+    cache.put("k", 1)
+    assert cache.get("k") is None
+    assert len(cache) == 0
+
+
+def test_concurrent_access_stays_bounded():
+    cache = LRUCache(max_size=50)
+
+    def worker(offset):
+        for i in range(500):
+            cache.get_or_compute((offset + i) % 120, lambda: i)
+
+    threads = [threading.Thread(target=worker, args=(n * 7,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stats = cache.stats()
+    assert stats["size"] <= 50
+    assert stats["hits"] + stats["misses"] == 8 * 500
+
+
+def test_response_cache_is_emptied_when_the_version_changes():
+    cache = ResponseCache(max_size=10)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return "answer"
+
+    assert cache.get_or_compute("What are your fees?", "v1", compute) == "answer"
+    assert cache.get_or_compute("  what are your FEES? ", "v1", compute) == "answer"
+    assert len(calls) == 1
+
+    assert cache.get("What are your fees?", "v2") is None
+    assert cache.stats()["invalidations"] == 1
+    # A response computed against the old version is not stored under the new one
+    cache.put("What are your fees?", "v1", "stale")
+    assert cache.get("What are your fees?", "v2") is None
+
+
+def _unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_semantic_cache_serves_near_duplicates_with_lru_eviction():
+    cache = SemanticResponseCache(max_size=2, max_distance=0.1)
+    assert cache.get(_unit(1, 0, 0), "v1") is None
+    cache.put(_unit(1, 0, 0), "v1", "roth")
+    cache.put(_unit(0, 1, 0), "v1", "fees")
+
+    assert cache.get(_unit(1, 0.1, 0), "v1") == "roth"  # distance ~0.01
+    assert cache.get(_unit(1, 1, 0), "v1") is None  # distance ~0.59
+    assert cache.get(_unit(1, 0, 0), "v1", fingerprint="other settings") is None
+
+    cache.put(_unit(0, 0, 1), "v1", "ira")  # evicts "fees", the least recently used
+    assert cache.get(_unit(0, 1, 0), "v1") is None
+    assert cache.get(_unit(1, 0, 0), "v1") == "roth"
+    stats = cache.stats()
+    assert (stats["size"], stats["hits"], stats["misses"], stats["evictions"]) == (2, 2, 4, 1)
+
+
+def test_semantic_cache_is_emptied_when_the_version_changes():
+    cache = SemanticResponseCache()
+    cache.put(_unit(1, 0), "v1", "ignored")  # No lookup for v1 yet
+    cache.get(_unit(1, 0), "v1")
+    cache.put(_unit(1, 0), "v1", "roth")
+    assert cache.get(_unit(1, 0), "v1") == "roth"
+    assert cache.get(_unit(1, 0), "v2") is None
+    assert len(cache) == 0 and cache.stats()["invalidations"] == 1
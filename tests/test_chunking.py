@@ -0,0 +1,30 @@
+import pytest
+
+from src.chunking import chunk_settings, chunk_text
+
+
+def test_short_text_is_one_unchanged_chunk():
+    text = "Resetting your password\nClick 'Forgot password' on the login page."
+    assert chunk_text(text) == [text]
+
+
+def test_token_windows_overlap_and_cover_the_text():
+    words = [f"w{i}" for i in range(25)]
+    chunks = chunk_text(" ".join(words), {"max_tokens": 10, "overlap": 2})
+
+    assert [chunk.split() for chunk in chunks] == [words[0:10], words[8:18], words[16:25]]
+
+
+def test_paragraph_mode_keeps_paragraphs_together():
+    first = " ".join(["alpha"] * 6)
+    second = " ".join(["beta"] * 6)
+    chunks = chunk_text(f"{first}\n\n{second}", {"mode": "paragraph", "max_tokens": 8, "overlap": 2})
+
+    assert chunks == [first, second]
+
+
+def test_invalid_settings():
+    with pytest.raises(ValueError):
+        chunk_settings({"mode": "sentences"})
+    with pytest.raises(ValueError):
+        chunk_settings({"max_tokens": 10, "overlap": 10})
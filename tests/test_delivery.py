@@ -0,0 +1,174 @@
+import time
+from email.mime.text import MIMEText
+
+import pytest
+
+from benchmarks.fake_servers import FakeSMTPServer, FakeTwilioServer
+from src.delivery import DeliveryError, DeliveryQueue, SQLiteOutbox, TokenBucket
+from src.integrations import SMTPPool, TwilioWhatsAppSender, send_response_to_channel
+
+
+def _wait_for(queue, delivery_id, statuses=("delivered", "failed"), timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = queue.status(delivery_id)
+        if status and status["status"] in statuses:
+            return status
+        time.sleep(0.01)
+    raise AssertionError(f"delivery {delivery_id} still {queue.status(delivery_id)}")
+
+
+def test_delivery_happens_in_background():
+    sent = []
+    queue = DeliveryQueue(lambda channel, response, recipient: sent.append((channel, response, recipient)) or True)
+    delivery_id = queue.submit("whatsapp", "hello", "+15550000000")
+
+    status = _wait_for(queue, delivery_id)
+    assert status["status"] == "delivered"
+    assert status["attempts"] == 1
+    assert sent == [("whatsapp", "hello", "+15550000000")]
+    queue.stop()
+
+
+def test_failed_sends_are_retried_with_backoff():
+    attempts = []
+
+    def flaky(channel, response, recipient):
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise ConnectionError("twilio unavailable")
+        return True
+
+    queue = DeliveryQueue(flaky, max_attempts=3, backoff_seconds=0.02)
+    status = _wait_for(queue, queue.submit("whatsapp", "hi", "+1"))
+    assert status["status"] == "delivered"
+    assert status["attempts"] == 3
+    assert attempts[1] - attempts[0] >= 0.02
+    assert attempts[2] - attempts[1] >= 0.04
+    queue.stop()
+
+
+def test_delivery_fails_after_max_attempts():
+    queue = DeliveryQueue(lambda *args: False, max_attempts=2, backoff_seconds=0.01)
+    status = _wait_for(queue, queue.submit("email", "hi", "a@example.com"))
+    assert status["status"] == "failed"
+    assert status["attempts"] == 2
+    assert status["error"] == "delivery failed"
+    queue.stop()
+
+
+def test_unknown_channel_or_missing_recipient_fails_without_retries():
+    for channel, recipient in (("fax", "+1"), ("whatsapp", None), ("email", "")):
+        with pytest.raises(DeliveryError) as failure:
+            send_response_to_channel(channel, "hi", recipient)
+        assert not failure.value.retryable
+
+    queue = DeliveryQueue(send_response_to_channel, max_attempts=3, backoff_seconds=0.01)
+    status = _wait_for(queue, queue.submit("fax", "hi", "+1"))
+    assert (status["status"], status["attempts"]) == ("failed", 1)
+    assert "Unknown channel" in status["error"]
+    queue.stop()
+
+
+def test_unknown_delivery_id():
+    assert DeliveryQueue(lambda *args: True).status("missing") is None
+
+
+def test_rate_limit_spaces_out_sends():
+    sent = []
+    queue = DeliveryQueue(lambda *args: sent.append(time.monotonic()) or True, workers=4,
+                          rate_limits={"whatsapp": TokenBucket(rate=50, burst=1)})
+    delivery_ids = [queue.submit("whatsapp", "hi", "+1") for _ in range(5)]
+    for delivery_id in delivery_ids:
+        assert _wait_for(queue, delivery_id)["status"] == "delivered"
+
+    assert sent[-1] - sent[0] >= 4 / 50 * 0.9
+    assert queue.stats()["channels"]["whatsapp"]["delivered"] == 5
+    assert queue.stats()["channels"]["whatsapp"]["throttled"] > 0
+    queue.stop()
+
+
+def test_sqlite_outbox_resumes_pending_deliveries(tmp_path):
+    path = str(tmp_path / "deliveries.db")
+    queue = DeliveryQueue(lambda *args: True, outbox=SQLiteOutbox(path))
+    queue.outbox.add({
+        "delivery_id": "left-over", "channel": "email", "recipient": "a@example.com", "response": "hi",
+        "status": "queued", "attempts": 0, "error": None, "created_at": 0.0, "next_attempt_at": 0.0,
+    })
+
+    # A new process with the same file picks up what was queued before it started
+    resumed = DeliveryQueue(lambda *args: True, outbox=SQLiteOutbox(path), poll_seconds=0.01)
+    resumed.start()
+    assert _wait_for(resumed, "left-over")["status"] == "delivered"
+    assert queue.status("left-over")["status"] == "delivered"
+    resumed.stop()
+
+
+def test_twilio_sender_reuses_connection_and_honours_429():
+    with FakeTwilioServer() as twilio:
+        sender = TwilioWhatsAppSender("AC123", "token", "+15550000000", api_base_url=twilio.url)
+        assert sender.send("+15551111111", "one")
+        twilio.fail_next(status=429, retry_after=2)
+        with pytest.raises(DeliveryError) as failure:
+            sender.send("+15551111111", "two")
+        assert failure.value.retryable and failure.value.retry_after == 2.0
+        twilio.fail_next(status=400)
+        with pytest.raises(DeliveryError) as failure:
+            sender.send("+15551111111", "three")
+        assert not failure.value.retryable
+        assert sender.send("+15551111111", "four")
+        sender.close()
+
+    assert [message["Body"] for message in twilio.messages] == ["one", "four"]
+    assert twilio.messages[0]["To"] == "whatsapp:+15551111111"
+    assert twilio.connections == 1
+
+
+def test_smtp_pool_reuses_connections():
+    with FakeSMTPServer() as smtp:
+        pool = SMTPPool(smtp.host, smtp.port, sender="bot@example.com", use_tls=False)
+        for number in range(3):
+            message = MIMEText(f"answer {number}")
+            message["Subject"] = "Your question"
+            assert pool.send("user@example.com", message)
+        pool.close()
+
+    assert len(smtp.messages) == 3
+    assert smtp.messages[0][1] == ["<user@example.com>"]
+    assert "answer 2" in smtp.messages[2][2]
+    assert smtp.connections == 1
+
+
+def test_smtp_pool_closes_connections_on_socket_errors():
+    class Connection:
+        def __init__(self, error=None):
+            self.error = error
+            self.closed = False
+
+        def sendmail(self, sender, recipients, data):
+            if self.error:
+                raise self.error
+
+        def close(self):
+            self.closed = True
+
+    pool = SMTPPool("smtp.invalid", sender="bot@example.com", use_tls=False)
+    timed_out, fresh = Connection(TimeoutError("timed out")), Connection()
+    connections = iter([timed_out, fresh])
+    pool._connect = lambda: next(connections)
+    message = MIMEText("answer")
+    assert pool.send("user@example.com", message)  # Reconnected after the timeout
+    assert timed_out.closed and pool._idle.get_nowait() is fresh
+
+    reset = [Connection(ConnectionResetError("reset")), Connection(TimeoutError("timed out"))]
+    connections = iter(reset)
+    with pytest.raises(DeliveryError, match="connection lost") as failure:
+        pool.send("user@example.com", message)
+    assert failure.value.retryable and all(connection.closed for connection in reset)
+    assert pool._idle.empty()
+
+    def refuse():
+        raise ConnectionRefusedError("refused")
+    pool._connect = refuse
+    with pytest.raises(DeliveryError, match="connection failed"):
+        pool.send("user@example.com", message)
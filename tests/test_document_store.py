@@ -0,0 +1,51 @@
+import json
+
+from src.document_store import Documents, DocumentStore, DocumentStoreWriter
+from src.ingest import iter_json_array, normalize_record
+
+
+def test_store_round_trip_and_last_write_wins(tmp_path):
+    path = str(tmp_path / "kb.jsonl")
+    with DocumentStoreWriter(path) as writer:
+        writer.add({"id": 7, "text": "old"})
+        writer.add({"id": 2, "text": "two"})
+        writer.add({"id": 7, "text": "new"})
+
+    store = DocumentStore(path)
+    assert len(store) == 2
+    assert store.get(7)["text"] == "new"
+    assert store.get(3) is None
+    assert [item["id"] for item in store] == [2, 7]
+
+
+def test_documents_overlay(tmp_path):
+    path = str(tmp_path / "kb.jsonl")
+    with DocumentStoreWriter(path) as writer:
+        for doc_id in range(3):
+            writer.add({"id": doc_id, "text": f"doc {doc_id}"})
+
+    documents = Documents(DocumentStore(path))
+    documents[1] = {"id": 1, "text": "changed"}
+    documents[5] = {"id": 5, "text": "added"}
+    del documents[0]
+
+    assert 0 not in documents
+    assert documents[1]["text"] == "changed"
+    assert list(documents) == [2, 1, 5]
+    assert len(documents) == 3
+    assert documents.max_id() == 5
+
+
+def test_iter_json_array_streams_small_reads(tmp_path):
+    records = [{"question": f"Q{i}?", "answer": "A [x], {y}"} for i in range(50)]
+    path = tmp_path / "faq.json"
+    path.write_text(json.dumps(records, indent=2))
+
+    assert list(iter_json_array(str(path), read_size=16)) == records
+
+
+def test_normalize_record():
+    assert normalize_record({"title": "Fees", "content": "None\r\n"}) == {
+        "text": "Fees\nNone", "source": "Help Article"
+    }
+    assert normalize_record({"id": "12", "question": "Q", "answer": "A"})["id"] == 12
@@ -0,0 +1,93 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from src.embedding_backends import create_backend, export_onnx
+
+sentence_transformers = pytest.importorskip("sentence_transformers")
+
+QUERIES = [
+    "What are your fees?",
+    "How do I reset my password?",
+    "Can I transfer my investments?",
+    "How do I withdraw money?",
+    "Is my data secure?",
+    "The mobile app does not sync",
+]
+
+
+@pytest.fixture(scope="module")
+def model(tmp_path_factory):
+    """(models_dir, model_name): the real model when it is in models/, otherwise a tiny random BERT"""
+    if os.path.isdir(os.path.join("models", "all-MiniLM-L6-v2")):
+        return "models", "all-MiniLM-L6-v2"
+
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    models_dir = tmp_path_factory.mktemp("models")
+    bert_dir = str(models_dir / "bert")
+    words = sorted({word.strip("?.,!'").lower() for text in QUERIES + _corpus() for word in text.split()})
+    vocab_path = models_dir / "vocab.txt"
+    vocab_path.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words))
+    BertTokenizerFast(vocab_file=str(vocab_path)).save_pretrained(bert_dir)
+    config = BertConfig(vocab_size=len(words) + 5, hidden_size=64, num_hidden_layers=2,
+                        num_attention_heads=4, intermediate_size=128)
+    BertModel(config).save_pretrained(bert_dir)
+
+    transformer = models.Transformer(bert_dir, max_seq_length=128)
+    pooling = models.Pooling(transformer.get_word_embedding_dimension(), pooling_mode="mean")
+    SentenceTransformer(modules=[transformer, pooling, models.Normalize()], device="cpu").save(
+        str(models_dir / "tiny")
+    )
+    return str(models_dir), "tiny"
+
+
+def _corpus():
+    with open("data/knowledge_base.json") as f:
+        return [item["text"] for item in json.load(f)]
+
+
+def _top_k(query_vectors, corpus_vectors, k=3):
+    distances = ((query_vectors[:, None, :] - corpus_vectors[None, :, :]) ** 2).sum(axis=2)
+    return np.argsort(distances, axis=1)[:, :k]
+
+
+def _assert_close_to_reference(backend, reference):
+    corpus = _corpus()
+    expected, actual = reference.encode(corpus), backend.encode(corpus)
+    assert actual.shape == expected.shape and actual.dtype == np.float32
+
+    cosine = (expected * actual).sum(axis=1) / (
+        np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1)
+    )
+    assert cosine.min() > 0.98
+
+    expected_top = _top_k(reference.encode(QUERIES), expected)
+    actual_top = _top_k(backend.encode(QUERIES), actual)
+    overlap = np.mean([len(set(a) & set(b)) / 3 for a, b in zip(expected_top, actual_top)])
+    assert expected_top[:, 0].tolist() == actual_top[:, 0].tolist()
+    assert overlap >= 0.8
+
+
+def test_torch_int8_matches_reference(model):
+    models_dir, name = model
+    reference = create_backend("sentence-transformers", name, models_dir)
+    _assert_close_to_reference(create_backend("torch-int8", name, models_dir), reference)
+
+
+@pytest.mark.parametrize("backend", ["onnx", "onnx-int8"])
+def test_onnx_matches_reference(model, backend):
+    pytest.importorskip("onnxruntime")
+    models_dir, name = model
+    if not os.path.exists(os.path.join(models_dir, name, "model_int8.onnx")):
+        export_onnx(name, models_dir, quantize=True)
+    reference = create_backend("sentence-transformers", name, models_dir)
+    _assert_close_to_reference(create_backend(backend, name, models_dir), reference)
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        create_backend("tensorrt")
@@ -0,0 +1,70 @@
+import numpy as np
+
+from src.embedding_store import EmbeddingStore
+
+
+def _encoder(calls, dimension=4):
+    def encode(texts):
+        calls.append(list(texts))
+        return np.array([[len(t), i, 1.0, 0.5] for i, t in enumerate(texts)], dtype=np.float32)[:, :dimension]
+    return encode
+
+
+def test_only_uncached_texts_are_encoded(tmp_path):
+    calls = []
+    store = EmbeddingStore(str(tmp_path), "test-model")
+    first = store.get_or_compute(["alpha", "beta"], _encoder(calls))
+    assert first.shape == (2, 4)
+
+    second = store.get_or_compute(["beta", "gamma", "alpha"], _encoder(calls))
+    assert calls == [["alpha", "beta"], ["gamma"]]
+    np.testing.assert_array_equal(second[0], first[1])
+    np.testing.assert_array_equal(second[2], first[0])
+
+
+def test_vectors_survive_restart_and_whitespace_changes(tmp_path):
+    calls = []
+    store = EmbeddingStore(str(tmp_path), "test-model")
+    original = store.get_or_compute(["Roth IRA  basics"], _encoder(calls))
+
+    reopened = EmbeddingStore(str(tmp_path), "test-model")
+    vectors = reopened.get_or_compute(["Roth IRA basics\n"], _encoder(calls))
+    assert len(calls) == 1
+    np.testing.assert_array_equal(vectors, original)
+
+
+def test_model_name_is_part_of_the_key(tmp_path):
+    calls = []
+    EmbeddingStore(str(tmp_path), "model-a").get_or_compute(["text"], _encoder(calls))
+    EmbeddingStore(str(tmp_path), "model-b").get_or_compute(["text"], _encoder(calls))
+    assert len(calls) == 2
+
+
+def test_workers_see_each_others_appends(tmp_path):
+    calls = []
+    worker_a = EmbeddingStore(str(tmp_path), "test-model")
+    worker_b = EmbeddingStore(str(tmp_path), "test-model")
+    worker_a.get_or_compute(["one"], _encoder(calls))
+    worker_b.get_or_compute(["two"], _encoder(calls))
+    worker_a.get_or_compute(["one", "two"], _encoder(calls))
+    assert calls == [["one"], ["two"]]
+    assert len(worker_a) == 2
+
+
+def test_misses_are_encoded_and_stored_chunk_by_chunk(tmp_path):
+    def encode(texts):
+        calls.append(list(texts))
+        return np.array([[int(text[1:]), 1.0] for text in texts], dtype=np.float32)
+
+    calls = []
+    store = EmbeddingStore(str(tmp_path), "test-model")
+    store.get_or_compute(["t1", "t4"], encode)
+    texts = [f"t{n}" for n in range(7)]
+    vectors = store.get_or_compute(texts, encode, chunk_size=2)
+
+    # Only the five misses are encoded, two at a time, and every row is in input order
+    assert calls[1:] == [["t0", "t2"], ["t3", "t5"], ["t6"]]
+    assert vectors.shape == (7, 2) and vectors.dtype == np.float32
+    np.testing.assert_array_equal(vectors[:, 0], np.arange(7))
+    # Each chunk was stored as it was computed
+    assert EmbeddingStore(str(tmp_path), "test-model").lookup(texts)[1] == []
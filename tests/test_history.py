@@ -0,0 +1,39 @@
+from src.history import HistoryCompactor
+
+
+def _history(*queries):
+    return [(query, "answer") for query in queries]
+
+
+def test_follow_up_questions_carry_topics_from_recent_turns():
+    compactor = HistoryCompactor(topic_terms=["roth ira", "ira", "401k", "fees"])
+    compacted = compactor.compact("What are its benefits?", _history("How do I open an account?", "What is a Roth IRA?"))
+    # 'ira' is contained in 'roth ira' and the acronym IRA, so only the longer topic is kept
+    assert compacted.topics == ["roth ira"]
+    assert compacted.text == "What are its benefits? roth ira"
+    assert compacted.query == "What are its benefits?"
+    assert compactor.topics("Compare an HSA with a 401k") == ["401k", "hsa"]
+
+
+def test_queries_with_their_own_topic_or_without_history_are_left_alone():
+    compactor = HistoryCompactor(topic_terms=["roth ira", "fees"])
+    history = _history("What is a Roth IRA?")
+    for query, turns in (("What are the fees?", history), ("What are its benefits?", None),
+                         ("What are its benefits?", [])):
+        compacted = compactor.compact(query, turns)
+        assert (compacted.text, compacted.topics) == (query, [])
+    compacted = HistoryCompactor(max_turns=0, topic_terms=["roth ira"]).compact("And its limits?", history)
+    assert compacted.text == "And its limits?"
+
+
+def test_only_the_last_turns_count_and_the_most_recent_win_the_budget():
+    history = _history("What is a Roth IRA?", "Tell me about the ETF", "What about the HSA?")
+    compacted = HistoryCompactor(max_turns=2, topic_terms=["roth ira"]).compact("Fees?", history)
+    assert compacted.topics == ["hsa", "etf"]
+
+    # "Fees?" plus " hsa" fits in 10 characters, " etf" does not
+    compacted = HistoryCompactor(max_turns=3, max_chars=10, topic_terms=["roth ira"]).compact("Fees?", history)
+    assert compacted.topics == ["hsa"] and len(compacted.text) <= 10
+    # A query that is already too long is kept whole, without topics
+    compacted = HistoryCompactor(max_chars=10, topic_terms=[]).compact("What are its benefits?", history)
+    assert compacted.text == "What are its benefits?"
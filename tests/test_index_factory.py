@@ -0,0 +1,47 @@
+import faiss
+import numpy as np
+import pytest
+
+from src.index_factory import build_index, index_settings, is_approximate
+
+
+def _corpus(n=2000, dimension=32, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.random((n, dimension), dtype=np.float32)
+    ids = np.arange(1000, 1000 + n, dtype=np.int64)
+    return vectors, ids
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "ivf_pq", "hnsw"])
+def test_each_type_finds_the_query_vector(index_type):
+    vectors, ids = _corpus()
+    index = build_index(vectors, ids, {"type": index_type, "nlist": 16, "nprobe": 16, "pq_m": 8})
+    distances, found = index.search(vectors[:5], 3)
+
+    assert list(found[:, 0]) == list(ids[:5])
+    if index_type != "ivf_pq":
+        # Exact L2 distances, same scale as IndexFlatL2
+        np.testing.assert_allclose(distances[:, 0], 0.0, atol=1e-5)
+
+
+def test_search_parameters_are_applied():
+    vectors, ids = _corpus()
+    ivf = build_index(vectors, ids, {"type": "ivf_flat", "nlist": 16, "nprobe": 5})
+    assert faiss.extract_index_ivf(ivf).nprobe == 5
+
+    hnsw = build_index(vectors, ids, {"type": "hnsw", "ef_search": 99})
+    assert faiss.downcast_index(hnsw.index).hnsw.efSearch == 99
+
+
+def test_small_corpus_falls_back_from_pq():
+    vectors, ids = _corpus(n=50)
+    index = build_index(vectors, ids, {"type": "ivf_pq", "pq_m": 8})
+    assert not is_approximate(index)
+    assert index.ntotal == 50
+
+
+def test_settings_validation():
+    assert index_settings({"type": "ivf_pq"})["rerank"] is True
+    assert index_settings(None)["rerank"] is False
+    with pytest.raises(ValueError):
+        index_settings({"type": "annoy"})
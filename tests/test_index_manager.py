@@ -0,0 +1,103 @@
+import os
+import threading
+
+import faiss
+import numpy as np
+
+from src.index_manager import IndexManager
+
+
+def _flat_index(n, dimension=8, seed=0):
+    rng = np.random.default_rng(seed)
+    index = faiss.IndexFlatL2(dimension)
+    index.add(rng.random((n, dimension), dtype=np.float32))
+    return index
+
+
+def _counting_loader(counter):
+    def loader(path):
+        counter.append(path)
+        return faiss.read_index(path)
+    return loader
+
+
+def test_index_is_read_from_disk_once(tmp_path):
+    path = str(tmp_path / "faiss_index")
+    faiss.write_index(_flat_index(5), path)
+    reads = []
+    manager = IndexManager(path, loader=_counting_loader(reads))
+
+    first = manager.get()
+    for _ in range(10):
+        assert manager.get() is first
+    assert first.ntotal == 5
+    assert len(reads) == 1
+
+
+def test_reload_when_file_changes(tmp_path):
+    path = str(tmp_path / "faiss_index")
+    faiss.write_index(_flat_index(5), path)
+    reads = []
+    manager = IndexManager(path, loader=_counting_loader(reads))
+    assert manager.get().ntotal == 5
+
+    # Another process publishes a bigger index
+    faiss.write_index(_flat_index(7), path)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    assert manager.get().ntotal == 7
+    assert len(reads) == 2
+
+
+def test_touch_without_content_change_does_not_reload(tmp_path):
+    path = str(tmp_path / "faiss_index")
+    faiss.write_index(_flat_index(5), path)
+    reads = []
+    manager = IndexManager(path, loader=_counting_loader(reads))
+    first = manager.get()
+
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    assert manager.get() is first
+    assert len(reads) == 1
+
+
+def test_publish_swaps_in_memory_index_without_reading(tmp_path):
+    path = str(tmp_path / "sub" / "faiss_index")
+    reads = []
+    manager = IndexManager(path, loader=_counting_loader(reads))
+    assert manager.get() is None
+
+    index = _flat_index(3)
+    manager.publish(index)
+    assert manager.get() is index
+    assert reads == []
+    assert faiss.read_index(path).ntotal == 3
+    assert not [name for name in os.listdir(tmp_path / "sub") if ".tmp." in name]
+
+
+def test_concurrent_readers_never_see_partial_index(tmp_path):
+    path = str(tmp_path / "faiss_index")
+    manager = IndexManager(path)
+    manager.publish(_flat_index(4))
+    seen = set()
+    errors = []
+
+    def reader():
+        for _ in range(200):
+            index = manager.get()
+            if index is None:
+                errors.append("missing index")
+            else:
+                seen.add(index.ntotal)
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for n in range(5, 15):
+        manager.publish(_flat_index(n))
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert seen <= set(range(4, 15))
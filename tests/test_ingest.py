@@ -0,0 +1,30 @@
+import json
+
+from src.document_store import DocumentStore
+from src.ingest import ingest
+
+
+def test_duplicate_ids_are_reported_and_skipped(tmp_path, capsys):
+    source = tmp_path / "export.jsonl"
+    records = [
+        {"question": "What are your fees?", "answer": "None."},
+        {"id": 0, "question": "How do I open an account?", "answer": "Online."},
+        {"question": "How do I reset my password?", "answer": "Use the link."},
+        {"id": 7, "title": "Wires", "content": "Wires settle the same day."},
+        {"id": 7, "title": "Cards", "content": "Cards arrive in a week."},
+    ]
+    source.write_text("".join(json.dumps(record) + "\n" for record in records))
+    output = tmp_path / "knowledge_base.jsonl"
+
+    counts = ingest([str(source)], str(output), embed=False)
+    assert counts["items"] == 3
+    assert counts["skipped"] == counts["duplicates"] == 2
+    out = capsys.readouterr().out
+    assert "record 2: id 0 is already used" in out and "record 5: id 7 is already used" in out
+
+    # The first record with an id wins, none is replaced silently
+    store = DocumentStore(str(output))
+    texts = {item["id"]: item["text"] for item in store}
+    store.close()
+    assert texts == {0: "Q: What are your fees?\nA: None.", 1: "Q: How do I reset my password?\nA: Use the link.",
+                     7: "Wires\nWires settle the same day."}
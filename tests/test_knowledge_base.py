@@ -0,0 +1,361 @@
+import hashlib
+import json
+import os
+import threading
+
+import faiss
+import numpy as np
+import pytest
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from src import knowledge_base
+from src.embedding_backends import EmbeddingBackend
+from src.document_store import Documents
+from src.embedding_store import EmbeddingStore
+from src.index_manager import IndexManager
+from src.lexical_index import LexicalIndex
+
+ITEMS = [
+    {"id": 0, "text": "Q: What are your fees?\nA: Trading commission is $0 for stocks.", "source": "FAQ"},
+    {"id": 1, "text": "Q: How do I open an account?\nA: Sign up online in ten minutes.", "source": "FAQ"},
+    {"id": 2, "text": "Q: How do I reset my password?\nA: Use the forgot password link.", "source": "FAQ"},
+]
+
+
+class StubBackend(EmbeddingBackend):
+    """Bag of hashed words, unit length: texts sharing words are close"""
+
+    name = "stub"
+
+    @property
+    def dimension(self):
+        return 32
+
+    def encode(self, texts, batch_size=32):
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                word = word.strip("?.,!:$")
+                vectors[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dimension] += 1.0
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+@pytest.fixture
+def kb(tmp_path, monkeypatch):
+    """The knowledge base module serving ITEMS from tmp_path with the stub model"""
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "knowledge_base.json").write_text(json.dumps(ITEMS))
+    for name, filename in (("knowledge_base_path", "knowledge_base.json"), ("document_store_path", "knowledge_base.jsonl"),
+                           ("changes_path", "knowledge_base.changes.jsonl"), ("index_path", "faiss_index")):
+        monkeypatch.setattr(knowledge_base, name, str(data / filename))
+    monkeypatch.setattr(knowledge_base, "embedding_model", StubBackend("stub"))
+    monkeypatch.setattr(knowledge_base, "embedding_store", EmbeddingStore(str(tmp_path / "embeddings"), "stub"))
+    monkeypatch.setattr(knowledge_base, "index_manager", IndexManager(str(data / "faiss_index"), loader=knowledge_base._read_index))
+    monkeypatch.setattr(knowledge_base, "index_config", dict(knowledge_base.index_config, type="flat", rerank=False))
+    monkeypatch.setattr(knowledge_base, "serving_mode", "read-write")
+    monkeypatch.setattr(knowledge_base, "_changes_offset", 0)
+    # Switching snapshots replaces these, put the originals back afterwards
+    for name in ("documents", "document_chunks", "lexical_index"):
+        monkeypatch.setattr(knowledge_base, name, getattr(knowledge_base, name))
+    knowledge_base.query_embedding_cache.clear()
+    knowledge_base._ready.clear()
+    yield knowledge_base
+    # Later tests load the real knowledge base again on first use
+    knowledge_base._reset_documents()
+    knowledge_base.query_embedding_cache.clear()
+    knowledge_base._ready.clear()
+
+
+def _ids(results):
+    return [item["id"] for item in results]
+
+
+def _restart(kb):
+    """Forget everything in memory, as a new worker process would start"""
+    kb.index_manager.clear()
+    kb._changes_offset = 0
+    kb._reset_documents()
+    kb._ready.clear()
+    kb.query_embedding_cache.clear()
+
+
+def test_embed_texts_encodes_in_batches_into_one_array(kb, monkeypatch, caplog):
+    backend = StubBackend("stub")
+    batches = []
+    encode = backend.encode
+    monkeypatch.setattr(backend, "encode", lambda texts, batch_size=32: batches.append((list(texts), batch_size))
+                        or encode(texts))
+    monkeypatch.setattr(kb, "embedding_model", backend)
+    monkeypatch.setattr(kb, "embedding_batch_size", 3)
+    texts = [f"question number {n}" for n in range(8)]
+
+    with caplog.at_level("INFO", logger="src.knowledge_base"):
+        embeddings = kb.embed_texts(texts)
+    assert [len(batch) for batch, _ in batches] == [3, 3, 2]
+    assert {batch_size for _, batch_size in batches} == {3}
+    assert [text for batch, _ in batches for text in batch] == texts
+    assert embeddings.shape == (8, backend.dimension) and embeddings.dtype == np.float32
+    np.testing.assert_allclose(embeddings, encode(texts))
+    assert "Encoded 8 items" in caplog.text and "batch size 3" in caplog.text
+
+    assert kb.embed_texts(texts, batch_size=8).shape == (8, backend.dimension)
+    assert len(batches) == 4
+    assert kb.embed_texts([]).shape == (0, backend.dimension)
+
+
+def test_query_embeddings_are_cached_case_insensitively_only_for_uncased_models(kb, monkeypatch):
+    kb.embed_query("What is a Roth IRA?")
+    kb.embed_query("what is a roth  ira?")
+    assert len(kb.query_embedding_cache) == 2  # The stub model is cased
+
+    monkeypatch.setattr(StubBackend, "lowercases", True)
+    kb.query_embedding_cache.clear()
+    kb.embed_queries(["What is a Roth IRA?", "what is a roth  ira?"])
+    assert len(kb.query_embedding_cache) == 1
+
+
+def test_upsert_update_and_delete_are_visible_in_search(kb):
+    kb.initialize()
+    doc_id = kb.upsert_document({"text": "Q: Do you offer mortgage refinancing?\nA: Yes, fixed rate.", "source": "FAQ"})
+    assert doc_id == 3
+    assert _ids(kb.search("Do you offer mortgage refinancing?", k=1)) == [3]
+
+    kb.upsert_document({"id": doc_id, "text": "Q: Do you offer student loans?\nA: Yes, for graduates.", "source": "FAQ"})
+    assert kb.search("Do you offer student loans?", k=1)[0]["text"].endswith("for graduates.")
+    assert kb.lexical_search("refinancing") == []
+
+    assert kb.delete_document(doc_id)
+    assert not kb.delete_document(doc_id)
+    assert kb.get_document(doc_id) is None
+    assert doc_id not in _ids(kb.search("Do you offer student loans?", k=4))
+    assert kb.index_manager.get().ntotal == len(ITEMS)
+
+
+def test_changes_are_replayed_after_a_restart(kb):
+    kb.initialize()
+    doc_id = kb.upsert_document({"text": "Q: Do you offer mortgage refinancing?\nA: Yes, fixed rate."})
+    kb.upsert_document({"id": 0, "text": "Q: What are your fees?\nA: There are no account fees."})
+    kb.delete_document(2)
+
+    _restart(kb)
+    kb.initialize()
+    assert sorted(item["id"] for item in kb.load_knowledge_base()) == [0, 1, doc_id]
+    assert kb.get_document(0)["text"].endswith("no account fees.")
+    assert _ids(kb.search("Do you offer mortgage refinancing?", k=1)) == [doc_id]
+    assert kb.get_document(2) is None
+
+
+def test_lexical_index_is_rebuilt_with_the_changes_after_a_restart(kb):
+    kb.initialize()
+    doc_id = kb.upsert_document({"text": "Q: Do you offer mortgage refinancing?\nA: Yes, fixed rate."})
+    kb.upsert_document({"id": 1, "text": "Q: How do I open a joint account?\nA: Both owners sign up online."})
+    kb.delete_document(2)
+
+    _restart(kb)
+    assert len(kb.lexical_index) == 0  # Rebuilt from the documents and the change log on first use
+    assert [doc for _, doc in kb.lexical_search("mortgage refinancing")] == [doc_id]
+    assert [doc for _, doc in kb.lexical_search("joint owners")] == [1]
+    assert kb.lexical_search("password") == []
+
+
+def test_concurrent_replays_apply_each_change_once(kb):
+    kb.initialize()
+    # Another worker appended to the log; several searching threads notice it at once
+    with open(kb.changes_path, "a") as f:
+        for doc_id in range(100, 300):
+            f.write(json.dumps({"op": "upsert", "id": doc_id, "item": {"text": f"Q: Topic {doc_id}?\nA: Yes."}}) + "\n")
+    generation = kb._generation
+    threads = [threading.Thread(target=kb._replay_changes) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert kb._changes_offset == os.path.getsize(kb.changes_path)
+    assert kb._generation == generation + 200
+    assert len(kb.documents) == len(ITEMS) + 200
+
+
+@pytest.mark.skipif(fcntl is None, reason="no cross-process locking")
+def test_updates_and_compaction_hold_the_worker_lock_until_the_index_is_published(kb, monkeypatch):
+    kb.initialize()
+    held = []
+
+    def other_worker_blocked():
+        with open(f"{kb.changes_path}.lock", "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(f, fcntl.LOCK_UN)
+            return False
+
+    publish = kb.index_manager.publish
+    monkeypatch.setattr(kb.index_manager, "publish", lambda index: held.append(other_worker_blocked()) or publish(index))
+    replay = kb._replay_changes
+    monkeypatch.setattr(kb, "_replay_changes", lambda: held.append(other_worker_blocked()) or replay())
+    kb.upsert_document({"text": "Q: Do you offer mortgage refinancing?\nA: Yes, fixed rate."})
+    kb.delete_document(0)
+    kb.compact_knowledge_base()
+    assert held and all(held)
+    assert not other_worker_blocked()
+
+
+def test_multi_chunk_documents_are_returned_once_with_their_best_chunk(kb, monkeypatch):
+    from src.chunking import chunk_item, chunk_settings
+
+    monkeypatch.setattr(kb, "chunking_config", chunk_settings({"max_tokens": 16, "overlap": 0}))  # FAQ items stay whole
+    monkeypatch.setattr(kb, "chunk_overfetch", 3)
+    article = {"id": 3, "source": "Help Article", "text": "Wire transfers\n" + " ".join(
+        f"wire transfer section {n} covers cutoff times fees and limits {word} for every account"
+        for n, word in enumerate(["domestic", "international", "recurring", "business", "urgent", "returned"]))}
+    kb.upsert_document(article)
+    chunks = chunk_item(article, kb.chunking_config)
+    assert len(chunks) > 3 and kb.document_chunks[3] == len(chunks)
+    assert kb.index_manager.get().ntotal == len(ITEMS) + len(chunks)
+
+    query = "wire transfer limits international"
+    results = kb.search(query, k=3)
+    # The article's chunks fill the top of the raw ranking; over-fetching still yields 3 documents
+    assert len(results) == 3 and len(set(_ids(results))) == 3
+    assert results[0]["id"] == 3
+    distances = ((StubBackend("stub").encode([embedded for embedded, _ in chunks]) - kb.embed_query(query)) ** 2).sum(axis=1)
+    best = int(distances.argmin())
+    assert results[0]["chunk"] == best and results[0]["text"] == chunks[best][1]
+    assert results[0]["score"] == pytest.approx(float(distances[best]), rel=1e-5)
+
+
+def test_compaction_folds_the_log_into_the_base_documents(kb):
+    kb.initialize()
+    doc_id = kb.upsert_document({"text": "Q: Do you offer mortgage refinancing?\nA: Yes, fixed rate."})
+    kb.delete_document(1)
+    assert os.path.exists(kb.changes_path)
+
+    kb.compact_knowledge_base()
+    assert not os.path.exists(kb.changes_path)
+    with open(kb.knowledge_base_path) as f:
+        assert [item["id"] for item in json.load(f)] == [0, 2, doc_id]
+
+    _restart(kb)
+    kb.initialize()
+    assert sorted(item["id"] for item in kb.load_knowledge_base()) == [0, 2, doc_id]
+    # Later changes start a new log on top of the compacted file
+    kb.delete_document(0)
+    _restart(kb)
+    assert sorted(item["id"] for item in kb.load_knowledge_base()) == [2, doc_id]
+
+
+def test_hnsw_deletes_rebuild_the_index(kb, monkeypatch):
+    monkeypatch.setattr(kb, "index_config", dict(kb.index_config, type="hnsw"))
+    kb.initialize()
+    rebuilds = []
+    create_index = kb.create_index
+    monkeypatch.setattr(kb, "create_index", lambda *args, **kwargs: rebuilds.append(1) or create_index(*args, **kwargs))
+
+    kb.delete_document(1)
+    assert rebuilds == [1]  # HNSW cannot remove vectors
+    index = kb.index_manager.get()
+    assert isinstance(faiss.downcast_index(index.index), faiss.IndexHNSW)
+    assert index.ntotal == len(ITEMS) - 1
+    assert 1 not in _ids(kb.search("How do I open an account?", k=3))
+
+
+def test_rerank_keeps_approximate_distances_for_vectors_missing_from_the_cache(kb, tmp_path, monkeypatch):
+    kb.initialize()
+    query = kb.embed_query("How do I open an account?")
+    texts = [kb._chunk_lookup(doc_id * kb.CHUNK_ID_STRIDE)[2][0] for doc_id in (0, 1, 2)]
+    exact = ((kb.embedding_store.lookup(texts)[0] - query) ** 2).sum(axis=1)
+
+    # Only document 1 is cached; 0 and 2 keep the distances the index returned
+    partial = EmbeddingStore(str(tmp_path / "partial"), "stub")
+    partial.add([texts[1]], kb.embedding_store.lookup([texts[1]])[0])
+    monkeypatch.setattr(kb, "embedding_store", partial)
+    approximate = np.array([0.5, 9.0, 3.0], dtype=np.float32)
+    indices = np.array([0, kb.CHUNK_ID_STRIDE, 2 * kb.CHUNK_ID_STRIDE, -1], dtype=np.int64)
+    distances, order = kb._rerank_exact(query, np.append(approximate, np.inf), indices)
+    assert order.tolist() == [kb.CHUNK_ID_STRIDE, 0, 2 * kb.CHUNK_ID_STRIDE]
+    np.testing.assert_allclose(distances, [exact[1], 0.5, 3.0], rtol=1e-5)
+
+    # With nothing cached (no vectors at all) the approximate order is kept
+    monkeypatch.setattr(kb, "embedding_store", EmbeddingStore(str(tmp_path / "empty"), "stub"))
+    distances, order = kb._rerank_exact(query, approximate, indices[:3])
+    assert order.tolist() == [0, 2 * kb.CHUNK_ID_STRIDE, kb.CHUNK_ID_STRIDE]
+    np.testing.assert_allclose(distances, [0.5, 3.0, 9.0])
+
+
+def test_snapshot_serving_with_ivf_pq_and_no_local_embedding_cache(kb, tmp_path, monkeypatch):
+    from src.snapshots import SnapshotStore
+
+    words = ["bond", "stock", "fund", "cash", "loan", "card", "tax", "wire"]
+    items = ITEMS + [{"id": 10 + i, "text": f"Q: Topic {i} {words[i % 8]} {words[i // 8 % 8]}?\nA: Answer {i}."}
+                     for i in range(40)]
+    (tmp_path / "data" / "knowledge_base.json").write_text(json.dumps(items))
+    monkeypatch.setattr(kb, "snapshot_store", SnapshotStore(str(tmp_path / "snapshots")))
+    monkeypatch.setattr(kb, "index_config", dict(kb.index_config, type="ivf_pq", pq_m=4, pq_bits=4, nprobe=4,
+                                                 rerank=True))
+    for name in ("_snapshot_version", "_snapshot_stat", "_snapshot"):
+        monkeypatch.setattr(kb, name, None)
+    builder_store = kb.embedding_store
+    first = kb.publish_snapshot()
+
+    # A serving node: nothing cached locally, everything read from the snapshot
+    monkeypatch.setattr(kb, "serving_mode", "snapshot")
+    monkeypatch.setattr(kb, "embedding_store", EmbeddingStore(str(tmp_path / "node-embeddings"), "stub"))
+    kb._ready.clear()
+    results = kb.search("How do I reset my password?", k=3)
+    assert results[0]["id"] == 2
+    assert kb.documents.store.memory_map and kb._snapshot_version == first
+    # Exact distances from the vectors shipped with the snapshot, not PQ estimates
+    embedded_text = kb._chunk_lookup(2 * kb.CHUNK_ID_STRIDE)[2][0]
+    expected = ((kb.embed_query("How do I reset my password?") - StubBackend("stub").encode([embedded_text])[0]) ** 2).sum()
+    assert results[0]["score"] == pytest.approx(expected, rel=1e-5)
+    with pytest.raises(RuntimeError):
+        kb.upsert_document({"text": "read-only"})
+
+    # A newly published snapshot is picked up on the next search
+    items.append({"id": 99, "text": "Q: Do you offer mortgage refinancing?\nA: Yes, fixed and variable."})
+    (tmp_path / "data" / "knowledge_base.json").write_text(json.dumps(items))
+    with monkeypatch.context() as builder:  # As `python -m src.snapshots publish` would
+        builder.setattr(kb, "serving_mode", "read-write")
+        builder.setattr(kb, "embedding_store", builder_store)
+        second = kb.publish_snapshot()
+    results = kb.search("Do you offer mortgage refinancing?", k=1)
+    assert kb._snapshot_version == second != first
+    assert _ids(results) == [99]
+
+
+def test_switching_snapshots_leaves_the_one_being_served_untouched(kb, tmp_path, monkeypatch):
+    from src.snapshots import SnapshotStore
+
+    monkeypatch.setattr(kb, "snapshot_store", SnapshotStore(str(tmp_path / "snapshots")))
+    for name in ("_snapshot_version", "_snapshot_stat", "_snapshot"):
+        monkeypatch.setattr(kb, name, None)
+    kb.publish_snapshot()
+    monkeypatch.setattr(kb, "serving_mode", "snapshot")
+    kb._ready.clear()
+    assert _ids(kb.search("How do I reset my password?", k=1)) == [2]
+    old = kb._snapshot
+    old_lexical = kb.lexical_index
+
+    # Document 2 is replaced by another text under a new id
+    items = ITEMS[:2] + [{"id": 7, "text": "Q: Do you offer mortgage refinancing?\nA: Yes, fixed rate."}]
+    (tmp_path / "data" / "knowledge_base.json").write_text(json.dumps(items))
+    with monkeypatch.context() as builder:  # A separate build process with its own documents
+        builder.setattr(kb, "serving_mode", "read-write")
+        builder.setattr(kb, "documents", Documents())
+        builder.setattr(kb, "document_chunks", {})
+        builder.setattr(kb, "lexical_index", LexicalIndex())
+        kb.publish_snapshot()
+    assert _ids(kb.search("Do you offer mortgage refinancing?", k=1)) == [7]
+
+    # A search that started on the old snapshot still resolves its ids there
+    assert kb._snapshot is not old and kb.lexical_index is not old_lexical
+    assert old.documents.get(2)["text"].endswith("forgot password link.") and old.documents.get(7) is None
+    distances, indices = old.index.search(kb.embed_queries(["How do I reset my password?"]), 1)
+    assert _ids(kb._results(distances[0], indices[0], 1, old)) == [2]
+    assert [doc_id for _, doc_id in old_lexical.search("password")] == [2]
+    assert kb.get_document(2) is None and kb.lexical_search("password") == []
@@ -0,0 +1,68 @@
+import pytest
+
+from src.lexical_index import PHRASE_BOOST, QUESTION_BOOST, LexicalIndex, tokenize
+
+
+def _ids(results):
+    return [doc_id for _, doc_id in results]
+
+
+def test_bm25_prefers_rare_terms_and_short_documents():
+    index = LexicalIndex()
+    index.add(0, "wire transfer wire transfer limits")
+    index.add(1, "wire transfer limits for business accounts with many other words in the text")
+    index.add(2, "card limits")
+    index.add(3, "card replacement")
+
+    # "wire" is in two documents, "limits" in three: the shorter wire document wins
+    assert _ids(index.search("wire limits", top_k=3)) == [0, 1, 2]
+    # Terms of two characters or less are ignored
+    assert index.search("of to a") == []
+    assert index.search("mortgage escrow") == []
+
+
+def test_question_and_phrase_boosts():
+    index = LexicalIndex()
+    index.add(0, "Q: How do I close my account?\nA: Contact support.")
+    index.add(1, "Account settings: close the account menu or how to open it again")
+    scores = dict((doc_id, score) for score, doc_id in index.search("close account", top_k=2))
+    plain = LexicalIndex()
+    plain.add(0, "K: How do I close my account?\nB: Contact support.")  # Same length, no FAQ question
+    plain.add(1, "Account settings: close the account menu or how to open it again")
+    plain_scores = dict((doc_id, score) for score, doc_id in plain.search("close account", top_k=2))
+    # Both keywords are in document 0's FAQ question; neither has the phrase "close account"
+    assert scores[0] == pytest.approx(plain_scores[0] + 2 * QUESTION_BOOST)
+    assert scores[1] == pytest.approx(plain_scores[1])
+
+    index.add(2, "You can close account access at any time")
+    assert dict((doc_id, score) for score, doc_id in index.search("close account", top_k=3))[2] >= PHRASE_BOOST
+
+
+def test_add_replaces_and_remove_forgets_documents():
+    index = LexicalIndex()
+    index.add(0, "mortgage refinancing rates")
+    index.add(1, "student loans")
+    assert _ids(index.search("mortgage")) == [0]
+
+    index.add(0, "savings accounts")
+    assert index.search("mortgage") == []
+    assert _ids(index.search("savings")) == [0]
+    assert len(index) == 2
+
+    index.remove(0)
+    index.remove(0)  # Removing twice is a no-op
+    assert index.search("savings") == []
+    assert len(index) == 1 and index._total_len == len(tokenize("student loans"))
+    assert "savings" not in index._postings
+
+    index.clear()
+    assert len(index) == 0 and index.search("student") == []
+
+
+def test_phrase_check_reads_texts_through_the_loader():
+    texts = {0: "open an account online", 1: "account to open"}
+    index = LexicalIndex(text_loader=texts.__getitem__)
+    for doc_id, text in texts.items():
+        index.add(doc_id, text)
+    assert index._texts == {}
+    assert _ids(index.search("open an account", top_k=1)) == [0]
@@ -1,3 +1,5 @@
+import json
+import time
 import pytest
 from fastapi.testclient import TestClient
 from src.main import app, conversation_histories  # Import app and conversation_histories
@@ -95,3 +97,96 @@ def test_read_root():
     response = client.get("/")
     assert response.status_code == 200
     assert response.json() == {"message": "Financial AI Agent API. Use /ask endpoint to ask questions."}
+
+def test_health_and_readiness():
+    assert client.get("/healthz").json() == {"status": "ok"}
+
+    # The first request loads the model and index if warm-up has not already
+    client.post("/ask", json={"query": "What are your fees?", "channel": "test"})
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ready"}
+
+def test_repeated_questions_are_answered_from_the_response_cache():
+    from src.main import response_cache
+
+    first = client.post("/ask", json={"query": "How do I open an account?", "channel": "test"}).json()
+    hits = response_cache.stats()["hits"]
+    second = client.post("/ask", json={"query": "How do I open an account?", "channel": "test"}).json()
+
+    assert second["response"] == first["response"]
+    assert response_cache.stats()["hits"] == hits + 1
+    assert client.get("/stats").json()["response_cache"]["hits"] == hits + 1
+
+def test_metrics_endpoint():
+    client.post("/ask", json={"query": "What are your fees?", "channel": "test"})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert '# TYPE fin_ai_stage_seconds histogram' in body
+    assert 'fin_ai_stage_seconds_count{stage="answer"}' in body
+    assert 'fin_ai_http_request_seconds_count{method="POST",route="/ask",status="200"}' in body
+    assert 'fin_ai_cache_lookups_total{cache="response",result="hit"}' in body
+
+def test_batch_endpoint_answers_json_and_ndjson_in_order():
+    from src.main import answer_query, response_cache, semantic_cache
+
+    sessions = len(conversation_histories)
+    queries = ["What is a Roth IRA?", "How do I open an account?", "What is a Roth IRA?"]
+    response = client.post("/ask/batch", json=queries + [{"id": 7, "query": "What are your fees?"}, 42])
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert [line["index"] for line in lines] == [0, 1, 2, 3, 4]
+    response_cache.clear()  # Compare with answers computed one at a time
+    semantic_cache.clear()
+    assert [line["response"] for line in lines[:3]] == [answer_query(query) for query in queries]
+    assert lines[3]["id"] == 7 and "delivery_id" not in lines[3]
+    assert "error" in lines[4]
+    assert len(conversation_histories) == sessions  # No sessions for batch questions
+
+    body = '{"query": "What are your fees?", "recipient": "a@example.com"}\n\n"What is a 401k?"\n'
+    response = client.post("/ask/batch?channel=email", content=body,
+                           headers={"Content-Type": "application/x-ndjson"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    response_cache.clear()
+    semantic_cache.clear()
+    assert [line["response"] for line in lines] == [answer_query("What are your fees?"), answer_query("What is a 401k?")]
+    assert all(line["delivery_id"] for line in lines)
+
+    assert client.post("/ask/batch", json={"query": "not a list"}).status_code == 400
+
+def test_rephrased_questions_are_answered_from_the_semantic_cache(monkeypatch):
+    import src.main
+    from src.fin_engine import generate_response
+    from src.main import semantic_cache
+
+    semantic_cache.clear()
+    retrieved = []
+    retrieve = src.main.retrieve_relevant_data
+    monkeypatch.setattr(src.main, "retrieve_relevant_data", lambda query: retrieved.append(query) or retrieve(query))
+    client.post("/ask", json={"query": "Tell me about Roth IRA accounts?", "channel": "test"})
+    hits = semantic_cache.stats()["hits"]
+    second = client.post("/ask", json={"query": "tell me about roth ira accounts", "channel": "test"}).json()
+
+    # The cached retrieval results are formatted again for the new phrasing
+    assert retrieved == ["Tell me about Roth IRA accounts?"]
+    expected = generate_response("tell me about roth ira accounts", retrieve("Tell me about Roth IRA accounts?"))
+    assert second["response"] == expected and "tell me about roth ira accounts" in expected
+    assert semantic_cache.stats()["hits"] == hits + 1
+    assert client.get("/stats").json()["semantic_cache"]["hits"] == hits + 1
+
+def test_chat_responses_are_not_queued_for_delivery():
+    data = client.post("/ask", json={"query": "What are your fees?", "channel": "chat"}).json()
+    assert data["delivery_id"] is None
+
+    # An unknown channel is reported as failed, not delivered
+    data = client.post("/ask", json={"query": "What are your fees?", "channel": "fax"}).json()
+    for _ in range(500):
+        status = client.get(f"/deliveries/{data['delivery_id']}").json()
+        if status["status"] == "failed":
+            break
+        time.sleep(0.01)
+    assert status["status"] == "failed" and status["attempts"] == 1
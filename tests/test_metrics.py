@@ -0,0 +1,30 @@
+import logging
+
+from src.logs import StructuredFormatter
+from src.metrics import Registry
+
+
+def test_prometheus_text_format():
+    registry = Registry()
+    latency = registry.histogram("stage_seconds", "Stage latency", ("stage",), buckets=(0.1, 1.0))
+    latency.labels("encode").observe(0.05)
+    latency.labels("encode").observe(0.5)
+    latency.labels("encode").observe(5)
+    registry.counter("requests_total", "Requests").inc(3)
+    registry.gauge("queue_depth", "Pending jobs", lambda: {("email",): 2}, ("channel",))
+
+    lines = registry.render().splitlines()
+    assert "# TYPE stage_seconds histogram" in lines
+    assert 'stage_seconds_bucket{stage="encode",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{stage="encode",le="1.0"} 2' in lines
+    assert 'stage_seconds_bucket{stage="encode",le="+Inf"} 3' in lines
+    assert 'stage_seconds_count{stage="encode"} 3' in lines
+    assert "requests_total 3" in lines
+    assert 'queue_depth{channel="email"} 2' in lines
+
+
+def test_structured_log_lines():
+    record = logging.LogRecord("src.test", logging.INFO, __file__, 1, "Sent %s", ("ok",), None)
+    record.fields = {"channel": "email"}
+    assert StructuredFormatter().format(record).endswith("INFO src.test: Sent ok channel='email'")
+    assert '"channel": "email"' in StructuredFormatter(json_lines=True).format(record)
@@ -0,0 +1,54 @@
+from src.relevance import FINANCIAL_TERMS, ParsedDocumentCache, RelevanceMatcher, TermMatcher
+
+
+def test_term_matcher_finds_overlapping_and_contained_terms():
+    matcher = TermMatcher(["fee", "fees", "roth ira", "ira", "Bond", ""])
+    assert matcher.terms == {"fee", "fees", "roth ira", "ira", "bond"}
+    assert matcher.find("What FEES apply to a Roth IRA?") == {"fee", "fees", "roth ira", "ira"}
+    assert matcher.find("bonds and spirals") == {"bond", "ira"}  # Substrings, like 'in'
+    assert matcher.find("nothing here") == frozenset()
+    assert TermMatcher([]).find("fees") == frozenset()
+
+    texts = ["Is there a fee for a 401k rollover?", "retirement investment costs", "stocks, bonds, funds", ""]
+    matcher = TermMatcher(FINANCIAL_TERMS)
+    for text in texts:
+        assert matcher.find(text) == {term for term in FINANCIAL_TERMS if term in text.lower()}
+
+
+def test_financial_terms_in_the_query_must_appear_in_the_answer():
+    matcher = RelevanceMatcher()
+    roth = matcher.parse("Q: What is a Roth IRA?\nA: A retirement account funded after tax.")
+    fees = matcher.parse("Q: What are your fees?\nA: Trading commission is $0.")
+    assert roth.is_faq and roth.question == "What is a Roth IRA?"
+    assert matcher.is_relevant("roth ira contribution limits", roth)
+    assert not matcher.is_relevant("roth ira contribution limits", fees)
+    # One shared financial term is enough, and word overlap does not count without one
+    assert matcher.is_relevant("what are the fees of a roth ira", fees)
+    assert not matcher.is_relevant("what is a roth ira fund", fees)
+
+
+def test_without_financial_terms_a_third_of_the_query_words_must_match():
+    matcher = RelevanceMatcher()
+    document = matcher.parse("Q: How do I open an account?\nA: Sign up online in ten minutes.")
+    # Six words, so two long words must match: 'open' and 'account'
+    assert matcher.is_relevant("how do i open an account", document)
+    assert not matcher.is_relevant("how do i close an account", document)
+    # Words of three characters or less never match, but count towards the threshold
+    assert not matcher.is_relevant("how do i", document)
+    assert matcher.is_relevant("account", document)
+    # Query words match inside longer words of the answer, as in the original check
+    plural = matcher.parse("Q: Which accounts can be opened online?\nA: Savings and checking accounts.")
+    assert matcher.is_relevant("open account", plural)
+
+
+def test_parsed_documents_are_reparsed_when_the_text_changed():
+    cache = ParsedDocumentCache(RelevanceMatcher(), max_size=2)
+    first = cache.put(1, "Q: Old question?\nA: Old answer.")
+    assert cache.get({"id": 1, "text": "Q: Old question?\nA: Old answer."}) is first
+    changed = cache.get({"id": 1, "text": "Q: New question?\nA: New answer."})
+    assert changed is not first and changed.question == "New question?"
+    assert cache.get({"id": 1, "text": "Q: Old question?\nA: Old answer."}) is first  # Not replaced
+
+    cache.get({"id": 2, "text": "two"})
+    cache.get({"id": 3, "text": "three"})  # Cached on first use, evicting the oldest
+    assert cache.get({"id": 1, "text": "Q: Old question?\nA: Old answer."}) is not first
@@ -0,0 +1,57 @@
+import pytest
+
+from src import retrieval
+
+DOCUMENTS = {doc_id: {"id": doc_id, "text": f"document {doc_id}", "source": "FAQ"} for doc_id in range(10)}
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(retrieval, "get_document", DOCUMENTS.get)
+    monkeypatch.setattr(retrieval, "vector_weight", 0.7)
+    monkeypatch.setattr(retrieval, "rrf_k", 60)
+    monkeypatch.setattr(retrieval, "lexical_midpoint", 10.0)
+
+
+def _vector(*pairs):
+    """Vector results for (doc_id, squared L2 distance) pairs, as search returns them"""
+    return [dict(DOCUMENTS[doc_id], score=distance) for doc_id, distance in pairs]
+
+
+def _ranking(fused):
+    return [(item["id"], round(item["relevance"], 6)) for item in fused]
+
+
+def test_weighted_fusion_mixes_cosine_and_squashed_bm25():
+    fused = retrieval.fuse_results(_vector((1, 0.4), (2, 1.0)), [(30.0, 2), (10.0, 3)], top_k=5, method="weighted")
+    # 1: 0.7 * 0.8; 2: 0.7 * 0.5 + 0.3 * 0.75; 3: 0.3 * 0.5
+    assert _ranking(fused) == [(2, 0.575), (1, 0.56), (3, 0.15)]
+    assert fused[0]["score"] == 1.0 and "score" not in fused[2]
+    assert DOCUMENTS[3].get("relevance") is None  # Lexical-only items are copies
+    assert len(retrieval.fuse_results(_vector((1, 0.4), (2, 1.0)), [(30.0, 2), (10.0, 3)], top_k=2)) == 2
+
+
+def test_rrf_fusion_uses_ranks_only():
+    fused = retrieval.fuse_results(_vector((1, 0.1), (2, 1.9)), [(50.0, 2), (1.0, 1)], top_k=3, method="rrf")
+    # Both documents are first in one list and second in the other
+    assert _ranking(fused) == [(1, round((1 / 61 + 1 / 62) / (2 / 61), 6)), (2, round((1 / 62 + 1 / 61) / (2 / 61), 6))]
+    fused = retrieval.fuse_results(_vector((4, 0.0)), [(5.0, 4)], method="rrf")
+    assert fused[0]["relevance"] == pytest.approx(1.0)
+
+
+def test_disjoint_results_keep_both_lists_and_ties_keep_vector_order_first():
+    vector = _vector((1, 0.0), (2, 0.0))
+    lexical = [(1e9, 5), (1e9, 6)]
+    # Equal relevance: the sort is stable, vector results before lexical results, each in rank order
+    fused = retrieval.fuse_results(vector, lexical, top_k=4, method="weighted")
+    assert [item["id"] for item in fused] == [1, 2, 5, 6]
+    assert [item["relevance"] for item in fused] == pytest.approx([0.7, 0.7, 0.3, 0.3])
+    fused = retrieval.fuse_results(vector, lexical, top_k=4, method="rrf")
+    assert [item["id"] for item in fused] == [1, 5, 2, 6]
+    assert [item["relevance"] for item in fused] == pytest.approx([0.5, 0.5, 61 / 124, 61 / 124])
+
+
+def test_lexical_results_for_deleted_documents_are_dropped():
+    fused = retrieval.fuse_results([], [(20.0, 99), (20.0, 3)], method="weighted")
+    assert [item["id"] for item in fused] == [3]
+    assert retrieval.fuse_results([], []) == []
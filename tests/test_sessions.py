@@ -0,0 +1,84 @@
+import pytest
+
+from src.sessions import InMemorySessionStore, SQLiteSessionStore, create_session_store
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return InMemorySessionStore(**kwargs)
+        return SQLiteSessionStore(str(tmp_path / "sessions.db"), **kwargs)
+    return make
+
+
+def test_turns_round_trip_like_a_dict(make_store):
+    store = make_store()
+    long_response = "Roth IRA contributions are made with after-tax dollars. " * 20
+    store.append_turn("s1", "What is a Roth IRA?", long_response)
+    store.append_turn("s1", "What are its benefits?", "Tax-free withdrawals")
+
+    assert "s1" in store
+    assert store["s1"] == [
+        ("What is a Roth IRA?", long_response),
+        ("What are its benefits?", "Tax-free withdrawals"),
+    ]
+    assert store.get("missing", []) == []
+
+    store["s2"] = []
+    assert len(store) == 2
+    del store["s2"]
+    assert "s2" not in store
+    store.clear()
+    assert len(store) == 0
+
+
+def test_turn_cap_keeps_latest_turns(make_store):
+    store = make_store(max_turns=2)
+    for n in range(5):
+        store.append_turn("s", f"q{n}", f"a{n}")
+    assert store["s"] == [("q3", "a3"), ("q4", "a4")]
+
+
+def test_idle_sessions_expire(make_store):
+    clock = FakeClock()
+    store = make_store(idle_ttl_seconds=60, clock=clock)
+    store.append_turn("old", "q", "a")
+    clock.now += 30
+    store.append_turn("active", "q", "a")
+    clock.now += 45
+
+    assert "old" not in store
+    assert store["active"] == [("q", "a")]
+
+
+def test_memory_budget_evicts_least_recently_used_sessions():
+    store = InMemorySessionStore(max_bytes=1000)
+    for n in range(10):
+        store.append_turn(f"s{n}", "q" * 100, "a" * 100)
+    stats = store.stats()
+    assert stats["bytes"] <= 1000
+    assert stats["evictions"] > 0
+    assert "s9" in store
+    assert "s0" not in store
+
+
+def test_sqlite_store_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    SQLiteSessionStore(path).append_turn("s", "q1", "a1")
+    other_worker = SQLiteSessionStore(path)
+    other_worker.append_turn("s", "q2", "a2")
+    assert SQLiteSessionStore(path)["s"] == [("q1", "a1"), ("q2", "a2")]
+
+
+def test_create_session_store_rejects_unknown_backend():
+    with pytest.raises(ValueError):
+        create_session_store({"backend": "redis"})
@@ -0,0 +1,32 @@
+import faiss
+import numpy as np
+
+from src.snapshots import SnapshotStore
+
+
+def _index(vectors):
+    index = faiss.IndexIDMap(faiss.IndexFlatL2(vectors.shape[1]))
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+    return index
+
+
+def test_publish_open_and_prune(tmp_path):
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    assert store.current() is None and store.current_stat() is None
+
+    vectors = np.random.default_rng(0).random((20, 8), dtype=np.float32)
+    items = [{"id": i, "text": f"doc {i}"} for i in range(20)]
+    first = store.publish(_index(vectors), items, {"embedding_model": "test"})
+    assert store.current() == first
+
+    index, documents, manifest = store.open(first)
+    assert documents.memory_map and documents.get(7) == {"id": 7, "text": "doc 7"}
+    assert manifest["documents"] == 20 and manifest["vectors"] == 20
+    assert manifest["embedding_model"] == "test"
+    assert index.search(vectors[3:4], 1)[1][0, 0] == 3
+
+    versions = [store.publish(_index(vectors), items, keep=2) for _ in range(3)]
+    assert store.current() == versions[-1]
+    assert store.versions() == versions[-2:]
+    # The old mapping stays readable after its snapshot is pruned
+    assert documents.get(19)["text"] == "doc 19"
@@ -0,0 +1,54 @@
+import json
+
+import numpy as np
+
+from src.topics import Topic, TopicCatalog
+
+VECTORS = {
+    "What is a Roth IRA?": [1.0, 0.0, 0.0],
+    "Roth IRA benefits": [0.9, 0.1, 0.0],
+    "What is an IRA?": [0.0, 1.0, 0.0],
+    "What is a 401k?": [0.0, 0.0, 1.0],
+}
+
+
+def _encode(texts):
+    vectors = np.array([VECTORS[text] for text in texts], dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _catalog(**kwargs):
+    return TopicCatalog([
+        Topic("ira", "IRA answer", ["ira"], ["What is an IRA?"]),
+        Topic("roth ira", "Roth answer", ["roth ira", "roth"], ["What is a Roth IRA?", "Roth IRA benefits"]),
+        Topic("401k", "401k answer", ["401k", "401(k)"], ["What is a 401k?"]),
+    ], encode=_encode, **kwargs)
+
+
+def test_keyword_lookup_prefers_the_longest_keyword_in_any_order():
+    catalog = _catalog()
+    assert catalog.find("Tell me about a ROTH IRA").name == "roth ira"
+    assert catalog.find("how do iras work").name == "ira"
+    assert catalog.find("my 401(k) match").name == "401k"
+    assert catalog.find("opening hours") is None
+
+
+def test_route_matches_all_queries_against_all_centroids_at_once():
+    catalog = _catalog(min_similarity=0.8, min_margin=0.05)
+    queries = _encode(["Roth IRA benefits", "What is a 401k?"])
+    between = np.array([[0.7, 0.7, 0.0]], dtype=np.float32) / np.sqrt(0.98)  # Roth and IRA alike
+    far = np.array([[0.6, 0.0, 0.6]], dtype=np.float32) / np.sqrt(0.72)  # 0.71 to Roth and 401k
+
+    routed = catalog.route(np.vstack([queries, between, far]))
+    assert [topic.name if topic else None for topic in routed] == ["roth ira", "401k", None, None]
+    assert catalog.centroids().shape == (3, 3)
+
+
+def test_load_reads_the_catalog_file(tmp_path):
+    path = tmp_path / "topics.json"
+    path.write_text(json.dumps({"topics": [{"name": "fees", "answer": "Fee answer", "keywords": ["fees"]}]}))
+    catalog = TopicCatalog.load(str(path))
+    assert len(catalog) == 1 and catalog.find("what are your fees").answer == "Fee answer"
+    assert catalog.topics[0].examples == ["fees"]
+    assert len(TopicCatalog.load(str(tmp_path / "missing.json"))) == 0
+    assert catalog.route(np.ones((2, 3), dtype=np.float32)) == [None, None]  # No encoder